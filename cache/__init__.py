@@ -0,0 +1,8 @@
+from .backend import CacheBackend
+from .memory import MemoryCache
+from .response_cache import ResponseCache, create_backend
+from .shared import SharedCache
+from .tags import page_tags, write_tags
+
+# the response cache of this process, configured by rest._response_cache
+response_cache = ResponseCache()
@@ -0,0 +1,59 @@
+"""
+Interface of the Cache Backends
+"""
+
+
+class CacheBackend:
+    """Stores response bodies with a TTL and tags, entries are removed by their tags.
+
+    A backend keeps its size under max_bytes by evicting the least recently used entries.
+    """
+
+    name = None
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=60):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+    @property
+    def generation(self):
+        """int: changes with every invalidation, a response computed before an invalidation is not stored"""
+        raise NotImplementedError
+
+    def configure(self, max_bytes=None, ttl=None):
+        if max_bytes is not None: self.max_bytes = max_bytes
+        if ttl is not None: self.ttl = ttl
+
+    def get(self, key):
+        """Returns (body, mimetype) of a cached response, None if there is none or it has expired."""
+        raise NotImplementedError
+
+    def set(self, key, body: bytes, mimetype: str, tags=(), ttl=None, generation=None):
+        """Stores a response body, bodies larger than a quarter of the memory cap are not stored.
+
+        Args:
+            key (str): key of the response
+            body (bytes): body of the response
+            mimetype (str): mimetype of the response
+            tags (list, optional): tags of the response (see cache.tags). Defaults to ().
+            ttl (float, optional): seconds until the entry expires, the default TTL if None.
+                Defaults to None.
+            generation (int, optional): the generation when the response was computed, it is
+                not stored if there has been an invalidation since then. Defaults to None.
+        """
+        raise NotImplementedError
+
+    def invalidate(self, tags):
+        """Removes all entries with one of the tags.
+
+        Returns:
+            int: number of removed entries
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        """Returns the hit/miss counters and the size of the cache."""
+        raise NotImplementedError
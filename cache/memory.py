@@ -0,0 +1,110 @@
+"""
+In-process Cache Backend
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from .backend import CacheBackend
+
+
+class MemoryCache(CacheBackend):
+    """LRU cache of response bodies with a memory cap, a TTL per entry and tags.
+
+    The cache is per process, other workers keep their entries until they expire.
+    """
+
+    name = "memory"
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=60):
+        super().__init__(max_bytes, ttl)
+        # key -> (expires, body, mimetype, tags), least recently used first
+        self._entries = OrderedDict()
+        # tag -> keys of the entries with the tag
+        self._tags = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "invalidations": 0}
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def configure(self, max_bytes=None, ttl=None):
+        with self._lock:
+            super().configure(max_bytes, ttl)
+            self._evict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return entry[1], entry[2]
+
+    def set(self, key, body: bytes, mimetype: str, tags=(), ttl=None, generation=None):
+        if len(body) > self.max_bytes // 4:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            expires = time.monotonic() + (ttl if ttl is not None else self.ttl)
+            self._entries[key] = (expires, body, mimetype, tuple(tags))
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            self._size += self._entry_size(key, body)
+            self.counters["stores"] += 1
+            self._evict()
+
+    def invalidate(self, tags):
+        with self._lock:
+            keys = set()
+            for tag in tags:
+                keys |= self._tags.get(tag, set())
+            for key in keys:
+                self._remove(key)
+            self._generation += 1
+            self.counters["invalidations"] += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._size = 0
+            self._generation += 1
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "entries": len(self._entries), "bytes": self._size,
+                    "max_bytes": self.max_bytes, "ttl": self.ttl}
+
+    def _evict(self):
+        # least recently used entries first
+        while self._size > self.max_bytes and self._entries:
+            self._remove(next(iter(self._entries)))
+            self.counters["evictions"] += 1
+
+    def _remove(self, key):
+        _, body, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+        self._size -= self._entry_size(key, body)
+
+    @staticmethod
+    def _entry_size(key, body):
+        return len(body) + len(key)
@@ -0,0 +1,77 @@
+"""
+Cache of Responses
+"""
+
+import os
+import tempfile
+
+from .memory import MemoryCache
+from .shared import SharedCache
+
+
+class ResponseCache:
+    """Cache of response bodies with tags, stored in a backend (see cache.backend).
+
+    Every entry is stored with tags (e.g. "pc-clan-<oid>"), a write invalidates all
+    entries with one of the tags it affects (see logic.data_state.data_changed).
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or MemoryCache()
+        self.enabled = True
+
+    @property
+    def generation(self):
+        return self.backend.generation
+
+    @property
+    def max_bytes(self):
+        return self.backend.max_bytes
+
+    def configure(self, backend=None, enabled=None):
+        if backend is not None: self.backend = backend
+        if enabled is not None: self.enabled = enabled
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def set(self, key, body: bytes, mimetype: str, tags=(), ttl=None, generation=None):
+        if self.enabled:
+            self.backend.set(key, body, mimetype, tags=tags, ttl=ttl, generation=generation)
+
+    def invalidate(self, tags):
+        return self.backend.invalidate(tags)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return {**self.backend.stats(), "backend": self.backend.name, "enabled": self.enabled}
+
+
+def create_backend(name="memory", path=None, max_bytes=None, ttl=None):
+    """Creates a cache backend.
+
+    Args:
+        name (str, optional): "memory" (per process) or "shared" (all processes of the host).
+            Defaults to "memory".
+        path (str, optional): file of the shared backend, a file in the temporary directory
+            if None. Defaults to None.
+        max_bytes (int, optional): memory cap, the default of the backend if None. Defaults to None.
+        ttl (float, optional): default TTL in seconds, the default of the backend if None.
+            Defaults to None.
+
+    Raises:
+        ValueError: unknown backend
+
+    Returns:
+        CacheBackend: the backend
+    """
+    if name == "memory":
+        backend = MemoryCache()
+    elif name == "shared":
+        backend = SharedCache(path or os.path.join(tempfile.gettempdir(), "helo-response-cache.sqlite3"))
+    else:
+        raise ValueError(f"unknown cache backend: {name}")
+    backend.configure(max_bytes=max_bytes, ttl=ttl)
+    return backend
@@ -0,0 +1,151 @@
+"""
+Cache Backend Shared by the Workers of a Host
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from .backend import CacheBackend
+
+# the last use of an entry is only written if it is older, so that hits rarely write
+USED_RESOLUTION = 1.0
+
+
+class SharedCache(CacheBackend):
+    """LRU cache of response bodies in a SQLite file that all worker processes of a host open.
+
+    An entry stored by one worker is served by all of them, and an invalidation removes the
+    entries for all of them. The hit/miss counters are those of this process.
+    """
+
+    name = "shared"
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, ttl=60):
+        super().__init__(max_bytes, ttl)
+        self.path = path
+        self.counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "invalidations": 0}
+        self._counters_lock = threading.Lock()
+        # a connection per thread and process, connections must not be shared with forked workers
+        self._local = threading.local()
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, expires REAL, size INTEGER,
+                                                    used REAL, mimetype TEXT, body BLOB);
+                CREATE INDEX IF NOT EXISTS entries_used ON entries (used, size);
+                CREATE INDEX IF NOT EXISTS entries_expires ON entries (expires);
+                CREATE TABLE IF NOT EXISTS tags (tag TEXT, key TEXT, PRIMARY KEY (tag, key));
+                CREATE INDEX IF NOT EXISTS tags_key ON tags (key);
+                CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER);
+                INSERT OR IGNORE INTO meta VALUES ('generation', 0);
+            """)
+        finally:
+            db.close()
+
+    @property
+    def generation(self):
+        return self._generation(self._connect())
+
+    def get(self, key):
+        db = self._connect()
+        now = time.time()
+        row = db.execute("SELECT expires, used, mimetype, body FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None or row[0] <= now:
+            self._count("misses")
+            return None
+        if now - row[1] > USED_RESOLUTION:
+            db.execute("UPDATE entries SET used = ? WHERE key = ?", (now, key))
+        self._count("hits")
+        return bytes(row[3]), row[2]
+
+    def set(self, key, body: bytes, mimetype: str, tags=(), ttl=None, generation=None):
+        if len(body) > self.max_bytes // 4:
+            return
+        now = time.time()
+        with self._transaction() as db:
+            if generation is not None and generation != self._generation(db):
+                return
+            self._remove(db, [key])
+            db.execute("INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                       (key, now + (ttl if ttl is not None else self.ttl), len(body) + len(key), now,
+                        mimetype, body))
+            db.executemany("INSERT OR IGNORE INTO tags VALUES (?, ?)", [(tag, key) for tag in tags])
+            self._evict(db, now)
+        self._count("stores")
+
+    def invalidate(self, tags):
+        with self._transaction() as db:
+            keys = set()
+            for tag in tags:
+                keys.update(key for key, in db.execute("SELECT key FROM tags WHERE tag = ?", (tag,)))
+            self._remove(db, keys)
+            db.execute("UPDATE meta SET value = value + 1 WHERE name = 'generation'")
+        self._count("invalidations", len(keys))
+        return len(keys)
+
+    def clear(self):
+        with self._transaction() as db:
+            db.execute("DELETE FROM entries")
+            db.execute("DELETE FROM tags")
+            db.execute("UPDATE meta SET value = value + 1 WHERE name = 'generation'")
+
+    def stats(self):
+        entries, size = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        with self._counters_lock:
+            counters = dict(self.counters)
+        return {**counters, "entries": entries, "bytes": size, "max_bytes": self.max_bytes,
+                "ttl": self.ttl, "path": self.path}
+
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+    @contextmanager
+    def _transaction(self):
+        db = self._connect()
+        # takes the write lock at the start, so that the checks and the writes are atomic
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def _evict(self, db, now):
+        # expired entries first, then the least recently used ones
+        expired = [key for key, in db.execute("SELECT key FROM entries WHERE expires <= ?", (now,))]
+        self._remove(db, expired)
+        size = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if size <= self.max_bytes:
+            return
+        keys = []
+        for key, entry_size in db.execute("SELECT key, size FROM entries ORDER BY used").fetchall():
+            if size <= self.max_bytes:
+                break
+            keys.append(key)
+            size -= entry_size
+        self._remove(db, keys)
+        self._count("evictions", len(keys))
+
+    @staticmethod
+    def _remove(db, keys):
+        keys = [(key,) for key in keys]
+        db.executemany("DELETE FROM entries WHERE key = ?", keys)
+        db.executemany("DELETE FROM tags WHERE key = ?", keys)
+
+    @staticmethod
+    def _generation(db):
+        return db.execute("SELECT value FROM meta WHERE name = 'generation'").fetchone()[0]
+
+    def _count(self, counter, num=1):
+        with self._counters_lock:
+            self.counters[counter] += num
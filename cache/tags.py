@@ -0,0 +1,42 @@
+"""
+Tags of the Cached Pages
+"""
+
+
+def page_tags(console=False, clan=None, match=None):
+    """Returns the tags of a page: the platform and the clan or match of the page,
+    pages without a clan or match (e.g. listings) are tagged as lists.
+
+    Args:
+        console (bool, optional): page of the console API. Defaults to False.
+        clan (str, optional): oid of the clan of the page. Defaults to None.
+        match (str, optional): match id of the match of the page. Defaults to None.
+
+    Returns:
+        list: tags, also used as surrogate keys
+    """
+    platform = "console" if console else "pc"
+    tags = [platform]
+    if clan is not None: tags.append(f"{platform}-clan-{clan}")
+    if match is not None: tags.append(f"{platform}-match-{match}")
+    if clan is None and match is None: tags.append(f"{platform}-lists")
+    return tags
+
+
+def write_tags(console=False, clans=None, matches=()):
+    """Returns the tags of the pages that a write affects.
+
+    Args:
+        console (bool, optional): write to the console database. Defaults to False.
+        clans (list, optional): oids of the written clans, None if they are unknown,
+            then all pages of the platform are affected. Defaults to None.
+        matches (list, optional): match ids of the written matches. Defaults to ().
+
+    Returns:
+        list: tags
+    """
+    platform = "console" if console else "pc"
+    if clans is None:
+        return [platform]
+    return [f"{platform}-lists"] + [f"{platform}-clan-{c}" for c in clans] \
+        + [f"{platform}-match-{m}" for m in matches]
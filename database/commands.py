@@ -0,0 +1,121 @@
+# database/commands.py
+import click
+from flask.cli import AppGroup
+
+from logic.checkpoints import write_checkpoint
+from logic.clan_stats import rebuild_clan_stats, verify_clan_stats
+from logic.recalculation_jobs import resume_failed_jobs, run_next_job, work
+from models.match import Match
+from models.console.console_match import ConsoleMatch
+from .indexes import backfill_shadow_fields, find_collscans, sync_indexes
+
+
+# flask stats verify|rebuild [--console]
+stats_cli = AppGroup("stats", help="Materialized statistics of the clans.")
+
+
+@stats_cli.command("verify")
+@click.option("--console", is_flag=True, help="Use the console database.")
+def verify_stats(console):
+    """Compares the statistics with the matches, exits with 1 if they differ."""
+    wrong = verify_clan_stats(console=console)
+    if wrong:
+        click.echo(f"statistics of {len(wrong)} clans differ from the matches: {', '.join(wrong)}")
+        raise SystemExit(1)
+    click.echo("statistics match the matches")
+
+
+@stats_cli.command("rebuild")
+@click.option("--console", is_flag=True, help="Use the console database.")
+def rebuild_stats(console):
+    """Rebuilds the statistics of all clans from the matches and verifies them."""
+    wrong = verify_clan_stats(console=console)
+    click.echo(f"statistics of {len(wrong)} clans differed from the matches")
+    num = rebuild_clan_stats(console=console)
+    click.echo(f"rebuilt statistics of {num} clans")
+    wrong = verify_clan_stats(console=console)
+    if wrong:
+        click.echo(f"statistics of {len(wrong)} clans still differ: {', '.join(wrong)}")
+        raise SystemExit(1)
+
+
+# flask indexes sync|check|backfill [--console]
+indexes_cli = AppGroup("indexes", help="Indexes of the collections.")
+
+
+@indexes_cli.command("sync")
+@click.option("--console", is_flag=True, help="Use the console database.")
+@click.option("--drop", is_flag=True, help="Drop indexes that are not declared in the models.")
+def sync(console, drop):
+    """Creates the indexes declared in the models."""
+    for model, diff in sync_indexes(console=console, drop=drop).items():
+        for index in diff["missing"]:
+            click.echo(f"{model}: created {index}")
+        for index in diff["extra"]:
+            click.echo(f"{model}: {'dropped' if drop else 'not declared'} {index}")
+
+
+@indexes_cli.command("check")
+@click.option("--console", is_flag=True, help="Use the console database.")
+def check(console):
+    """Explains the frequent queries, exits with 1 if one scans the whole collection."""
+    collscans = find_collscans(console=console)
+    if collscans:
+        click.echo(f"{len(collscans)} queries scan the whole collection: {'; '.join(collscans)}")
+        raise SystemExit(1)
+    click.echo("all frequent queries use an index")
+
+
+@indexes_cli.command("backfill")
+@click.option("--console", is_flag=True, help="Use the console database.")
+def backfill(console):
+    """Sets the lowercase copies of the filtered fields where they are missing or outdated."""
+    for model, num in backfill_shadow_fields(console=console).items():
+        click.echo(f"{model}: updated {num} documents")
+
+
+# flask recalculations run [--resume]|worker|checkpoint [--console]
+recalculations_cli = AppGroup("recalculations", help="Recalculation jobs.")
+
+
+@recalculations_cli.command("run")
+@click.option("--console", is_flag=True, help="Use the console database.")
+@click.option("--resume", is_flag=True, help="Resume the failed jobs after their committed matches.")
+def run(console, resume):
+    """Runs the queued and interrupted jobs, then exits."""
+    if resume:
+        click.echo(f"resuming {resume_failed_jobs(console=console)} failed jobs")
+    job = run_next_job(console=console)
+    while job is not None:
+        click.echo(f"job {job.id} (match {job.match_id}): {job.status}, {job.replayed} matches replayed, "
+                   f"{job.skipped} skipped"
+                   + (f", {job.error}" if job.error else ""))
+        job = run_next_job(console=console)
+
+
+@recalculations_cli.command("worker")
+def worker():
+    """Runs the jobs of both platforms until it is stopped, e.g. instead of the app processes."""
+    work()
+
+
+@recalculations_cli.command("checkpoint")
+@click.option("--console", is_flag=True, help="Use the console database.")
+def checkpoint(console):
+    """Writes a rating checkpoint as of the last confirmed match, e.g. before the first
+    recalculation on a long history."""
+    match_obj = Match if not console else ConsoleMatch
+    match = match_obj.objects(score_posted=True).order_by("-date").first()
+    if match is None:
+        click.echo("no confirmed matches")
+        return
+    if write_checkpoint(match, console=console) is None:
+        click.echo(f"checkpoint as of match {match.match_id} exists")
+    else:
+        click.echo(f"wrote checkpoint as of match {match.match_id}")
+
+
+def initialize_commands(app):
+    app.cli.add_command(stats_cli)
+    app.cli.add_command(indexes_cli)
+    app.cli.add_command(recalculations_cli)
@@ -1,4 +1,8 @@
 # database/db.py
+import json
+
+from bson import ObjectId, json_util
+from bson.json_util import LEGACY_JSON_OPTIONS
 from flask_mongoengine import MongoEngine
 from mongoengine.queryset import QuerySet
 
@@ -8,9 +12,56 @@ def initialize_db(app):
     db.init_app(app)
 
 
+class MongoJSONEncoder(json.JSONEncoder):
+    # same output as bson's json_util with LEGACY_JSON_OPTIONS (the format of QuerySet.to_json()),
+    # but only the BSON types are converted in python, everything else is left to the C encoder
+    def default(self, o):
+        if isinstance(o, ObjectId):
+            return {"$oid": str(o)}
+        return json_util.default(o, json_options=LEGACY_JSON_OPTIONS)
+
+
 class CustomQuerySet(QuerySet):
 
+    def to_json(self, *args, **kwargs):
+        # raw documents (with the projection of only()) and one encoder, no Documents are built
+        if args or kwargs:
+            return super().to_json(*args, **kwargs)
+        return json.dumps(list(exclude_shadow_fields(self).as_pymongo()), cls=MongoJSONEncoder)
+
     def to_json_serializable(self):
-        # check if a document in the QuerySet has the method "to_dict"
-        # if not return the default document
-        return [doc.to_dict() if hasattr(doc, "to_dict") else doc for doc in self]
+        # the raw documents as they would be returned by to_json()
+        return json.loads(self.to_json())
+
+
+# documents can declare shadow_fields = {field: lowercase copy of the field}, the copies
+# allow case insensitive prefix and exact filters that can use an index (unlike icontains)
+def set_shadow_fields(document):
+    # in clean(), so on every save()
+    for field, shadow in document.shadow_fields.items():
+        value = getattr(document, field)
+        setattr(document, shadow, value.lower() if isinstance(value, str) else None)
+
+
+def shadow_values(document_cls, values: dict):
+    # for update() and update_one(), which do not call clean(): the copies of the fields in 'values'
+    return {shadow: values[field].lower() if isinstance(values[field], str) else None
+            for field, shadow in document_cls.shadow_fields.items() if field in values}
+
+
+# the copies are not part of the API, the raw serialization paths (responses and exports) exclude them
+def exclude_shadow_fields(queryset):
+    shadow_fields = getattr(queryset._document, "shadow_fields", None)
+    return queryset.exclude(*shadow_fields.values()) if shadow_fields else queryset
+
+
+def shadow_db_fields(document_cls):
+    return [document_cls._fields[shadow].db_field for shadow in getattr(document_cls, "shadow_fields", {}).values()]
+
+
+def document_to_json(document):
+    # Document.to_json() without the copies
+    son = document.to_mongo()
+    for field in shadow_db_fields(type(document)):
+        son.pop(field, None)
+    return json.dumps(son.to_dict(), cls=MongoJSONEncoder)
@@ -0,0 +1,161 @@
+# database/indexes.py
+from datetime import datetime
+
+from mongoengine.queryset.visitor import Q
+from pymongo import UpdateOne
+
+from models.clan import Clan
+from models.clan_stats import ClanStats
+from models.data_state import DataState
+from models.lease import Lease
+from models.match import Match
+from models.rating_checkpoint import RatingCheckpoint
+from models.recalculation_job import RecalculationJob
+from models.score import Score
+from models.user import User
+from models.console.console_clan import ConsoleClan
+from models.console.console_clan_stats import ConsoleClanStats
+from models.console.console_data_state import ConsoleDataState
+from models.console.console_lease import ConsoleLease
+from models.console.console_match import ConsoleMatch
+from models.console.console_rating_checkpoint import ConsoleRatingCheckpoint
+from models.console.console_recalculation_job import ConsoleRecalculationJob
+from models.console.console_score import ConsoleScore
+
+
+# the indexes are declared in the models' meta
+def get_models(console=False):
+    if not console:
+        return [Clan, ClanStats, DataState, Lease, Match, RatingCheckpoint, RecalculationJob, Score, User]
+    return [ConsoleClan, ConsoleClanStats, ConsoleDataState, ConsoleLease, ConsoleMatch, ConsoleRatingCheckpoint,
+            ConsoleRecalculationJob, ConsoleScore]
+
+
+def sync_indexes(console=False, drop=False):
+    """Creates the declared indexes of all models.
+
+    Args:
+        console (bool, optional): console database. Defaults to False.
+        drop (bool, optional): also drop indexes that are not declared. Defaults to False.
+
+    Returns:
+        dict: model name -> {"missing": created indexes, "extra": undeclared indexes}
+    """
+    report = {}
+    for model in get_models(console):
+        diff = model.compare_indexes()
+        model.ensure_indexes()
+        if drop:
+            collection = model._get_collection()
+            for name, info in collection.index_information().items():
+                if name != "_id_" and _index_key(info) in diff["extra"]:
+                    collection.drop_index(name)
+        report[model.__name__] = diff
+    return report
+
+
+def backfill_shadow_fields(console=False, batch_size=1000):
+    """Sets the lowercase copies of the documents that have been written without them
+    (e.g. before the copies were introduced).
+
+    Args:
+        console (bool, optional): console database. Defaults to False.
+        batch_size (int, optional): documents per bulk write. Defaults to 1000.
+
+    Returns:
+        dict: model name -> number of updated documents
+    """
+    report = {}
+    for model in get_models(console):
+        shadow_fields = getattr(model, "shadow_fields", None)
+        if not shadow_fields:
+            continue
+        db_fields = {model._fields[f].db_field: model._fields[s].db_field for f, s in shadow_fields.items()}
+        collection = model._get_collection()
+        ops, num = [], 0
+        for doc in collection.find({}, {**{f: 1 for f in db_fields}, **{s: 1 for s in db_fields.values()}}):
+            values = {s: doc[f].lower() if isinstance(doc.get(f), str) else None for f, s in db_fields.items()}
+            if any(doc.get(s) != v for s, v in values.items()):
+                ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": values}))
+            if len(ops) == batch_size:
+                num += collection.bulk_write(ops, ordered=False).modified_count
+                ops = []
+        if ops:
+            num += collection.bulk_write(ops, ordered=False).modified_count
+        report[model.__name__] = num
+    return report
+
+
+def _index_key(info):
+    # the key of an existing index like Document.compare_indexes() lists it
+    if "_fts" in info["key"][0]:
+        return [(key, info["key"][0][1]) for key in info.get("weights").keys()]
+    return info["key"]
+
+
+def get_hot_queries(console=False):
+    """The filters of the frequent queries, the values do not matter for the plans.
+
+    Returns:
+        list: (description, QuerySet) tuples
+    """
+    if not console:
+        clan_obj, match_obj, score_obj, stats_obj = Clan, Match, Score, ClanStats
+        checkpoint_obj = RatingCheckpoint
+    else:
+        clan_obj, match_obj, score_obj, stats_obj = ConsoleClan, ConsoleMatch, ConsoleScore, ConsoleClanStats
+        checkpoint_obj = ConsoleRatingCheckpoint
+    clan_id, match_id, date = "000000000000000000000000", "match-id", datetime(2022, 1, 1)
+    of_clan = Q(clans1_ids=clan_id) | Q(clans2_ids=clan_id)
+
+    queries = [
+        ("matches of a clan (statistics)", match_obj.objects(of_clan & Q(map__iexact="foy"))),
+        ("posted matches of a clan, newest first (performance rating)",
+         match_obj.objects(of_clan & Q(score_posted=True)).order_by("-date")),
+        ("matches on or after a date (recalculation)",
+         match_obj.objects(Q(date__gte=date) & Q(match_id__ne=match_id)).order_by("+date", "+id")),
+        ("match by match id", match_obj.objects(match_id=match_id)),
+        ("matches by map prefix", match_obj.objects(map_lower__startswith="fo")),
+        ("matches by event prefix", match_obj.objects(event_lower__startswith="hlc")),
+        ("matches by match id prefix", match_obj.objects(match_id_lower__startswith="stdb")),
+        ("clans by tag prefix", clan_obj.objects(tag_lower__startswith="co")),
+        ("clans by name prefix", clan_obj.objects(name_lower__startswith="corvus")),
+        ("Score objects of a match", score_obj.objects(Q(match_id=match_id) & Q(clan__in=[clan_id]))),
+        ("Score object by number of matches", score_obj.objects(Q(clan=clan_id) & Q(num_matches=1))),
+        ("last Score object before a match",
+         score_obj.objects(Q(clan=clan_id) & Q(_created_at__lt=date) & Q(match_id__ne=match_id))
+         .order_by("-_created_at", "-num_matches")),
+        ("score history of a clan",
+         score_obj.objects(Q(clan=clan_id) & Q(_created_at__gte=date)).order_by("+_created_at")),
+        ("Score objects in a date range (export)", score_obj.objects(_created_at__gte=date).order_by("+id")),
+        ("Score objects of clans since a checkpoint (recalculation)",
+         score_obj.objects(Q(clan__in=[clan_id]) & Q(_created_at__gt=date) & Q(_created_at__lt=date))),
+        ("nearest checkpoint before a match (recalculation)",
+         checkpoint_obj.objects(date__lt=date).order_by("-date")),
+        ("statistics of a clan", stats_obj.objects(clan=clan_id)),
+    ]
+    if not console:
+        queries.append(("clan of a Discord role", clan_obj.objects(role_id="0")))
+    return queries
+
+
+def find_collscans(console=False):
+    """Explains the frequent queries.
+
+    Args:
+        console (bool, optional): console database. Defaults to False.
+
+    Returns:
+        list: descriptions of the queries whose winning plan scans the whole collection
+    """
+    return [description for description, queryset in get_hot_queries(console)
+            if _has_stage(queryset.explain()["queryPlanner"]["winningPlan"], "COLLSCAN")]
+
+
+def _has_stage(plan, stage):
+    # plans are trees of stages with 'inputStage' or 'inputStages' (e.g. $or),
+    # newer servers wrap the query plan of the classic engine in 'queryPlan'
+    if plan.get("stage") == stage:
+        return True
+    children = plan.get("inputStages", []) + [plan[k] for k in ("inputStage", "queryPlan") if k in plan]
+    return any(_has_stage(child, stage) for child in children)
@@ -1,2 +1,4 @@
 #!/bin/sh
-gunicorn helo-server:app -b 0.0.0.0:5000
\ No newline at end of file
+# one process runs the recalculation jobs, the app processes do not (RECALCULATION_WORKER)
+FLASK_APP=helo-server.py flask recalculations worker &
+exec gunicorn helo-server:app -b 0.0.0.0:5000
@@ -9,7 +9,11 @@ from flask_jwt_extended import JWTManager
 from flask_restful import Api
 
 from database._db import initialize_db
+from database.commands import initialize_commands
+from logic.recalculation_jobs import start_worker
 from discord.auth import initialize_discord_auth
+from rest._conditional import initialize_conditional_requests
+from rest._response_cache import initialize_response_cache
 from rest._routes import initialize_routes
 
 # init components
@@ -50,13 +54,30 @@ app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY")
 app.config["DISCORD_REPORT_MATCH_WEBHOOK"] = os.environ.get(
     "DISCORD_REPORT_MATCH_WEBHOOK"
 )
+# token for the export endpoints, besides admin JWTs
+app.config["EXPORT_TOKEN"] = os.environ.get("EXPORT_TOKEN")
 app.config["IS_CONSOLE_API"] = os.environ.get("IS_CONSOLE_API") == "true"
+# response cache of the read endpoints, per process ("memory") or shared by the workers of the host ("shared")
+app.config["RESPONSE_CACHE_BACKEND"] = os.environ.get("RESPONSE_CACHE_BACKEND", "memory")
+app.config["RESPONSE_CACHE_PATH"] = os.environ.get("RESPONSE_CACHE_PATH")
+app.config["RESPONSE_CACHE_ENABLED"] = os.environ.get("RESPONSE_CACHE_ENABLED", "true") == "true"
+app.config["RESPONSE_CACHE_MAX_BYTES"] = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+app.config["RESPONSE_CACHE_TTL"] = int(os.environ.get("RESPONSE_CACHE_TTL", 60))
+# run the recalculation jobs with 'flask recalculations worker', or (if true) in a thread of every
+# app process, e.g. of a single development server
+app.config["RECALCULATION_WORKER"] = os.environ.get("RECALCULATION_WORKER", "false") == "true"
 # needs to be true for custom error messagess
 app.config["PROPAGATE_EXCEPTIONS"] = True
 
 initialize_db(app)
 discord = initialize_discord_auth(app)
 initialize_routes(Api(app), discord)
+initialize_conditional_requests(app)
+initialize_response_cache(app)
+initialize_commands(app)
+if app.config["RECALCULATION_WORKER"]:
+    # in every worker process, threads do not survive the fork of a preloaded app
+    app.before_first_request(start_worker)
 
 bcrypt = Bcrypt(app)
 jwt = JWTManager(app)
@@ -11,15 +11,30 @@ from models.score import Score
 from models.console.console_clan import ConsoleClan
 from models.console.console_match import ConsoleMatch
 from models.console.console_score import ConsoleScore
+from .clan_cache import get_clan_cache
 
-def get_clan_objects(match):
-    if isinstance(match, Match):
-        clan_obj = Clan
-    else:
-        clan_obj = ConsoleClan
-    clans1 = [clan_obj.objects.get(id=oid) for oid in match.clans1_ids]
-    clans2 = [clan_obj.objects.get(id=oid) for oid in match.clans2_ids]
-    return clans1, clans2
+def get_clan_objects(match, max_age=None):
+    clans = get_clans(match.clans1_ids + match.clans2_ids, console=not isinstance(match, Match), max_age=max_age)
+    return clans[:len(match.clans1_ids)], clans[len(match.clans1_ids):]
+
+
+def get_clans(clan_ids: list, console=False, max_age=None):
+    """Returns the Clan objects for a list of ids from the clan cache.
+
+    Args:
+        clan_ids (list): ids of the clans, may contain duplicates
+        console (bool, optional): console database. Defaults to False.
+        max_age (float, optional): seconds since the clan cache has last checked for writes
+            of other processes, see logic.clan_cache. Defaults to None.
+
+    Raises:
+        DoesNotExist: at least one of the clans does not exist, all missing ids
+                      are listed in the message
+
+    Returns:
+        list: Clan objects in the order of the given ids
+    """
+    return get_clan_cache(console).get_many(clan_ids, max_age=max_age)
 
 
 def get_by_clan_id(match, clan_id: str):
@@ -34,36 +49,89 @@ def get_by_clan_id(match, clan_id: str):
     """
     if isinstance(match, Match):
         score_obj = Score
-        match_obj = Match
-        console = False
     else:
         score_obj = ConsoleScore
-        match_obj = ConsoleMatch
-        console = True
     try:
         return score_obj.objects.get(Q(match_id=match.match_id) & Q(clan=clan_id))
     # if the match haven't been confirmed, there won't be a matching Score object
-    # in this case, find the last (before the given one) match by date
+    # in this case, take the last Score object before the given match
     except DoesNotExist:
-        matches = []
-        for m in match_obj.objects(Q(date__lte=match.date) & (Q(clans1_ids__in=[clan_id]) | (Q(clans2_ids__in=[clan_id])))):
-            # discard the match itself, but we need 'lte' in case there is
-            # another match on this day
-            if m.match_id == match.match_id:
-                continue
+        return get_score_before(match, clan_id)
+
+
+def get_score_before(match, clan_id: str, inclusive=True):
+    """Returns the last Score object of a clan before a match, the match itself is ignored.
+    The scores are ordered by the date of their match (the creation date of the
+    Score object), matches on the same date by the number of matches.
+
+    Args:
+        match (Match): Match object
+        clan_id (str): id of a clan
+        inclusive (bool, optional): include other matches on the same date. Defaults to True.
+
+    Returns:
+        Score: last Score before the match, a DefaultScore if there is none
+    """
+    console = not isinstance(match, Match)
+    score_obj = Score if not console else ConsoleScore
+    date_filter = Q(_created_at__lte=match.date) if inclusive else Q(_created_at__lt=match.date)
+    doc = score_obj.objects(Q(clan=clan_id) & date_filter & Q(match_id__ne=match.match_id))\
+        .order_by("-_created_at", "-num_matches").only("clan", "num_matches", "match_id", "score", "_created_at")\
+        .as_pymongo().first()
+    if doc is None:
+        return score_obj(clan_id, 0, "DefaultScore", 600 if not console else 1000)
+    return _score_from_son(score_obj, doc)
+
+
+def get_scores_before(pairs, console=False, inclusive=True):
+    """Batch version of get_score_before, fetches the last Score objects for many
+    (clan, match) pairs at once. Pairs with different clans are resolved with one
+    query, every additional pair of the same clan needs another one.
+
+    Args:
+        pairs (list): list of tuples (clan_id, match)
+        console (bool, optional): console database. Defaults to False.
+        inclusive (bool, optional): include other matches on the same date. Defaults to True.
+
+    Returns:
+        dict: (clan_id, match_id) -> last Score before the match, a DefaultScore if there is none
+    """
+    score_obj = Score if not console else ConsoleScore
+    date_op = "$lte" if inclusive else "$lt"
+    # a Score object can be "before" several matches of the same clan,
+    # so every query gets at most one match per clan
+    rounds = []
+    for clan_id, match in pairs:
+        for r in rounds:
+            if clan_id not in r:
+                r[clan_id] = match
+                break
+        else:
+            rounds.append({clan_id: match})
+
+    results = {}
+    for r in rounds:
+        docs = score_obj.objects.aggregate([
+            {"$match": {"$or": [{"clan": clan_id, "_created_at": {date_op: match.date},
+                                 "match_id": {"$ne": match.match_id}} for clan_id, match in r.items()]}},
+            {"$sort": {"clan": 1, "_created_at": -1, "num_matches": -1}},
+            {"$group": {"_id": "$clan", "doc": {"$first": "$$ROOT"}}},
+        ])
+        found = {d["_id"]: d["doc"] for d in docs}
+        for clan_id, match in r.items():
+            if clan_id in found:
+                results[(clan_id, match.match_id)] = _score_from_son(score_obj, found[clan_id])
             else:
-                matches.append(m)
-        # sort matches, latest (before the current) first
-        # e.g. 2022-03-03 -> 2022-03-02 -> ...
-        matches.sort(key=lambda x: x.date, reverse=True)
-        # if there is no match at all, return default score object with 600
-        try:
-            # TODO: BUG: match on same date will result in an endless loop, because
-            # if both matches have no score object in DB, they will return each other over
-            # and over again!!
-            return get_by_clan_id(matches[0], clan_id)
-        except IndexError:
-            return score_obj(clan_id, 0, "DefaultScore", 600 if not console else 1000)
+                results[(clan_id, match.match_id)] = score_obj(clan_id, 0, "DefaultScore",
+                                                               600 if not console else 1000)
+    return results
+
+
+def _score_from_son(score_obj, doc):
+    score = score_obj(doc["clan"], doc["num_matches"], doc["match_id"],
+                      score_obj._fields["score"].to_python(doc["score"]))
+    score._created_at = doc.get("_created_at")
+    return score
 
 
 def get_by_num_matches(clan_id: str, num_matches: int, console=False):
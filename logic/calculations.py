@@ -4,19 +4,82 @@ Score Calculation and Database Interactions
 
 from mongoengine.queryset.visitor import Q
 from datetime import datetime
+from pymongo import UpdateMany, UpdateOne
 
 from logic.helo_functions import get_new_scores, get_coop_scores,\
                             get_new_console_scores, get_console_coop_scores
-from models.match import Match
+from models.clan import Clan
 from models.score import Score
-from models.console.console_match import ConsoleMatch
+from models.console.console_clan import ConsoleClan
 from models.console.console_score import ConsoleScore
+from .checkpoints import scores_written
+from .clan_cache import get_clan_cache
+from .clan_stats import update_clan_stats
+from .data_state import data_changed
 from ._getter import get_clan_objects
 
 
+def get_match_scores(match, scores1, num_matches1, scores2, num_matches2, console=False):
+    """Calculates the new scores of both sides of a match, picking the right
+    HeLO function for the platform and for coop games.
+
+    Args:
+        match (Match): Match or ConsoleMatch object
+        scores1 (list): scores of the clans on side 1 before the match
+        num_matches1 (list): number of matches of the clans on side 1
+        scores2 (list): scores of the clans on side 2 before the match
+        num_matches2 (list): number of matches of the clans on side 2
+        console (bool, optional): use the console calculations. Defaults to False.
+
+    Returns:
+        list, list, str: new scores for side 1 and side 2, possible error
+    """
+    if not console:
+        # check if it is a coop game or a normal game
+        if len(match.clans1_ids) == 1 and len(match.clans2_ids) == 1:
+            score1, score2, err = get_new_scores(scores1[0], scores2[0],
+                                                        match.caps1, match.caps2,
+                                                        num_matches1[0],
+                                                        num_matches2[0],
+                                                        match.factor, match.players)
+            # for compatibility reasons
+            scores1, scores2 = [score1], [score2]
+
+        else:
+            scores1, scores2, err = get_coop_scores(scores1, scores2, match.caps1,
+                                                            match.caps2, match.factor,
+                                                            match.player_dist1,
+                                                            match.player_dist2,
+                                                            match.players,
+                                                            num_matches1=num_matches1,
+                                                            num_matches2=num_matches2)
+
+    else:
+        if len(match.clans1_ids) == 1 and len(match.clans2_ids) == 1:
+            score1, score2, err = get_new_console_scores(scores1[0], scores2[0],
+                                                        match.caps1, match.caps2,
+                                                        num_matches1[0],
+                                                        num_matches2[0],
+                                                        match.factor,
+                                                        **match.get_console_settings())
+            # for compatibility reasons
+            scores1, scores2 = [score1], [score2]
+        else:
+            scores1, scores2, err = get_console_coop_scores(scores1, scores2, match.caps1,
+                                                            match.caps2, match.factor,
+                                                            match.player_dist1,
+                                                            match.player_dist2,
+                                                            num_matches1,
+                                                            num_matches2,
+                                                            **match.get_console_settings())
+
+    return scores1, scores2, err
+
+
 def calc_scores(match, scores1=None, num_matches1=None, scores2=None, num_matches2=None,
                 recalculate=False, console=False):
-        clans1, clans2 = get_clan_objects(match)
+        # the scores are written back, so other processes' clan writes must be known
+        clans1, clans2 = get_clan_objects(match, max_age=0)
         # hier nihct aus clan, sondern letztes Match object (vor diesem nehmen)
         # z.b. über datum
         if scores1 is None and num_matches1 is None and scores2 is None and num_matches2 is None:
@@ -27,50 +90,18 @@ def calc_scores(match, scores1=None, num_matches1=None, scores2=None, num_matche
             # a clan cannot play against itself
             raise RuntimeError("A clan cannot play against itself.")
 
-        if not console:
-            # check if it is a coop game or a normal game
-            if len(match.clans1_ids) == 1 and len(match.clans2_ids) == 1:
-                score1, score2, err = get_new_scores(scores1[0], scores2[0],
-                                                            match.caps1, match.caps2,
-                                                            num_matches1[0],
-                                                            num_matches2[0],
-                                                            match.factor, match.players)
-                # for compatibility reasons
-                scores1, scores2 = [score1], [score2]
-
-            else:
-                scores1, scores2, err = get_coop_scores(scores1, scores2, match.caps1,
-                                                                match.caps2, match.factor,
-                                                                match.player_dist1,
-                                                                match.player_dist2,
-                                                                match.players,
-                                                                num_matches1=num_matches1,
-                                                                num_matches2=num_matches2)
-
-        else:
-            if len(match.clans1_ids) == 1 and len(match.clans2_ids) == 1:
-                score1, score2, err = get_new_console_scores(scores1[0], scores2[0],
-                                                            match.caps1, match.caps2,
-                                                            num_matches1[0],
-                                                            num_matches2[0],
-                                                            match.factor,
-                                                            **match.get_console_settings())
-                # for compatibility reasons
-                scores1, scores2 = [score1], [score2]
-            else:
-                scores1, scores2, err = get_console_coop_scores(scores1, scores2, match.caps1,
-                                                                match.caps2, match.factor,
-                                                                match.player_dist1,
-                                                                match.player_dist2,
-                                                                num_matches1,
-                                                                num_matches2,
-                                                                **match.get_console_settings())
-
+        scores1, scores2, err = get_match_scores(match, scores1, num_matches1, scores2,
+                                                num_matches2, console=console)
 
-        _save_clans_and_scores(match, clans1, clans2, scores1, scores2, num_matches1,
-                                num_matches2, recalculate=recalculate, console=console)
+        saved, counted = _save_clans_and_scores(match, clans1, clans2, scores1, scores2, num_matches1,
+                                                num_matches2, recalculate=recalculate, console=console)
         match.score_posted = True
         match.save()
+        # only clans with a new Score object count the match in their statistics, after the
+        # match has been saved as posted (clans without statistics are built from their matches)
+        update_clan_stats(match, saved, counted, console=console)
+        data_changed("matches", "scores", "clans", console=console,
+                     clans=match.clans1_ids + match.clans2_ids, matches=[match.match_id])
 
         return err
 
@@ -79,48 +110,55 @@ def _save_clans_and_scores(match, clans1, clans2, scores1, scores2, num_matches1
                             num_matches2, recalculate=False, console=False):
         if not console:
             score_obj = Score
-            match_obj = Match
+            clan_obj = Clan
         else:
             score_obj = ConsoleScore
-            match_obj = ConsoleMatch
-        for clan, score, num_matches in list(zip(clans1, scores1, num_matches1)) + list(zip(clans2, scores2, num_matches2)):
-            # get the score object which matches the match_id and the clan (id)
-            score_queryset = score_obj.objects(Q(match_id=match.match_id) & Q(clan=str(clan.id)))
-            # update or insert if it does not exist
-            res = score_queryset.update_one(set__score=score, upsert=True, full_result=True)
-
-            # check if it was an insert or update, this is important for the number of matches
-            if res.raw_result.get("updatedExisting"):
-                clan.update(score=score, last_updated=datetime.now())
+            clan_obj = ConsoleClan
+        entries = list(zip(clans1, scores1, num_matches1)) + list(zip(clans2, scores2, num_matches2))
+        # check which clans already have a Score object for the match, this is important
+        # for the number of matches
+        existing = {doc["clan"]: doc.get("_created_at") for doc in score_obj.objects(Q(match_id=match.match_id)
+                                                              & Q(clan__in=[str(clan.id) for clan, _, _ in entries]))
+                                                .only("clan", "_created_at").as_pymongo()}
+        score_field = score_obj._fields["score"]
+        clan_field = clan_obj._fields["score"]
+        now = datetime.now()
+        score_ops, clan_ops = [], []
+        for clan, score, num_matches in entries:
+            # the score object which matches the match_id and the clan (id)
+            score_filter = {"match_id": match.match_id, "clan": str(clan.id)}
+            clan_update = {"$set": {"score": clan_field.to_mongo(score), "last_updated": now}}
+
+            if str(clan.id) in existing:
+                score_ops.append(UpdateOne(score_filter, {"$set": {"score": score_field.to_mongo(score)}}))
 
             else:
                 # TODO: BUG, multiple recalculations lead to a higher num_matches
-                clan.update(score=score, last_updated=datetime.now(), inc__num_matches=1)
-                # set creation time of score object only if the score is new
-                # why is this necessary? update_one does not check whether the given fields match the required formats
-                # TODO: should be equal to the date of match
-                # score_queryset.update_one(set___created_at=datetime.now())
-                score_queryset.update_one(set___created_at=match.date)
-
+                clan_update["$inc"] = {"num_matches": 1}
                 if recalculate:
                     # +1, because the num_matches is before the score has been calculated
-                    # we need to replace the matching score object's num_matches after the calculation
                     num = num_matches + 1
-                    # update all scores after the match
-                    # TODO: make this all more efficient
-                    # all matches after the match that is new (including the match itmatch, because of 'gte' but ...)
-                    matches_after = match_obj.objects(Q(date__gte=match.date))
-                    # all scores after the match that is new
-                    scores_after = [score_obj.objects(Q(clan=str(clan.id)) & Q(match_id=match.match_id)) for match in matches_after]
-                    # update every match that comes after the new match
-                    for score in scores_after:
-                        score.update_one(inc__num_matches=1)
-                    # ... it does not matter, because we are setting the num_matches to the correct value here
-                    score_queryset.update_one(set__num_matches=num)
-
+                    # all later Score objects of the clan move up by one, the creation time of
+                    # a Score object is the date of its match
+                    score_ops.append(UpdateMany({"clan": str(clan.id), "_created_at": {"$gte": match.date},
+                                                 "match_id": {"$ne": match.match_id}},
+                                                {"$inc": {"num_matches": 1}}))
                 else:
-                    clan.reload()
-                    # TODO: BUG, if there is no Score object and we recalculate, the num_matches is set
-                    # to the clan's num_matches, even if this isn't the true num_matches
-                    # edit: bug fixed for the moment with 'if recalculate'
-                    score_queryset.update_one(set__num_matches=clan.num_matches)
+                    # the clan's num_matches including this match
+                    num = clan.num_matches + 1
+                # set creation time of score object only if the score is new
+                score_ops.append(UpdateOne(score_filter,
+                                           {"$set": {"score": score_field.to_mongo(score)},
+                                            "$setOnInsert": {"num_matches": num, "_created_at": match.date}},
+                                           upsert=True))
+            clan_ops.append(UpdateOne({"_id": clan.id}, clan_update))
+
+        score_obj._get_collection().bulk_write(score_ops, ordered=False)
+        # the existing Score objects keep their creation time, e.g. of a match whose date has changed
+        scores_written(min([match.date] + [date for date in existing.values() if date is not None]),
+                       console=console)
+        clan_obj._get_collection().bulk_write(clan_ops, ordered=False)
+        get_clan_cache(console).written([clan.id for clan, _, _ in entries])
+        # the saved scores and the clans that did not have a Score object of the match
+        return {str(clan.id): score_field.to_mongo(score) for clan, score, _ in entries}, \
+            [str(clan.id) for clan, _, _ in entries if str(clan.id) not in existing]
@@ -0,0 +1,146 @@
+"""
+Rating Checkpoints for the Recalculations
+"""
+
+from models.match import Match
+from models.rating_checkpoint import RatingCheckpoint
+from models.score import Score
+from models.console.console_match import ConsoleMatch
+from models.console.console_rating_checkpoint import ConsoleRatingCheckpoint
+from models.console.console_score import ConsoleScore
+from ._getter import get_scores_before, _score_from_son
+
+# confirmed matches between two checkpoints
+CHECKPOINT_EVERY = 100
+# number of checkpoints that are kept, older ones are deleted
+KEEP_CHECKPOINTS = 10
+
+_SCORE_FIELDS = ("clan", "num_matches", "score", "match_id", "_created_at")
+
+
+def get_scores_before_match(clan_ids: list, match, console=False):
+    """Returns the last Score object of every clan before a match, like
+    get_scores_before(inclusive=False), but starting from the nearest checkpoint before the
+    match, so that only the Score objects since the checkpoint are read.
+
+    Args:
+        clan_ids (list): ids of the clans
+        match (Match): Match or ConsoleMatch object
+        console (bool, optional): console database. Defaults to False.
+
+    Returns:
+        dict: (clan_id, match_id) -> last Score before the match, a DefaultScore if there is none
+    """
+    checkpoint_obj = RatingCheckpoint if not console else ConsoleRatingCheckpoint
+    score_obj = Score if not console else ConsoleScore
+    checkpoint = checkpoint_obj.objects(date__lt=match.date).order_by("-date").as_pymongo().first()
+    if checkpoint is None:
+        return get_scores_before([(oid, match) for oid in clan_ids], console=console, inclusive=False)
+
+    entries = {oid: checkpoint["clans"].get(oid) for oid in clan_ids}
+    _merge(entries, score_obj.objects(clan__in=list(clan_ids), _created_at__gt=checkpoint["date"],
+                                      _created_at__lt=match.date, match_id__ne=match.match_id)
+                              .only(*_SCORE_FIELDS).as_pymongo())
+    # the last Score object is the one of the match itself (its date has been changed),
+    # the one before it is not in the checkpoint
+    stale = [oid for oid, entry in entries.items() if entry is not None and entry[2] == match.match_id]
+    results = get_scores_before([(oid, match) for oid in stale], console=console, inclusive=False) if stale else {}
+    for oid, entry in entries.items():
+        if oid in stale:
+            continue
+        if entry is None:
+            results[(oid, match.match_id)] = score_obj(oid, 0, "DefaultScore", 600 if not console else 1000)
+        else:
+            num_matches, score, match_id, created_at = entry
+            results[(oid, match.match_id)] = _score_from_son(score_obj, {
+                "clan": oid, "num_matches": num_matches, "score": score, "match_id": match_id,
+                "_created_at": created_at})
+    return results
+
+
+def write_checkpoint(match, console=False):
+    """Writes a checkpoint with the last Score object of every clan created on or before the
+    date of a match. It is built from the nearest checkpoint before it, if there is one.
+
+    Args:
+        match (Match): Match or ConsoleMatch object
+        console (bool, optional): console database. Defaults to False.
+
+    Returns:
+        RatingCheckpoint: the new checkpoint, None if there already is one for the date
+    """
+    checkpoint_obj = RatingCheckpoint if not console else ConsoleRatingCheckpoint
+    score_obj = Score if not console else ConsoleScore
+    before = checkpoint_obj.objects(date__lte=match.date).order_by("-date").as_pymongo().first()
+    if before is None:
+        clans, docs = {}, score_obj.objects(_created_at__lte=match.date)
+    elif before["date"] == match.date:
+        return None
+    else:
+        clans, docs = dict(before["clans"]), score_obj.objects(_created_at__gt=before["date"],
+                                                               _created_at__lte=match.date)
+    _merge(clans, docs.only(*_SCORE_FIELDS).as_pymongo())
+    checkpoint = checkpoint_obj(match_id=match.match_id, date=match.date, clans=clans).save()
+    prune_checkpoints(console=console)
+    return checkpoint
+
+
+def match_confirmed(console=False):
+    """Writes a checkpoint as of the last confirmed match, if CHECKPOINT_EVERY matches have
+    been confirmed after the last checkpoint. Called after the scores of a match have been
+    calculated.
+
+    Args:
+        console (bool, optional): console database. Defaults to False.
+
+    Returns:
+        RatingCheckpoint: the new checkpoint, None if none has been written
+    """
+    checkpoint_obj = RatingCheckpoint if not console else ConsoleRatingCheckpoint
+    match_obj = Match if not console else ConsoleMatch
+    latest = checkpoint_obj.objects.order_by("-date").only("date").as_pymongo().first()
+    posted = match_obj.objects(score_posted=True)
+    if latest is not None:
+        posted = posted.filter(date__gt=latest["date"])
+    if posted.count() < CHECKPOINT_EVERY:
+        return None
+    return write_checkpoint(posted.order_by("-date").first(), console=console)
+
+
+def scores_written(since=None, console=False):
+    """Deletes the checkpoints that are outdated by written Score objects, every path
+    that writes Score objects calls this.
+
+    Args:
+        since (datetime, optional): earliest creation time of the written Score objects,
+            None deletes all checkpoints. Defaults to None.
+        console (bool, optional): console database. Defaults to False.
+    """
+    checkpoint_obj = RatingCheckpoint if not console else ConsoleRatingCheckpoint
+    checkpoints = checkpoint_obj.objects if since is None else checkpoint_obj.objects(date__gte=since)
+    checkpoints.delete()
+
+
+def prune_checkpoints(console=False, keep=None):
+    """Deletes all but the newest checkpoints.
+
+    Args:
+        console (bool, optional): console database. Defaults to False.
+        keep (int, optional): number of checkpoints to keep, KEEP_CHECKPOINTS if None.
+            Defaults to None.
+
+    Returns:
+        int: number of deleted checkpoints
+    """
+    checkpoint_obj = RatingCheckpoint if not console else ConsoleRatingCheckpoint
+    keep = KEEP_CHECKPOINTS if keep is None else keep
+    old = checkpoint_obj.objects.order_by("-date").skip(keep).scalar("id")
+    return checkpoint_obj.objects(id__in=list(old)).delete()
+
+
+def _merge(clans, docs):
+    # keeps the last Score object of every clan, same order as get_scores_before
+    for doc in docs:
+        entry = clans.get(doc["clan"])
+        if entry is None or (doc["_created_at"], doc["num_matches"]) > (entry[3], entry[0]):
+            clans[doc["clan"]] = [doc["num_matches"], doc["score"], doc["match_id"], doc["_created_at"]]
@@ -0,0 +1,168 @@
+"""
+Write-through Cache of the Clans
+"""
+
+import threading
+import time
+
+from bson import ObjectId
+
+from models.clan import Clan
+from models.data_state import DataState
+from models.console.console_clan import ConsoleClan
+from models.console.console_data_state import ConsoleDataState
+
+# seconds between two checks whether another process has written clans
+CHECK_INTERVAL = 1.0
+
+
+class ClanCache:
+    """The clans of a platform indexed by id, tag and role id, loaded on first use.
+
+    The clan writes of this process update the cache right away (see ClanCache.written).
+    The writes of other processes are noticed by the version of the clans collection
+    (see logic.data_state.data_changed), which is checked at most every CHECK_INTERVAL
+    seconds, or on every lookup with max_age=0. Lookups return new Clan objects, so
+    they can be changed without changing the cache.
+    """
+
+    def __init__(self, console=False):
+        self.clan_obj = Clan if not console else ConsoleClan
+        self.state_obj = DataState if not console else ConsoleDataState
+        self._lock = threading.Lock()
+        # oid -> raw document, None until the first lookup
+        self._docs = None
+        self._by_tag = {}
+        self._by_role_id = {}
+        self._version = None
+        self._checked = 0
+
+    def get(self, oid, max_age=None):
+        """Returns a clan by its id.
+
+        Args:
+            oid (str): id of the clan
+            max_age (float, optional): seconds since the last check for writes of other
+                processes, CHECK_INTERVAL if None. Defaults to None.
+
+        Raises:
+            DoesNotExist: the clan does not exist
+
+        Returns:
+            Clan: Clan object
+        """
+        return self.get_many([oid], max_age=max_age)[0]
+
+    def get_many(self, oids: list, max_age=None):
+        """Returns the clans for a list of ids.
+
+        Args:
+            oids (list): ids of the clans, may contain duplicates
+            max_age (float, optional): see ClanCache.get. Defaults to None.
+
+        Raises:
+            DoesNotExist: at least one of the clans does not exist, all missing ids
+                          are listed in the message
+
+        Returns:
+            list: Clan objects in the order of the given ids
+        """
+        oids = [str(oid) for oid in oids]
+        with self._lock:
+            self._refresh(max_age)
+            docs = [self._docs.get(oid) for oid in oids]
+            if None in docs:
+                # e.g. written without data_changed, only unknown ids cost a query
+                self._load([oid for oid, doc in zip(oids, docs) if doc is None])
+                self._index()
+                docs = [self._docs.get(oid) for oid in oids]
+        missing = [oid for oid, doc in dict(zip(oids, docs)).items() if doc is None]
+        if missing:
+            raise self.clan_obj.DoesNotExist(f"clans not found: {', '.join(missing)}")
+        return [self.clan_obj._from_son(doc) for doc in docs]
+
+    def by_tag(self, tag: str, max_age=None):
+        """Returns a clan by its tag, see ClanCache.get."""
+        with self._lock:
+            self._refresh(max_age)
+            oid = self._by_tag.get(tag)
+        if oid is None:
+            raise self.clan_obj.DoesNotExist(f"clan not found: {tag}")
+        return self.get(oid, max_age=max_age)
+
+    def by_role_id(self, role_id: str, max_age=None):
+        """Returns a clan by its Discord role id, see ClanCache.get.
+
+        Raises:
+            DoesNotExist: no clan has the role
+            MultipleObjectsReturned: several clans have the role
+        """
+        with self._lock:
+            self._refresh(max_age)
+            oids = self._by_role_id.get(role_id, [])
+        if not oids:
+            raise self.clan_obj.DoesNotExist(f"clan not found by role id: {role_id}")
+        if len(oids) > 1:
+            raise self.clan_obj.MultipleObjectsReturned(f"several clans with the role id: {role_id}")
+        return self.get(oids[0], max_age=max_age)
+
+    def written(self, oids: list):
+        """Reloads clans after this process has written them, deleted clans are removed.
+
+        Args:
+            oids (list): ids of the written clans
+        """
+        with self._lock:
+            if self._docs is not None:
+                self._load(oids)
+                self._index()
+
+    def clear(self):
+        with self._lock:
+            self._docs = None
+
+    def _refresh(self, max_age):
+        max_age = CHECK_INTERVAL if max_age is None else max_age
+        now = time.monotonic()
+        if self._docs is not None and now - self._checked < max_age:
+            return
+        version = self._read_version()
+        if self._docs is None or version != self._version:
+            # the version is read first, a write while loading is noticed by the next check
+            self._docs = {str(doc["_id"]): doc for doc in self.clan_obj.objects.as_pymongo()}
+            self._version = version
+            self._index()
+        self._checked = now
+
+    def _load(self, oids):
+        oids = {str(oid) for oid in oids if ObjectId.is_valid(str(oid))}
+        docs = {str(doc["_id"]): doc for doc in self.clan_obj.objects(id__in=list(oids)).as_pymongo()}
+        for oid in oids:
+            self._docs.pop(oid, None)
+        self._docs.update(docs)
+
+    def _read_version(self):
+        state = self.state_obj.objects(collection="clans").only("version").as_pymongo().first()
+        return state.get("version", 0) if state is not None else 0
+
+    def _index(self):
+        self._by_tag, self._by_role_id = {}, {}
+        for oid, doc in self._docs.items():
+            self._by_tag[doc.get("tag")] = oid
+            if doc.get("role_id") is not None:
+                self._by_role_id.setdefault(doc["role_id"], []).append(oid)
+
+
+_caches = {False: ClanCache(), True: ClanCache(console=True)}
+
+
+def get_clan_cache(console=False):
+    """Returns the clan cache of a platform.
+
+    Args:
+        console (bool, optional): console database. Defaults to False.
+
+    Returns:
+        ClanCache: the clan cache of this process
+    """
+    return _caches[console]
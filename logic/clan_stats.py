@@ -0,0 +1,218 @@
+"""
+Materialized Statistics of the Clans
+"""
+
+import math
+from datetime import datetime
+
+from mongoengine.queryset.visitor import Q
+from pymongo import DeleteMany, ReplaceOne, UpdateOne
+
+from models.clan_stats import ClanStats
+from models.match import Match
+from models.score import Score
+from models.console.console_clan_stats import ConsoleClanStats
+from models.console.console_match import ConsoleMatch
+from models.console.console_score import ConsoleScore
+
+
+def map_key(map: str):
+    """Returns the key of a map in the statistics, map names are compared case insensitive
+    and must not contain '.' or start with '$' to be used as field names."""
+    return map.lower().replace(".", "\uff0e").replace("$", "\uff04")
+
+
+def get_stats_cell(clan_id: str, map=None, side=None, console=False):
+    """Returns the statistics of a clan, optionally only for one map and/or side.
+
+    Args:
+        clan_id (str): oid of the clan
+        map (str, optional): name of the map. Defaults to None.
+        side (str, optional): Axis or Allies. Defaults to None.
+        console (bool, optional): console database. Defaults to False.
+
+    Returns:
+        dict: cell with total, wins, caps, strength and rated, None if there are no
+        statistics of the clan (yet)
+    """
+    stats_obj = ClanStats if not console else ConsoleClanStats
+    stats = stats_obj.objects(clan=clan_id).as_pymongo().first()
+    if stats is None:
+        return None
+
+    if not map and not side:
+        cell = stats.get("total", {})
+    elif not side:
+        cell = stats.get("maps", {}).get(map_key(map), {})
+    else:
+        cells = stats.get("sides", {}) if not map \
+            else stats.get("maps_sides", {}).get(map_key(map), {})
+        # sides are compared case insensitive, too
+        cell = next((c for s, c in cells.items() if s.lower() == side.lower()), {})
+    return {"total": 0, "wins": 0, "caps": {}, "strength": 0, "rated": 0, **cell}
+
+
+def update_clan_stats(match, scores: dict, clan_ids: list, console=False):
+    """Adds a posted match to the statistics of the given clans with one bulk write. Clans
+    without statistics (e.g. before they have been built) get them from all their posted
+    matches instead, so the match must have been saved as posted.
+
+    Args:
+        match (Match): Match or ConsoleMatch object
+        scores (dict): clan id -> score of the clan's Score object of the match
+        clan_ids (list): clans that have not counted the match yet
+        console (bool, optional): console database. Defaults to False.
+    """
+    stats_obj = ClanStats if not console else ConsoleClanStats
+    incs = {clan_id: inc for clan_id, inc in _increments(match.to_mongo(), scores).items() if clan_id in clan_ids}
+    built = set(stats_obj.objects(clan__in=list(incs)).scalar("clan"))
+    now = datetime.now()
+    # no upsert, a document with only this match would be taken for complete statistics
+    ops = [UpdateOne({"clan": clan_id}, {"$inc": inc, "$set": {"last_updated": now}})
+           for clan_id, inc in incs.items() if clan_id in built]
+    if ops:
+        stats_obj._get_collection().bulk_write(ops, ordered=False)
+    missing = [clan_id for clan_id in incs if clan_id not in built]
+    if missing:
+        rebuild_clan_stats(missing, console=console)
+
+
+def refresh_clan_stats(clan_ids=(), match_ids=(), console=False):
+    """Rebuilds the statistics of clans after a write that changes them and that is not
+    counted incrementally, e.g. an edited or deleted posted match or an edited Score object
+    (the opponents' strength).
+
+    Args:
+        clan_ids (list, optional): ids of the clans. Defaults to ().
+        match_ids (list, optional): the clans of these matches, too. Defaults to ().
+        console (bool, optional): console database. Defaults to False.
+
+    Returns:
+        int: number of clans with statistics that have been rebuilt
+    """
+    match_obj = Match if not console else ConsoleMatch
+    clan_ids = set(clan_ids)
+    if match_ids:
+        for doc in match_obj.objects(match_id__in=list(match_ids)).only("clans1_ids", "clans2_ids").as_pymongo():
+            clan_ids.update(doc["clans1_ids"] + doc["clans2_ids"])
+    if not clan_ids:
+        return 0
+    return rebuild_clan_stats(list(clan_ids), console=console)
+
+
+def build_clan_stats(clan_ids=None, console=False):
+    """Computes the statistics from the posted matches and their Score objects.
+
+    Args:
+        clan_ids (list, optional): only for these clans. Defaults to None, all clans.
+        console (bool, optional): console database. Defaults to False.
+
+    Returns:
+        dict: clan id -> statistics document, clans without posted matches are missing
+    """
+    if not console:
+        match_obj, score_obj = Match, Score
+    else:
+        match_obj, score_obj = ConsoleMatch, ConsoleScore
+
+    filter = Q(score_posted=True)
+    if clan_ids is not None:
+        clan_ids = set(clan_ids)
+        filter &= Q(clans1_ids__in=list(clan_ids)) | Q(clans2_ids__in=list(clan_ids))
+    matches = list(match_obj.objects(filter).only("match_id", "clans1_ids", "clans2_ids", "caps1", "caps2",
+                                                  "map", "side1", "side2").as_pymongo())
+
+    score_filter = Q()
+    if clan_ids is not None:
+        score_filter = Q(match_id__in=[m["match_id"] for m in matches])
+    scores = {}
+    for doc in score_obj.objects(score_filter).only("clan", "match_id", "score").as_pymongo():
+        scores.setdefault(doc["match_id"], {})[doc["clan"]] = doc["score"]
+
+    stats = {}
+    for m in matches:
+        for clan_id, inc in _increments(m, scores.get(m["match_id"], {})).items():
+            if clan_ids is None or clan_id in clan_ids:
+                _apply(stats.setdefault(clan_id, {"clan": clan_id}), inc)
+    return stats
+
+
+def rebuild_clan_stats(clan_ids=None, console=False):
+    """Replaces the statistics with the ones computed from the matches.
+
+    Args:
+        clan_ids (list, optional): only for these clans. Defaults to None, all clans.
+        console (bool, optional): console database. Defaults to False.
+
+    Returns:
+        int: number of clans with statistics that have been rebuilt
+    """
+    stats_obj = ClanStats if not console else ConsoleClanStats
+    stats = build_clan_stats(clan_ids, console=console)
+    now = datetime.now()
+    ops = [ReplaceOne({"clan": clan_id}, {**doc, "last_updated": now}, upsert=True)
+           for clan_id, doc in stats.items()]
+    # clans without posted matches do not have statistics
+    if clan_ids is None:
+        ops.append(DeleteMany({"clan": {"$nin": list(stats)}}))
+    else:
+        ops.append(DeleteMany({"clan": {"$in": [c for c in clan_ids if c not in stats]}}))
+    stats_obj._get_collection().bulk_write(ops, ordered=False)
+    return len(stats)
+
+
+def verify_clan_stats(console=False):
+    """Compares the stored statistics with the ones computed from the matches.
+
+    Args:
+        console (bool, optional): console database. Defaults to False.
+
+    Returns:
+        list: ids of the clans with wrong or missing statistics
+    """
+    stats_obj = ClanStats if not console else ConsoleClanStats
+    expected = build_clan_stats(console=console)
+    stored = {doc["clan"]: doc for doc in stats_obj.objects.exclude("id", "last_updated").as_pymongo()}
+    return sorted(clan_id for clan_id in set(expected) | set(stored)
+                  if not _equal(expected.get(clan_id), stored.get(clan_id)))
+
+
+def _increments(match, scores):
+    # clan id -> {path of a statistic: increment} of one posted match, match is a raw document
+    incs = {}
+    key = map_key(match["map"])
+    for own, opponents, caps, side in ((match["clans1_ids"], match["clans2_ids"], match["caps1"], match.get("side1")),
+                                       (match["clans2_ids"], match["clans1_ids"], match["caps2"], match.get("side2"))):
+        opponent_scores = [scores[c] for c in opponents if c in scores]
+        cells = ["total", f"maps.{key}"]
+        if side:
+            cells += [f"sides.{side}", f"maps_sides.{key}.{side}"]
+        for clan_id in own:
+            inc = incs.setdefault(clan_id, {})
+            for cell in cells:
+                inc[f"{cell}.total"] = 1
+                inc[f"{cell}.wins"] = int(caps >= 3)
+                inc[f"{cell}.caps.{caps}"] = 1
+                if opponent_scores:
+                    inc[f"{cell}.strength"] = sum(opponent_scores) / len(opponent_scores)
+                    inc[f"{cell}.rated"] = 1
+    return incs
+
+
+def _apply(doc, inc):
+    # does what $inc does, but on a dict
+    for path, value in inc.items():
+        *parents, field = path.split(".")
+        d = doc
+        for p in parents:
+            d = d.setdefault(p, {})
+        d[field] = d.get(field, 0) + value
+
+
+def _equal(a, b):
+    # strengths are sums of floats, they may differ in the last digits
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(_equal(a[k], b[k]) for k in a)
+    if isinstance(a, float) or isinstance(b, float):
+        return isinstance(b, (int, float)) and isinstance(a, (int, float)) and math.isclose(a, b, rel_tol=1e-9)
+    return a == b
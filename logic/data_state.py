@@ -0,0 +1,119 @@
+"""
+Modification Times and Data Version of the Collections
+"""
+
+import threading
+import time
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+from cache import response_cache, write_tags
+from models.data_state import DataState
+from models.console.console_data_state import ConsoleDataState
+
+# seconds between two checks whether another process has written
+CHECK_INTERVAL = 1.0
+
+
+class DataVersion:
+    """The data version of a platform in the memory of this process, read on first use.
+
+    The writes of this process make the next lookup read it again (see data_changed),
+    the writes of other processes are noticed by checking it at most every CHECK_INTERVAL
+    seconds, or on every lookup with max_age=0, the way logic.clan_cache.ClanCache does.
+    """
+
+    def __init__(self, console=False):
+        self.state_obj = DataState if not console else ConsoleDataState
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked = 0
+
+    def get(self, max_age=None):
+        """Returns the data version.
+
+        Args:
+            max_age (float, optional): seconds since the last check for writes of other
+                processes, CHECK_INTERVAL if None. Defaults to None.
+
+        Returns:
+            int: number of writes to all collections of the platform
+        """
+        max_age = CHECK_INTERVAL if max_age is None else max_age
+        with self._lock:
+            now = time.monotonic()
+            if self._version is None or now - self._checked >= max_age:
+                self._version = sum(state.get("version", 0)
+                                    for state in self.state_obj.objects.only("version").as_pymongo())
+                self._checked = now
+            return self._version
+
+    def clear(self):
+        with self._lock:
+            self._version = None
+
+
+_versions = {False: DataVersion(), True: DataVersion(console=True)}
+
+
+def get_data_version(console=False):
+    """Returns the data version of a platform.
+
+    Args:
+        console (bool, optional): console database. Defaults to False.
+
+    Returns:
+        DataVersion: the data version of this process
+    """
+    return _versions[console]
+
+
+def data_changed(*collections, console=False, clans=None, matches=()):
+    """Records that documents of the given collections have been written and invalidates
+    the cached pages that the write affects, every write path calls this after its writes.
+
+    Args:
+        *collections (str): names of the collections, "matches", "scores", "clans" or "events"
+        console (bool, optional): console database. Defaults to False.
+        clans (list, optional): oids of the affected clans, None if they are unknown (all
+            pages of the platform are affected). Defaults to None.
+        matches (list, optional): match ids of the affected matches. Defaults to ().
+    """
+    state_obj = DataState if not console else ConsoleDataState
+    now = datetime.utcnow()
+    # $max, concurrent writes must not move the time back
+    ops = [UpdateOne({"collection": c}, {"$max": {"last_modified": now}, "$inc": {"version": 1}}, upsert=True)
+           for c in collections]
+    if ops:
+        state_obj._get_collection().bulk_write(ops, ordered=False)
+        _versions[console].clear()
+    response_cache.invalidate(write_tags(console=console, clans=clans, matches=matches))
+
+
+def last_modified(collection: str, console=False):
+    """Returns when documents of a collection were last written.
+
+    Args:
+        collection (str): name of the collection, e.g. "matches"
+        console (bool, optional): console database. Defaults to False.
+
+    Returns:
+        datetime: naive UTC time, None if no write has been recorded yet
+    """
+    state_obj = DataState if not console else ConsoleDataState
+    state = state_obj.objects(collection=collection).only("last_modified").as_pymongo().first()
+    return state.get("last_modified") if state is not None else None
+
+
+def data_version(console=False, max_age=None):
+    """Returns the data version of a platform, it changes with every recorded write.
+
+    Args:
+        console (bool, optional): console database. Defaults to False.
+        max_age (float, optional): see DataVersion.get. Defaults to None.
+
+    Returns:
+        int: number of writes to all collections of the platform
+    """
+    return _versions[console].get(max_age=max_age)
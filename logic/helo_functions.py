@@ -132,6 +132,91 @@ def get_coop_scores(clan_scores1: list, clan_scores2: list, caps1: int, caps2: i
 
 
 
+def get_win_probs(scores1, scores2):
+    """Calculates the probabilities of winning for many pairs of teams at once,
+    see get_win_prob.
+
+    Args:
+        scores1 (array_like): HeLO scores of the first teams
+        scores2 (array_like): HeLO scores of the second teams
+
+    Returns:
+        ndarray, ndarray: probabilities for the first and the second teams
+    """
+    scores1, scores2 = np.broadcast_arrays(np.asarray(scores1, dtype=float),
+                                           np.asarray(scores2, dtype=float))
+    diff = np.minimum(400, np.abs(scores1 - scores2))
+    # math.erf for the distinct differences only, there aren't many of them
+    diffs, inverse = np.unique(diff, return_inverse=True)
+    erf = np.frompyfunc(math.erf, 1, 1)(diffs / 400).astype(float)
+    better = _round(0.5*(erf + 1), 3)
+    worse = _round(1 - better, 3)
+    better = better[inverse].reshape(diff.shape)
+    worse = worse[inverse].reshape(diff.shape)
+    prob1 = np.where(scores1 > scores2, better, worse)
+    prob2 = np.where(scores1 > scores2, worse, better)
+    return prob1, prob2
+
+
+def get_new_scores_batch(scores1, scores2, caps1, caps2, matches1=0, matches2=0, c=2, number_of_players=50):
+    """Calculates the new HeLO scores for many matches at once, see get_new_scores.
+    All arguments can be arrays of the same length or scalars.
+
+    Args:
+        scores1 (array_like): HeLO scores of the first teams
+        scores2 (array_like): HeLO scores of the second teams
+        caps1 (array_like): strong points captured by the first teams
+        caps2 (array_like): strong points captured by the second teams
+        matches1 (array_like, optional): number of games played (teams 1). Defaults to 0.
+        matches2 (array_like, optional): number of games played (teams 2). Defaults to 0.
+        c (array_like, optional): competitive factors. Defaults to 2.
+        number_of_players (array_like, optional): number of players per team. Defaults to 50.
+
+    Returns:
+        ndarray, ndarray, ndarray: new HeLO scores for teams 1 and teams 2 (nan if
+                                   the calculation failed), mask of the failed calculations
+    """
+    scores1, scores2, caps1, caps2, matches1, matches2, c, number_of_players = np.broadcast_arrays(
+        *[np.asarray(x, dtype=float) for x in (scores1, scores2, caps1, caps2, matches1,
+                                                matches2, c, number_of_players)])
+    err = ~((scores1 > 0) & (scores2 > 0) & (4 < caps1 + caps2) & (caps1 + caps2 <= 5))
+    # determine the "amount factor" by the number of games played
+    a1 = np.where(matches1 > 30, 20, 40)
+    a2 = np.where(matches2 > 30, 20, 40)
+    prob1, prob2 = get_win_probs(np.where(err, 1, scores1), np.where(err, 1, scores2))
+    score1_new = scores1 + a1 * c * (_log(number_of_players/50, a1) + 1) * (caps1 / 5 - prob1)
+    score2_new = scores2 + a2 * c * (_log(number_of_players/50, a2) + 1) * (caps2 / 5 - prob2)
+    return np.where(err, np.nan, np.rint(score1_new)), np.where(err, np.nan, np.rint(score2_new)), err
+
+
+def _log(x, base):
+    """math.log for arrays, math.log and numpy's log can differ in the last digit,
+    which changes the rounding of the scores."""
+    x, base = np.broadcast_arrays(x, base)
+    logs = np.empty(x.shape)
+    # there are only a few distinct bases (amount or K factors)
+    for b in np.unique(base):
+        mask = base == b
+        values, inverse = np.unique(x[mask], return_inverse=True)
+        logs[mask] = np.frompyfunc(lambda v: math.log(v, b) if v > 0 else math.nan, 1, 1)(values)\
+            .astype(float)[inverse.ravel()]
+    return logs
+
+
+def _round(x, ndigits):
+    """round() for arrays, np.round can differ from round() if the value is very
+    close to the middle between two decimals."""
+    shape = np.shape(x)
+    x = np.ravel(x)
+    rounded = np.round(x, ndigits)
+    scaled = x * 10**ndigits
+    close = np.abs(np.abs(scaled - np.floor(scaled)) - 0.5) < 1e-6
+    for i in np.flatnonzero(close):
+        rounded[i] = round(float(x[i]), ndigits)
+    return rounded.reshape(shape)
+
+
+
 #############################################
 #                  CONSOLE                  #
 #############################################
@@ -276,3 +361,53 @@ def get_console_coop_scores(clan_scores1: list, clan_scores2: list, caps1: int,
 
     return clan_scores1, clan_scores2, err
 
+
+def get_new_console_scores_batch(scores1, scores2, caps1, caps2, matches1=0, matches2=0,
+                                 c=1, n1=50, t1=50, n2=50, t2=50, offensive=False):
+    """Calculates the new console HeLO scores for many matches at once, see
+    get_new_console_scores. All arguments can be arrays of the same length or scalars.
+
+    Args:
+        scores1 (array_like): HeLO scores of the first teams
+        scores2 (array_like): HeLO scores of the second teams
+        caps1 (array_like): strong points captured by the first teams
+        caps2 (array_like): strong points captured by the second teams
+        matches1 (array_like, optional): number of games played (teams 1). Defaults to 0.
+        matches2 (array_like, optional): number of games played (teams 2). Defaults to 0.
+        c (array_like, optional): competitive factors. Defaults to 1.
+        n1 (array_like, optional): number of clan players in teams 1. Defaults to 50.
+        t1 (array_like, optional): total number of players in teams 1. Defaults to 50.
+        n2 (array_like, optional): number of clan players in teams 2. Defaults to 50.
+        t2 (array_like, optional): total number of players in teams 2. Defaults to 50.
+        offensive (array_like, optional): offensive mode or warfare. Defaults to False.
+
+    Returns:
+        ndarray, ndarray, ndarray: new HeLO scores for teams 1 and teams 2 (nan if
+                                   the calculation failed), mask of the failed calculations
+    """
+    scores1, scores2, caps1, caps2, matches1, matches2, c, n1, t1, n2, t2 = np.broadcast_arrays(
+        *[np.asarray(x, dtype=float) for x in (scores1, scores2, caps1, caps2, matches1,
+                                                matches2, c, n1, t1, n2, t2)])
+    offensive = np.broadcast_to(np.asarray(offensive, dtype=bool), scores1.shape)
+    err = ~((scores1 > 0) & (scores2 > 0) & (4 < caps1 + caps2) & (caps1 + caps2 <= 5))
+
+    # determine the K factor by the number of games played
+    K1 = np.select([matches1 <= 10, matches1 <= 30], [32, 24], 16)
+    K2 = np.select([matches2 <= 10, matches2 <= 30], [32, 24], 16)
+    # determine offensive mode factor
+    m = np.where(offensive, 0.6, 3)
+
+    prob1, prob2 = get_win_probs(np.where(err, 1, scores1), np.where(err, 1, scores2))
+
+    # in offensive mode side1 must always be the attacker
+    S1 = np.where(offensive, np.where(caps1 <= 4, caps1 * 0.1, 1), caps1 / 5)
+    S2 = np.where(offensive, 1 - S1, caps2 / 5)
+    # team-size factor, losing team-size divided by winning team-size
+    size_f = np.where((~offensive & (S1 < S2)) | (offensive & (S1 < 5)), t1/t2, t2/t1)
+    # enforce friendly multiplier for <75% clan affiliated players
+    c = np.where((n1/t1 < 0.75) | (n2/t2 < 0.75), 0.8, c)
+
+    score1_new = scores1 + K1 * m * c * (_log((n1*t2)/(n2*t1), K1) + size_f) * (S1 - prob1)
+    score2_new = scores2 + K2 * m * c * (_log((n2*t1)/(n1*t2), K2) + size_f) * (S2 - prob2)
+    return (np.where(err, np.nan, _round(np.where(err, 0, score1_new), 2)),
+            np.where(err, np.nan, _round(np.where(err, 0, score2_new), 2)), err)
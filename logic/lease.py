@@ -0,0 +1,106 @@
+"""
+Leases in the Database, one Holder at a Time across all Processes
+"""
+
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+from models.lease import Lease
+from models.console.console_lease import ConsoleLease
+
+# seconds until a lease expires without a heartbeat
+LEASE_TTL = 30
+
+
+class LeaseLost(Exception):
+    """The lease has expired or has been taken over, the holder must stop writing."""
+
+
+class MongoLease:
+    """A lease on a task, held by one process until it is released or expires.
+
+    While the lease is held, a thread extends it every third of its TTL, so it only
+    expires if the holder dies (or cannot reach the database).
+    """
+
+    def __init__(self, name, console=False, purpose=None, ttl=LEASE_TTL):
+        self.lease_obj = Lease if not console else ConsoleLease
+        self.name = name
+        self.purpose = purpose
+        self.ttl = ttl
+        self.owner = f"{os.uname().nodename}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.lost = False
+        self._stop = threading.Event()
+        self._heartbeat = None
+        self._expires = None
+
+    def acquire(self, wait=0):
+        """Takes the lease if it is free or has expired.
+
+        Args:
+            wait (float, optional): seconds to wait for the lease. Defaults to 0.
+
+        Returns:
+            bool: True if the lease is held now
+        """
+        deadline = time.monotonic() + wait
+        while True:
+            now = datetime.utcnow()
+            self._expires = now + timedelta(seconds=self.ttl)
+            try:
+                # an existing lease that has not expired does not match, the upsert then
+                # fails on the unique name
+                self.lease_obj._get_collection().update_one(
+                    {"name": self.name, "expires_at": {"$lt": now}},
+                    {"$set": {"owner": self.owner, "purpose": self.purpose, "expires_at": self._expires}},
+                    upsert=True)
+                break
+            except DuplicateKeyError:
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(0.1)
+        self.lost = False
+        self._stop.clear()
+        self._heartbeat = threading.Thread(target=self._extend, name=f"lease-{self.name}", daemon=True)
+        self._heartbeat.start()
+        return True
+
+    def release(self):
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+            self._heartbeat = None
+        self.lease_obj._get_collection().delete_one({"name": self.name, "owner": self.owner})
+
+    def check(self):
+        """Raises LeaseLost if the lease is no longer held."""
+        if self.lost:
+            raise LeaseLost(f"lease lost: {self.name}")
+
+    def holder(self):
+        """Returns the purpose of the current holder, None if the lease is free."""
+        doc = self.lease_obj._get_collection().find_one(
+            {"name": self.name, "expires_at": {"$gte": datetime.utcnow()}}, {"purpose": 1})
+        return doc.get("purpose") if doc is not None else None
+
+    def _extend(self):
+        while not self._stop.wait(self.ttl / 3):
+            expires = datetime.utcnow() + timedelta(seconds=self.ttl)
+            try:
+                res = self.lease_obj._get_collection().update_one(
+                    {"name": self.name, "owner": self.owner}, {"$set": {"expires_at": expires}})
+            except Exception:
+                # tried again with the next heartbeat, unless the lease has expired by then
+                if datetime.utcnow() >= self._expires:
+                    self.lost = True
+                    return
+                continue
+            if res.matched_count == 0:
+                self.lost = True
+                return
+            self._expires = expires
@@ -0,0 +1,257 @@
+"""
+Recalculations as Background Jobs
+"""
+
+import logging
+import os
+import threading
+from datetime import datetime
+
+from pymongo import ReturnDocument
+
+from models.match import Match
+from models.recalculation_job import RecalculationJob
+from models.console.console_match import ConsoleMatch
+from models.console.console_recalculation_job import ConsoleRecalculationJob
+from .calculations import calc_scores
+from .checkpoints import match_confirmed
+from .lease import LeaseLost, MongoLease
+from .recalculations import Replay
+
+# matches replayed between two commits of a job
+COMMIT_EVERY = 50
+# seconds between two checks for jobs queued by other processes
+POLL_INTERVAL = 5
+# seconds a confirmation waits for another confirmation before it is queued
+CONFIRMATION_WAIT = 2
+
+_wakeup = threading.Event()
+_worker = {"thread": None, "pid": None}
+_worker_lock = threading.Lock()
+
+
+def _lease(console=False, purpose=None):
+    # one lease per platform for everything that writes scores: replays and confirmations
+    return MongoLease("recalculation", console=console, purpose=purpose)
+
+
+def submit_recalculation(match, console=False, requested_by=None):
+    """Queues the recalculation of a match and of the later matches whose scores can change.
+
+    A request is added to the queued recalculation if there is one, it then starts with
+    the earliest requested match. A running recalculation has already loaded its matches,
+    so a request while it runs is queued for the next one.
+
+    Args:
+        match (Match): the match that has been edited (or added afterwards)
+        console (bool, optional): console database. Defaults to False.
+        requested_by (str, optional): identity of the admin. Defaults to None.
+
+    Returns:
+        RecalculationJob: the queued job
+    """
+    job_obj = RecalculationJob if not console else ConsoleRecalculationJob
+    doc = job_obj._get_collection().find_one_and_update(
+        {"kind": "recalculation", "status": "queued"},
+        {"$addToSet": {"requested": match.match_id}},
+        sort=[("created_at", 1)], return_document=ReturnDocument.AFTER)
+    if doc is not None:
+        job = job_obj._from_son(doc)
+    else:
+        job = job_obj(match_id=match.match_id, requested=[match.match_id], requested_by=requested_by).save()
+    _wakeup.set()
+    return job
+
+
+def confirm_match(match, console=False):
+    """Calculates the scores of a confirmed match with calc_scores. While a recalculation
+    runs, the match is saved and its calculation is queued, it is calculated after the
+    recalculation.
+
+    Args:
+        match (Match): the confirmed match
+        console (bool, optional): console database. Defaults to False.
+
+    Raises:
+        RuntimeError: a clan plays against itself
+
+    Returns:
+        str: error of the calculation, None if there was none or it has been queued
+    """
+    lease = _lease(console, purpose="confirmation")
+    # other confirmations are short, a replay is not
+    wait = 0 if lease.holder() == "replay" else CONFIRMATION_WAIT
+    if lease.acquire(wait=wait):
+        try:
+            err = calc_scores(match, console=console)
+            match_confirmed(console=console)
+            return err
+        finally:
+            lease.release()
+    match.save()
+    job_obj = RecalculationJob if not console else ConsoleRecalculationJob
+    job_obj(kind="confirmation", match_id=match.match_id).save()
+    logging.info(f"queued the calculation of match {match.match_id}, a recalculation is running")
+    _wakeup.set()
+    return None
+
+
+def run_next_job(console=False):
+    """Runs the oldest queued job, or resumes an interrupted one. Only the holder of the
+    recalculation lease of the platform runs jobs.
+
+    Args:
+        console (bool, optional): console database. Defaults to False.
+
+    Returns:
+        RecalculationJob: the finished (or failed) job, None if there was none or
+                          another process runs the jobs
+    """
+    job_obj = RecalculationJob if not console else ConsoleRecalculationJob
+    if job_obj.objects(status__in=["queued", "running"]).count() == 0:
+        return None
+    lease = _lease(console, purpose="replay")
+    if not lease.acquire():
+        return None
+    try:
+        # a running job is not run by anyone else while the lease is held, its process has
+        # died or has lost the lease
+        doc = job_obj._get_collection().find_one_and_update(
+            {"status": {"$in": ["queued", "running"]}},
+            {"$set": {"status": "running", "updated_at": datetime.utcnow()}},
+            sort=[("created_at", 1)], return_document=ReturnDocument.AFTER)
+        if doc is None:
+            return None
+        job = job_obj._from_son(doc)
+        run_job(job, lease, console=console)
+        return job
+    finally:
+        lease.release()
+
+
+def resume_failed_jobs(console=False):
+    """Resumes the failed jobs, e.g. after the cause of the error has been fixed. A failed
+    recalculation has already committed some of its matches, it continues after them like
+    an interrupted job, with the same matches.
+
+    Args:
+        console (bool, optional): console database. Defaults to False.
+
+    Returns:
+        int: number of resumed jobs
+    """
+    job_obj = RecalculationJob if not console else ConsoleRecalculationJob
+    # not queued, a queued job takes new requests, but the matches of a started job are fixed
+    num = job_obj.objects(status="failed").update(set__status="running", unset__error=True,
+                                                 unset__finished_at=True, set__updated_at=datetime.utcnow())
+    if num:
+        _wakeup.set()
+    return num
+
+
+def run_job(job, lease, console=False):
+    """Runs a claimed job. The matches of a recalculation are replayed from the earliest
+    requested match, the progress is committed every COMMIT_EVERY matches. A job that has
+    already committed matches continues after them.
+
+    Args:
+        job (RecalculationJob): a claimed job
+        lease (MongoLease): the held recalculation lease
+        console (bool, optional): console database. Defaults to False.
+    """
+    job_qs = type(job).objects(id=job.id)
+    try:
+        if job.kind == "confirmation":
+            _confirm(job, console)
+        else:
+            _replay(job, lease, console)
+        job.status = "done"
+    except LeaseLost:
+        # another process resumes the job after the last commit
+        logging.error(f"recalculation {job.id} stopped, the lease has been lost")
+        return
+    except Exception as e:
+        logging.exception(f"recalculation {job.id} failed")
+        job.status, job.error = "failed", str(e)
+    job.finished_at = datetime.utcnow()
+    job_qs.update(set__status=job.status, set__replayed=job.replayed, set__error=job.error,
+                  set__finished_at=job.finished_at, set__updated_at=job.finished_at)
+
+
+def _replay(job, lease, console):
+    match_obj = Match if not console else ConsoleMatch
+    job_qs = type(job).objects(id=job.id)
+    if not job.match_ids:
+        # the replay starts with the earliest requested match, the later ones are replayed
+        # with it even if none of their clans played the matches before them
+        requested = list(match_obj.objects(match_id__in=job.requested or [job.match_id])
+                         .order_by("+date", "+id").scalar("match_id"))
+        if not requested:
+            raise match_obj.DoesNotExist(f"matches not found: {', '.join(job.requested)}")
+        match = match_obj.objects.get(match_id=requested[0])
+        replay = Replay(match, console=console, requested=requested[1:])
+        replay.load()
+        job.match_id = match.match_id
+        job.match_ids = [m.match_id for m in replay.matches]
+        job.started_at = datetime.utcnow()
+        job.skipped = len(replay.skipped)
+        job_qs.update(set__match_id=job.match_id, set__match_ids=job.match_ids,
+                      set__total=len(job.match_ids), set__skipped=job.skipped,
+                      set__started_at=job.started_at)
+    else:
+        match = match_obj.objects.get(match_id=job.match_id)
+        replay = Replay(match, console=console, match_ids=job.match_ids)
+        replay.load()
+        if job.replayed:
+            logging.info(f"resuming recalculation {job.id} after {job.replayed} matches")
+
+    def committed(num):
+        # stops before the next matches are written if another process may run the job
+        lease.check()
+        # a failed job keeps its progress, it is resumed after the committed matches
+        job.replayed = num
+        job_qs.update(set__replayed=num, set__updated_at=datetime.utcnow())
+
+    replay.run(start=job.replayed, commit_every=COMMIT_EVERY, committed=committed)
+    lease.check()
+    replay.commit()
+    match_obj.objects(match_id__in=job.requested or [job.match_id]).update(set__recalculate=False)
+    job.replayed = len(replay.matches)
+
+
+def _confirm(job, console):
+    match_obj = Match if not console else ConsoleMatch
+    match = match_obj.objects.get(match_id=job.match_id)
+    # a replay after the confirmation may have calculated it already
+    if match.needs_confirmations() or match.score_posted:
+        return
+    err = calc_scores(match, console=console)
+    match_confirmed(console=console)
+    if err is not None:
+        raise ValueError(f"{err}, match: {match.match_id}")
+
+
+def start_worker():
+    """Starts the worker thread of this process, if it is not running yet. It runs the queued
+    jobs of both platforms and resumes interrupted ones."""
+    with _worker_lock:
+        thread = _worker["thread"]
+        # threads do not survive a fork, e.g. of preloaded gunicorn workers
+        if thread is not None and thread.is_alive() and _worker["pid"] == os.getpid():
+            return
+        thread = threading.Thread(target=work, name="recalculation-worker", daemon=True)
+        _worker["thread"], _worker["pid"] = thread, os.getpid()
+        thread.start()
+
+
+def work():
+    """Runs the jobs of both platforms until the process ends."""
+    while True:
+        _wakeup.clear()
+        for console in (False, True):
+            try:
+                while run_next_job(console=console) is not None:
+                    pass
+            except Exception:
+                logging.exception("error running the recalculation jobs")
+        _wakeup.wait(POLL_INTERVAL)
@@ -2,64 +2,400 @@
 Recalculations for the Scores
 """
 
+import logging
+from datetime import datetime
+
+from bson import ObjectId
+from mongoengine.errors import DoesNotExist
+from mongoengine.queryset.visitor import Q
+from pymongo import DeleteOne, UpdateOne
+
+from models.clan import Clan
 from models.match import Match
+from models.score import Score
+from models.console.console_clan import ConsoleClan
 from models.console.console_match import ConsoleMatch
-from logic.calculations import calc_scores
-from ._getter import get_clan_objects, get_by_clan_id, get_by_num_matches
+from models.console.console_score import ConsoleScore
+from logic.calculations import get_match_scores
+from .checkpoints import get_scores_before_match, scores_written
+from .clan_cache import get_clan_cache
+from .clan_stats import rebuild_clan_stats
+from .data_state import data_changed
 
 
 def start_recalculation(match, console=False):
+    """Recalculates the scores of a match and of the matches played on or after its date
+    whose scores can change (see Replay).
+
+    Args:
+        match (Match): the match that has been edited (or added afterwards)
+        console (bool, optional): console database. Defaults to False.
+
+    Returns:
+        Replay: the finished replay
+    """
+    replay = Replay(match, console=console)
+    replay.load()
+    logging.info(f"replaying {len(replay.matches)} matches, {len(replay.skipped)} later matches skipped")
+    replay.run()
+    replay.commit()
+
+    match.recalculate = False
+    match.save()
+    return replay
+
+
+def preview_recalculation(match, console=False, removed=False):
+    """Replays an edit, insertion or deletion of a match in memory, like a recalculation
+    with the same rating functions, but nothing is written.
+
+    Args:
+        match (Match): the edited or added match (not saved), or the match to delete
+        console (bool, optional): console database. Defaults to False.
+        removed (bool, optional): preview the deletion of the match. Defaults to False.
+
+    Raises:
+        DoesNotExist: a clan of the replayed matches does not exist
+        RuntimeError: a clan plays against itself
+        ValueError: the scores of a match cannot be calculated
+
+    Returns:
+        dict: number of replayed and skipped matches, and the clans whose score or rank
+              changes with their old and new score, num_matches and rank (1 is the best),
+              ordered by the new rank
+    """
+    replay = Replay(match, console=console, removed=removed)
+    replay.load()
+    replay.run()
+
+    field = replay.clan_obj._fields["score"]
+    clans = {str(doc["_id"]): doc for doc in replay.clan_obj.objects.only("tag", "score", "num_matches").as_pymongo()}
+    old_scores = {oid: float(field.to_python(doc.get("score", replay.default_score))) for oid, doc in clans.items()}
+    new_scores = dict(old_scores)
+    new_scores.update((oid, float(score)) for oid, score in replay.new_scores.items())
+    old_ranks, new_ranks = _ranks(old_scores), _ranks(new_scores)
+
+    diff = []
+    for oid, doc in clans.items():
+        if old_scores[oid] == new_scores[oid] and old_ranks[oid] == new_ranks[oid]:
+            continue
+        num_matches = doc.get("num_matches", 0)
+        diff.append({"clan": oid, "tag": doc.get("tag"),
+                     "old_score": old_scores[oid], "new_score": new_scores[oid],
+                     "old_num_matches": num_matches, "new_num_matches": num_matches + replay.new_matches.get(oid, 0),
+                     "old_rank": old_ranks[oid], "new_rank": new_ranks[oid],
+                     # positive if the clan moves up
+                     "rank_change": old_ranks[oid] - new_ranks[oid]})
+    diff.sort(key=lambda clan: (clan["new_rank"], clan["tag"] or ""))
+    return {"match_id": match.match_id, "removed": removed, "replayed": len(replay.matches),
+            "skipped": len(replay.skipped), "clans": diff}
+
+
+def _ranks(scores):
+    # clans with the same score share a rank
+    ranks, rank, last = {}, 0, None
+    for num, (oid, score) in enumerate(sorted(scores.items(), key=lambda item: -item[1]), 1):
+        if score != last:
+            rank, last = num, score
+        ranks[oid] = rank
+    return ranks
+
+
+class Replay:
+    """Replays a match and the matches after it in chronological order against an
+    in-memory rating table, instead of calling calc_scores for every single match.
+
+    Only the matches whose scores can change are replayed: the edited matches, the matches
+    of their clans, and of every clan that played one of the replayed matches afterwards.
+    The other matches and their Score objects are not touched.
+
+    Every step does what calc_scores(recalculate=True) did with the scores from
+    get_by_clan_id and get_by_num_matches, only the database is read once in load()
+    and written once in commit():
+    - a rated match keeps its num_matches, it is calculated with the score of the
+      clan's Score object with num_matches - 1 and with num_matches - 1 matches, the
+      number of matches calc_scores calculates a confirmed match with
+    - a match without a Score object (added afterwards) is calculated with the last
+      score before it and gets a new Score object with num_matches + 1, all later
+      Score objects of the clan are shifted by one
+    """
+
+    def __init__(self, match, console=False, match_ids=None, removed=False, requested=()):
+        self.match = match
+        self.console = console
+        # match ids of the matches to replay in their order, e.g. of a resumed replay
+        self.match_ids = match_ids
+        # match ids of other edited matches after the match (a coalesced recalculation),
+        # they are replayed with the matches their clans play afterwards
+        self.requested = set(requested)
+        # the match is deleted, its Score objects are removed and the matches after it are replayed
+        self.removed = removed
         if not console:
-            match_obj = Match
+            self.clan_obj, self.match_obj, self.score_obj = Clan, Match, Score
+            self.default_score = 600
+        else:
+            self.clan_obj, self.match_obj, self.score_obj = ConsoleClan, ConsoleMatch, ConsoleScore
+            self.default_score = 1000
+        # matches to replay, in the order they are replayed
+        self.matches = []
+        # match ids of the later matches that are not replayed, their scores cannot change
+        self.skipped = []
+        # (clan id, match id) -> {"num_matches", "score", "date", "new", "match_id"}
+        self.scores = {}
+        # clan id -> list of its score dicts, sorted by date
+        self._clan_scores = {}
+        # clan id -> score after the last replayed match of the clan
+        self.new_scores = {}
+        # clan id -> number of new Score objects, added to the clan's num_matches
+        self.new_matches = {}
+        # Score objects that have to be written back, (clan id, match id)
+        self.changed = set()
+        # Score objects of a removed match that have to be deleted, (clan id, match id)
+        self.deleted = []
+        # matches that did not have any scores before the replay
+        self.posted = []
+        # earliest creation time of the replayed Score objects, later checkpoints are outdated
+        self.since = match.date
+
+    def load(self):
+        """Loads the matches to replay, their Score objects and the last Score object
+        of every clan before them."""
+        # some teams play multiple games on one day, that's why we use 'gte' and
+        # discard the match itself, ties on one day are replayed in insertion order
+        later = list(self.match_obj.objects(Q(date__gte=self.match.date) & Q(match_id__ne=self.match.match_id))
+                     .order_by("+date", "+id").only("match_id", "date", "clans1_ids", "clans2_ids").as_pymongo())
+        if self.match_ids is None:
+            # a match is replayed if it has been edited or if one of its clans has played a
+            # replayed match before
+            clan_ids = set(self.match.clans1_ids + self.match.clans2_ids)
+            match_ids = [self.match.match_id] if not self.removed else []
+            for doc in later:
+                if doc["match_id"] in self.requested or clan_ids.intersection(doc["clans1_ids"] + doc["clans2_ids"]):
+                    clan_ids.update(doc["clans1_ids"] + doc["clans2_ids"])
+                    match_ids.append(doc["match_id"])
         else:
-            match_obj = ConsoleMatch
-        clans1, clans2 = get_clan_objects(match)
-        scores1, num_matches1 = zip(*[_get_score_and_num_matches(match, clan, console) for clan in clans1])
-        scores2, num_matches2 = zip(*[_get_score_and_num_matches(match, clan, console) for clan in clans2])
-        print(match.match_id)
-        # calculate new scores
-        err = calc_scores(match, scores1, num_matches1, scores2, num_matches2, recalculate=True, console=console)
-
-        # get all updated teams
-        updated_teams = clans1 + clans2
-
-        # get all matches where date is greater
-        # note, that some teams play multiple games on one day
-        # that's why we use gte = greater than or equal to
-        # but this also delivers the same match as match ...
-        all_matches = []
-        for m in match_obj.objects(date__gte=match.date):
-            # ... just discard it
-            if m.match_id == match.match_id:
+            match_ids = self.match_ids
+        # matches that have been deleted since are skipped
+        matches = {m.match_id: m for m in self.match_obj.objects(match_id__in=match_ids)}
+        if not self.removed:
+            matches[self.match.match_id] = self.match
+        self.matches = [matches[match_id] for match_id in match_ids if match_id in matches]
+        replayed = {m.match_id for m in self.matches}
+        self.skipped = [doc["match_id"] for doc in later if doc["match_id"] not in replayed]
+
+        clan_ids = {oid for m in self.matches + [self.match] for oid in m.clans1_ids + m.clans2_ids}
+        found = {str(c["_id"]) for c in self.clan_obj.objects(id__in=list(clan_ids)).only("id").as_pymongo()}
+        if clan_ids - found:
+            raise DoesNotExist(f"clans not found: {', '.join(sorted(clan_ids - found))}")
+        self.new_matches = {oid: 0 for oid in clan_ids}
+
+        match_dates = {doc["match_id"]: doc["date"] for doc in later}
+        match_dates.update((m.match_id, m.date) for m in self.matches + [self.match])
+        field = self.score_obj._fields["score"]
+        # the Score objects of the skipped matches before a clan's first replayed match
+        # are its scores before that match
+        docs = self.score_obj.objects(Q(match_id__in=list(replayed | {self.match.match_id}))
+                                      | (Q(match_id__in=self.skipped) & Q(clan__in=list(clan_ids))))\
+            .only("clan", "match_id", "num_matches", "score", "_created_at").as_pymongo()
+        self.since = self.match.date
+        for doc in docs:
+            self._add_score(doc["clan"], doc["match_id"], doc["num_matches"],
+                            field.to_python(doc["score"]), match_dates[doc["match_id"]])
+            if doc.get("_created_at") is not None:
+                self.since = min(self.since, doc["_created_at"])
+        # the last score of every clan before the replayed matches, from the nearest checkpoint
+        before = get_scores_before_match(list(clan_ids), self.match, console=self.console)
+        for score in before.values():
+            if score.match_id != "DefaultScore":
+                self._add_score(score.clan, score.match_id, score.num_matches, score.score,
+                                score._created_at)
+        for scores in self._clan_scores.values():
+            scores.sort(key=_by_date)
+        if self.removed:
+            self._remove(self.match)
+
+    def _add_score(self, clan_id, match_id, num_matches, score, date, new=False):
+        score = {"num_matches": num_matches, "score": score, "date": date, "new": new,
+                 "match_id": match_id}
+        self.scores[(clan_id, match_id)] = score
+        self._clan_scores.setdefault(clan_id, []).append(score)
+        return score
+
+    def run(self, start=0, commit_every=None, committed=None):
+        """Replays the loaded matches.
+
+        Args:
+            start (int, optional): number of matches that have already been replayed and
+                written (a resumed replay). Defaults to 0.
+            commit_every (int, optional): writes the changes back after every n matches, so that
+                an interrupted replay can be resumed, None to write only in commit(). Defaults to None.
+            committed (callable, optional): called with the number of written matches after
+                every write. Defaults to None.
+        """
+        for num, m in enumerate(self.matches[start:], start + 1):
+            self.step(m)
+            if commit_every and num % commit_every == 0 and num < len(self.matches):
+                clans = self.write()
+                data_changed("matches", "scores", "clans", console=self.console, clans=clans,
+                             matches=[m.match_id for m in self.matches[num - commit_every:num]])
+                if committed is not None:
+                    committed(num)
+
+    def step(self, match):
+        """Calculates the new scores of one match and updates the rating table.
+
+        Raises:
+            RuntimeError: a clan plays against itself
+            ValueError: the scores of the match cannot be calculated
+        """
+        if set(match.clans1_ids) & set(match.clans2_ids):
+            # a clan cannot play against itself
+            raise RuntimeError("A clan cannot play against itself.")
+
+        scores1, num_matches1 = zip(*[self._score_and_num_matches(match, oid) for oid in match.clans1_ids])
+        scores2, num_matches2 = zip(*[self._score_and_num_matches(match, oid) for oid in match.clans2_ids])
+        new_scores1, new_scores2, err = get_match_scores(match, list(scores1), list(num_matches1),
+                                                         list(scores2), list(num_matches2),
+                                                         console=self.console)
+        if err is not None:
+            raise ValueError(f"{err}, match: {match.match_id}")
+
+        for oid, score, num in list(zip(match.clans1_ids, new_scores1, num_matches1)) \
+                + list(zip(match.clans2_ids, new_scores2, num_matches2)):
+            self._set_score(match, oid, score, num)
+
+        if not match.score_posted:
+            self.posted.append(match.match_id)
+        logging.info(f"replayed match: {match.match_id}")
+
+    def commit(self):
+        """Writes the remaining changes back and rebuilds the statistics of the replayed clans."""
+        self.write()
+        # the results and the opponents' scores of every replayed clan may have changed
+        rebuild_clan_stats(list(self.new_matches), console=self.console)
+        data_changed("matches", "scores", "clans", console=self.console,
+                     clans=list(self.new_matches), matches=[m.match_id for m in self.matches])
+
+    def write(self):
+        """Writes the Score, Clan and Match changes since the last write back with one
+        bulk operation each.
+
+        Returns:
+            list: ids of the clans with new scores
+        """
+        score_field = self.score_obj._fields["score"]
+        score_ops = []
+        for key in self.changed:
+            clan_id, match_id = key
+            score = self.scores[key]
+            update = {"$set": {"score": score_field.to_mongo(score["score"]),
+                               "num_matches": score["num_matches"]}}
+            if score["new"]:
+                update["$setOnInsert"] = {"_created_at": score["date"]}
+            score_ops.append(UpdateOne({"match_id": match_id, "clan": clan_id}, update, upsert=True))
+        for clan_id, match_id in self.deleted:
+            score_ops.append(DeleteOne({"match_id": match_id, "clan": clan_id}))
+        if score_ops:
+            self.score_obj._get_collection().bulk_write(score_ops, ordered=False)
+            scores_written(self.since, console=self.console)
+
+        clan_field = self.clan_obj._fields["score"]
+        now = datetime.now()
+        clan_ops = []
+        for clan_id, score in self.new_scores.items():
+            update = {"$set": {"score": clan_field.to_mongo(score), "last_updated": now}}
+            if self.new_matches[clan_id]:
+                update["$inc"] = {"num_matches": self.new_matches[clan_id]}
+            clan_ops.append(UpdateOne({"_id": ObjectId(clan_id)}, update))
+        if clan_ops:
+            self.clan_obj._get_collection().bulk_write(clan_ops, ordered=False)
+            get_clan_cache(self.console).written(list(self.new_scores))
+
+        if self.posted:
+            self.match_obj.objects(match_id__in=self.posted).update(set__score_posted=True)
+        posted = set(self.posted)
+        for m in self.matches:
+            if m.match_id in posted:
+                m.score_posted = True
+
+        clans = list(self.new_scores)
+        self.changed, self.posted, self.new_scores, self.deleted = set(), [], {}, []
+        self.new_matches = dict.fromkeys(self.new_matches, 0)
+        return clans
+
+    def _score_and_num_matches(self, match, clan_id):
+        own = self.scores.get((clan_id, match.match_id))
+        if own is None:
+            # if there is no Score object, because the match was added afterwards,
+            # then we do not have to go back another step / take the Score object before that
+            score = self._score_before(match, clan_id)
+            return score["score"], score["num_matches"]
+        # otherwise we need to use the old score (one match before the given match), the
+        # number of matches before the match is passed, like calc_scores does with the clan's
+        num = own["num_matches"] - 1
+        return self._score_by_num_matches(clan_id, num)["score"], num
+
+    def _score_before(self, match, clan_id):
+        """The Score object of the last match before a match."""
+        before = None
+        for score in self._clan_scores.get(clan_id, []):
+            if score["date"] is None or score["date"] > match.date:
+                break
+            before = score
+        return before or {"num_matches": 0, "score": self.default_score}
+
+    def _score_by_num_matches(self, clan_id, num_matches):
+        for score in self._clan_scores.get(clan_id, []):
+            if score["num_matches"] == num_matches:
+                return score
+        # a Score object before the loaded ones, e.g. if a match has been confirmed late, its
+        # num_matches is higher than the ones of the matches after it
+        loaded = [score["match_id"] for score in self._clan_scores.get(clan_id, [])]
+        doc = self.score_obj.objects(clan=clan_id, num_matches=num_matches, match_id__nin=loaded)\
+            .only("score").as_pymongo().first()
+        if doc is None:
+            return {"num_matches": 0, "score": self.default_score}
+        return {"num_matches": num_matches, "score": self.score_obj._fields["score"].to_python(doc["score"])}
+
+    def _remove(self, match):
+        for clan_id in match.clans1_ids + match.clans2_ids:
+            own = self.scores.pop((clan_id, match.match_id), None)
+            if own is None:
                 continue
-            else:
-                all_matches.append(m)
-
-        # sort all matches by ascending date
-        all_matches.sort(key=lambda x: x.date)
-        for m in all_matches:
-            clans1, clans2 = get_clan_objects(m)
-            updated_teams.extend(clans1 + clans2)
-            # makes searching more efficient if there are no dublicates
-            updated_teams = list(set(updated_teams))
-            # get the scores and number of matches for the recalculation
-            # TODO: make this more efficient by storing all scores and num_matches
-            # then we do not have to make database calls
-            scores1, num_matches1 = zip(*[_get_score_and_num_matches(m, clan, console) for clan in clans1])
-            scores2, num_matches2 = zip(*[_get_score_and_num_matches(m, clan, console) for clan in clans2])
-            err = calc_scores(m, scores1, num_matches1, scores2, num_matches2, recalculate=True, console=console)
-            print(err, "match:", m.match_id)
-
-        match.recalculate = False
-        match.save()
-
-def _get_score_and_num_matches(match, clan, console=False):
-    score_obj = get_by_clan_id(match, str(clan.id))
-    num = score_obj.num_matches
-    # if there does not exist a score object, because the match was added afterwards,
-    # then we do not have to go back another step / take the score object before that
-    # otherwise we need to use the old score (one match before the given match)
-    if match.score_posted:
-        score_obj = get_by_num_matches(str(clan.id), num - 1, console)
-    score = score_obj.score
-    return score, num
+            # all later matches of the clan move down by one
+            scores = [s for s in self._clan_scores[clan_id] if s is not own]
+            for s in scores:
+                if s["date"] is not None and s["date"] >= match.date:
+                    s["num_matches"] -= 1
+                    self.changed.add((clan_id, s["match_id"]))
+            self._clan_scores[clan_id] = scores
+            self.deleted.append((clan_id, match.match_id))
+            self.new_matches[clan_id] -= 1
+            # the score without the match, unless a later match of the clan is replayed
+            self.new_scores[clan_id] = scores[-1]["score"] if scores else self.default_score
+
+    def _set_score(self, match, clan_id, score, num):
+        field = self.score_obj._fields["score"]
+        # the value as it would be read back from the database
+        score = field.to_python(field.to_mongo(score))
+        key = (clan_id, match.match_id)
+        own = self.scores.get(key)
+        if own is None:
+            # the match was added afterwards, all later matches of the clan
+            # move up by one
+            for s in self._clan_scores.get(clan_id, []):
+                if s["date"] is not None and s["date"] >= match.date:
+                    s["num_matches"] += 1
+                    self.changed.add((clan_id, s["match_id"]))
+            own = self._add_score(clan_id, match.match_id, num + 1, score, match.date, new=True)
+            self._clan_scores[clan_id].sort(key=_by_date)
+            self.new_matches[clan_id] += 1
+        else:
+            own["score"] = score
+        self.changed.add(key)
+        self.new_scores[clan_id] = score
+
+
+def _by_date(score):
+    # same order as get_score_before
+    return (score["date"] is None, score["date"], score["num_matches"])
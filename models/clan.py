@@ -5,7 +5,7 @@ first level class
 import json
 from datetime import datetime
 
-from database.db import db, CustomQuerySet
+from database.db import db, CustomQuerySet, set_shadow_fields
 
 
 class Clan(db.Document):
@@ -35,16 +35,34 @@ class Clan(db.Document):
     archived = db.BooleanField()
     # discord role id of the clan
     role_id = db.StringField()
+    # lowercase copies for the filters, see database.db.set_shadow_fields
+    tag_lower = db.StringField()
+    name_lower = db.StringField()
+    shadow_fields = {"tag": "tag_lower", "name": "name_lower"}
     meta = {
         "indexes": [
             {
                 "fields": ["$tag", "$name", "$alt_tags"]
+            },
+            # prefix and exact filters
+            {
+                "fields": ["tag_lower"]
+            },
+            {
+                "fields": ["name_lower"]
+            },
+            # clan of a Discord role (login)
+            {
+                "fields": ["role_id"]
             }
         ],
         "queryset_class": CustomQuerySet
     }
 
 
+    def clean(self):
+        set_shadow_fields(self)
+
     def to_dict(self):
         return json.loads(self.to_json())
 
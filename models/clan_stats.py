@@ -0,0 +1,34 @@
+"""
+materialized statistics of a clan, this class should be understood as QoL class like Score,
+the statistics can always be rebuilt from the matches and Score objects (see logic/clan_stats.py)
+Every statistic is stored as cell:
+{"total": matches, "wins": victories, "caps": {"0": 0-5 results, ..., "5": 5-0 results},
+ "strength": sum of the opponents' scores, "rated": matches with opponent scores}
+"""
+
+import json
+from datetime import datetime
+
+from database.db import db, CustomQuerySet
+
+
+class ClanStats(db.Document):
+    # oid of the clan
+    clan = db.StringField(required=True, unique=True)
+    # cell of all posted matches of the clan
+    total = db.DictField()
+    # cells per map, the keys are the lowercase map names (see logic.clan_stats.map_key)
+    maps = db.DictField()
+    # cells per side, Axis or Allies
+    sides = db.DictField()
+    # cells per map and side, {map: {side: cell}}
+    maps_sides = db.DictField()
+    # when the statistics were last updated
+    last_updated = db.DateTimeField(default=datetime.now)
+    meta = {
+        "queryset_class": CustomQuerySet
+    }
+
+
+    def to_dict(self):
+        return json.loads(self.to_json())
@@ -5,7 +5,7 @@ first level class
 import json
 from datetime import datetime
 
-from database.db import db, CustomQuerySet
+from database.db import db, CustomQuerySet, set_shadow_fields
 
 
 class ConsoleClan(db.Document):
@@ -33,10 +33,21 @@ class ConsoleClan(db.Document):
     inactive = db.BooleanField()
     # indicates if a clan has been inactive for 4 months
     archived = db.BooleanField()
+    # lowercase copies for the filters, see database.db.set_shadow_fields
+    tag_lower = db.StringField()
+    name_lower = db.StringField()
+    shadow_fields = {"tag": "tag_lower", "name": "name_lower"}
     meta = {
         "indexes": [
             {
                 "fields": ["$tag", "$name", "$alt_tags"]
+            },
+            # prefix and exact filters
+            {
+                "fields": ["tag_lower"]
+            },
+            {
+                "fields": ["name_lower"]
             }
         ],
         "queryset_class": CustomQuerySet,
@@ -44,5 +55,8 @@ class ConsoleClan(db.Document):
     }
 
 
+    def clean(self):
+        set_shadow_fields(self)
+
     def to_dict(self):
         return json.loads(self.to_json())
@@ -0,0 +1,26 @@
+"""
+modification times and write counters of the collections, this class should be understood
+as QoL class, one document per collection (e.g. "matches", "scores") that is written by every
+write path (see logic/data_state.py)
+"""
+
+import json
+
+from database.db import db, CustomQuerySet
+
+
+class ConsoleDataState(db.Document):
+    # name of the collection, e.g. "matches"
+    collection = db.StringField(required=True, unique=True)
+    # when documents of the collection were last written (UTC)
+    last_modified = db.DateTimeField()
+    # number of writes, the sum over all collections is the data version of the platform
+    version = db.IntField(default=0)
+    meta = {
+        "queryset_class": CustomQuerySet,
+        "db_alias": "console"
+    }
+
+
+    def to_dict(self):
+        return json.loads(self.to_json())
@@ -8,7 +8,7 @@ from random import choices
 
 from numpy import require
 
-from database.db import db, CustomQuerySet
+from database.db import db, CustomQuerySet, set_shadow_fields
 
 
 class ConsoleMatch(db.Document):
@@ -56,10 +56,36 @@ class ConsoleMatch(db.Document):
     # reserved for admins, necessary to start a recalculate process for this match
     # will be set only temporarily
     recalculate = db.BooleanField()
+    # lowercase copies for the filters, see database.db.set_shadow_fields
+    match_id_lower = db.StringField()
+    map_lower = db.StringField()
+    event_lower = db.StringField()
+    shadow_fields = {"match_id": "match_id_lower", "map": "map_lower", "event": "event_lower"}
     meta = {
         "indexes": [
             {
                 "fields": ["$match_id", "$map", "$event"]
+            },
+            # prefix and exact filters
+            {
+                "fields": ["match_id_lower"]
+            },
+            {
+                "fields": ["map_lower"]
+            },
+            {
+                "fields": ["event_lower"]
+            },
+            # matches of a clan (multikey), newest first
+            {
+                "fields": ["clans1_ids", "-date"]
+            },
+            {
+                "fields": ["clans2_ids", "-date"]
+            },
+            # matches on or after a date (recalculations, exports)
+            {
+                "fields": ["date"]
             }
         ],
         "queryset_class": CustomQuerySet,
@@ -74,6 +100,9 @@ class ConsoleMatch(db.Document):
         return True
 
 
+    def clean(self):
+        set_shadow_fields(self)
+
     def to_dict(self):
         return json.loads(self.to_json())
 
@@ -0,0 +1,34 @@
+"""
+rating checkpoint, the last Score object of every clan as of a date, so that a recalculation
+does not have to look through the whole history of the clans (see logic/checkpoints.py)
+A checkpoint is deleted as soon as a Score object on or before its date is written.
+"""
+
+import json
+from datetime import datetime
+
+from database.db import db, CustomQuerySet
+
+
+class ConsoleRatingCheckpoint(db.Document):
+    # match after whose confirmation the checkpoint was written
+    match_id = db.StringField(required=True)
+    # the checkpoint contains the Score objects created on or before this date
+    date = db.DateTimeField(required=True)
+    # clan id -> [num_matches, score, match_id, _created_at] of its last Score object
+    clans = db.DictField()
+    created_at = db.DateTimeField(default=datetime.utcnow)
+    meta = {
+        "indexes": [
+            # nearest checkpoint before a date
+            {
+                "fields": ["-date"]
+            }
+        ],
+        "queryset_class": CustomQuerySet,
+        "db_alias": "console"
+    }
+
+
+    def to_dict(self):
+        return json.loads(self.to_json())
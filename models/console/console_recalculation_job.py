@@ -0,0 +1,52 @@
+"""
+recalculation of the scores that runs in the background (see logic/recalculation_jobs.py),
+the replayed matches are committed in steps, so that an interrupted job can be resumed
+"""
+
+import json
+from datetime import datetime
+
+from database.db import db, CustomQuerySet
+
+
+class ConsoleRecalculationJob(db.Document):
+    # recalculation (replay of the requested matches and the later matches they affect) or
+    # confirmation (calc_scores of a match confirmed during a replay)
+    kind = db.StringField(default="recalculation", choices=["recalculation", "confirmation"])
+    # match id of the confirmed match, or of the earliest requested match, the replay starts with it
+    match_id = db.StringField(required=True)
+    # match ids of the edited matches, later requests are added while the job is queued
+    requested = db.ListField(db.StringField())
+    # queued, running, done or failed
+    status = db.StringField(default="queued", choices=["queued", "running", "done", "failed"])
+    # match ids of the replayed matches in the order they are replayed, set when the job starts
+    match_ids = db.ListField(db.StringField())
+    # number of replayed matches that have been committed
+    replayed = db.IntField(default=0)
+    # number of matches to replay
+    total = db.IntField(default=0)
+    # number of later matches that are not replayed, their scores cannot change
+    skipped = db.IntField(default=0)
+    # error message of a failed job
+    error = db.StringField()
+    # identity of the admin who started the recalculation
+    requested_by = db.StringField()
+    created_at = db.DateTimeField(default=datetime.utcnow)
+    started_at = db.DateTimeField()
+    finished_at = db.DateTimeField()
+    # last progress of a running job (UTC)
+    updated_at = db.DateTimeField()
+    meta = {
+        "indexes": [
+            # next queued or interrupted job, queued job to add a request to
+            {
+                "fields": ["status", "created_at"]
+            }
+        ],
+        "queryset_class": CustomQuerySet,
+        "db_alias": "console"
+    }
+
+
+    def to_dict(self):
+        return json.loads(self.to_json())
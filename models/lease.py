@@ -0,0 +1,34 @@
+"""
+lease of a task that only one process may run at a time (e.g. the recalculations of a platform),
+the holder extends it while it runs (heartbeat), a lease that has not been extended expires
+(see logic/lease.py)
+"""
+
+import json
+
+from database.db import db, CustomQuerySet
+
+
+class Lease(db.Document):
+    # name of the task, e.g. "recalculation"
+    name = db.StringField(required=True, unique=True)
+    # process and thread of the holder
+    owner = db.StringField(required=True)
+    # what the holder does, e.g. "replay" or "confirmation"
+    purpose = db.StringField()
+    # when the lease expires without a heartbeat (UTC)
+    expires_at = db.DateTimeField(required=True)
+    meta = {
+        "indexes": [
+            # expired leases are removed by the server
+            {
+                "fields": ["expires_at"],
+                "expireAfterSeconds": 0
+            }
+        ],
+        "queryset_class": CustomQuerySet
+    }
+
+
+    def to_dict(self):
+        return json.loads(self.to_json())
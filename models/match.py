@@ -8,7 +8,7 @@ from random import choices
 
 from numpy import require
 
-from database.db import db, CustomQuerySet
+from database.db import db, CustomQuerySet, set_shadow_fields
 
 
 class Type(enum.Enum):
@@ -57,10 +57,36 @@ class Match(db.Document):
     recalculate = db.BooleanField()
     # url to the stream of the match
     stream_url = db.StringField()
+    # lowercase copies for the filters, see database.db.set_shadow_fields
+    match_id_lower = db.StringField()
+    map_lower = db.StringField()
+    event_lower = db.StringField()
+    shadow_fields = {"match_id": "match_id_lower", "map": "map_lower", "event": "event_lower"}
     meta = {
         "indexes": [
             {
                 "fields": ["$match_id", "$map", "$event"]
+            },
+            # prefix and exact filters
+            {
+                "fields": ["match_id_lower"]
+            },
+            {
+                "fields": ["map_lower"]
+            },
+            {
+                "fields": ["event_lower"]
+            },
+            # matches of a clan (multikey), newest first
+            {
+                "fields": ["clans1_ids", "-date"]
+            },
+            {
+                "fields": ["clans2_ids", "-date"]
+            },
+            # matches on or after a date (recalculations, exports)
+            {
+                "fields": ["date"]
             }
         ],
         "queryset_class": CustomQuerySet
@@ -72,6 +98,9 @@ class Match(db.Document):
             return False
         return True
 
+    def clean(self):
+        set_shadow_fields(self)
+
     def to_dict(self):
         return json.loads(self.to_json())
 
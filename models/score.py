@@ -32,6 +32,22 @@ class Score(db.Document):
             "indexes": [
                 {
                     "fields": ["$match_id"]
+                },
+                # last score of a clan before a match
+                {
+                    "fields": ["clan", "-_created_at", "-num_matches"]
+                },
+                # Score objects of a match
+                {
+                    "fields": ["match_id", "clan"]
+                },
+                # Score object of a clan by its number of matches
+                {
+                    "fields": ["clan", "num_matches"]
+                },
+                # Score objects in a date range (exports)
+                {
+                    "fields": ["_created_at"]
                 }
             ],
             "queryset_class": CustomQuerySet
@@ -1,14 +1,27 @@
 # rest/common.py
+import base64
+import binascii
+import hmac
 import json
 import logging
 import traceback
 from functools import wraps
+from itertools import islice
 
-from flask import Response, abort
+from bson import SON, json_util
+from bson.json_util import CANONICAL_JSON_OPTIONS
+from flask import Response, abort, current_app, request
 from flask_jwt_extended import get_jwt, verify_jwt_in_request
+from mongoengine import Document
+from mongoengine.fields import ListField
+from mongoengine.queryset import QuerySet
+from mongoengine.queryset.visitor import Q
+from werkzeug.exceptions import BadRequest
 
+from database.db import MongoJSONEncoder, document_to_json, exclude_shadow_fields
 from models.user import Role
 
+NDJSON = "application/x-ndjson"
 
 # build error json
 # add_info, reserved, will be used later ... maybe
@@ -19,13 +32,69 @@ def handle_error(text, status=400, add_info=None):
 
 def get_response(obj, status=200):
     if type(obj) is dict:
-        return Response(json.dumps(obj), mimetype="application/json", status=status)
+        # the dict may contain raw documents, e.g. a page of matches
+        return Response(json.dumps(obj, cls=MongoJSONEncoder), mimetype="application/json", status=status)
     elif type(obj) is str:
         return Response(obj, mimetype="application/json", status=status)
+    elif isinstance(obj, QuerySet) and (not obj._limit or wants_ndjson()):
+        # unbounded listings are streamed from the cursor
+        return stream_response(exclude_shadow_fields(obj).as_pymongo(), status=status)
+    elif isinstance(obj, Document):
+        return Response(document_to_json(obj), mimetype="application/json", status=status)
     else:
         return Response(obj.to_json(), mimetype="application/json", status=status)
 
 
+# bulk consumers can request newline delimited JSON with 'Accept: application/x-ndjson'
+def wants_ndjson():
+    return request.accept_mimetypes.best_match(["application/json", NDJSON]) == NDJSON
+
+
+# streams raw documents in batches instead of building the whole response in memory,
+# as JSON array (or {key: [...], "meta": meta(number of documents)}) with the same bytes
+# as get_response, or as NDJSON with one document per line (without the meta),
+# NDJSON is used if the client accepts it, unless 'ndjson' is given
+def stream_response(docs, key=None, meta=None, status=200, batch_size=500, ndjson=None):
+    if ndjson is None:
+        ndjson = wants_ndjson()
+    if isinstance(docs, QuerySet):
+        docs = docs.batch_size(batch_size)
+    docs = iter(docs)
+    # the first batch is read before the response is returned, so that a failing query is an
+    # error response instead of a 200 with truncated JSON, and a single batch is not streamed
+    first = [json.dumps(doc, cls=MongoJSONEncoder) for doc in islice(docs, batch_size)]
+
+    def generate():
+        if not ndjson:
+            yield f"{{{json.dumps(key)}: [" if key is not None else "["
+        num, batch = 0, first
+        while batch:
+            yield _join_batch(batch, num, ndjson)
+            num += len(batch)
+            # a short batch is the last one
+            batch = [json.dumps(doc, cls=MongoJSONEncoder) for doc in islice(docs, batch_size)] \
+                if len(batch) == batch_size else []
+        if not ndjson:
+            yield f"], \"meta\": {json.dumps(meta(num), cls=MongoJSONEncoder)}}}" if key is not None else "]"
+
+    body = generate() if len(first) == batch_size else "".join(generate())
+    return Response(body, mimetype=NDJSON if ndjson else "application/json", status=status)
+
+
+def _join_batch(batch, num, ndjson):
+    if ndjson:
+        return "\n".join(batch) + "\n"
+    return (", " if num else "") + ", ".join(batch)
+
+
+# case insensitive prefix (or exact) filter on the lowercase copy of a field (see the documents'
+# shadow_fields), the anchored regex can use the index of the copy, unlike icontains
+def prefix_filter(field: str, value: str, exact=False):
+    if exact:
+        return Q(**{f"{field}_lower": value.lower()})
+    return Q(**{f"{field}_lower__startswith": value.lower()})
+
+
 # check for None or empty string
 def empty(s: str):
     if s is None or s == "" or s == " ":
@@ -49,7 +118,155 @@ def admin_required():
     return wrapper
 
 
+# like admin_required, but scrapers without an admin account can also
+# authorize with the configured EXPORT_TOKEN in the 'X-Export-Token' header
+def export_required():
+    def wrapper(fn):
+        @wraps(fn)
+        def decorator(*args, **kwargs):
+            token = current_app.config.get("EXPORT_TOKEN")
+            given = request.headers.get("X-Export-Token")
+            if token and given and hmac.compare_digest(token, given):
+                return fn(*args, **kwargs)
+            # optional, a request with neither the token nor a JWT is unauthorized (not an error)
+            verify_jwt_in_request(optional=True)
+            claims = get_jwt()
+            if Role.Admin.value in claims.get("roles", []):
+                return fn(*args, **kwargs)
+            return handle_error(f"Authorization failed", 401)
+        return decorator
+    return wrapper
+
+
 def validate_schema(schema, args):
     errors = schema.validate(args)
     if errors: abort(400, str(errors))
 
+
+
+# keyset pagination: a page starts after the last document of the previous page instead of
+# skipping all documents before it, the id breaks ties of the sort field
+# returns the raw documents of the page and the cursor of the next page (None on the last page),
+# count is the 'count' parameter of the request, the total count of a cursor page is not computed
+def cursor_page(queryset, cursor, sort_by=None, desc=False, limit=0, offset=0, fields=None, count=None):
+    if count is not None: raise BadRequest("'count' cannot be used with a cursor")
+    # also on the first page ('cursor='), the pages after it would not be shifted by it
+    if offset: raise BadRequest("'offset' cannot be used with a cursor")
+    document = queryset._document
+    field = sort_by if not empty(sort_by) else "id"
+    if field not in document._fields or isinstance(document._fields[field], ListField):
+        raise BadRequest(f"cannot use a cursor with 'sort_by={sort_by}'")
+    db_field = document._fields[field].db_field
+
+    if not empty(cursor):
+        last = _decode_cursor(cursor)
+        if last["sort_by"] != field or last["desc"] != bool(desc):
+            raise BadRequest("cursor does not match 'sort_by' and 'desc'")
+        queryset = queryset.filter(__raw__=_after(db_field, last["value"], last["id"], desc))
+
+    direction = "-" if desc else "+"
+    order = [f"{direction}{field}"] if field == "id" else [f"{direction}{field}", f"{direction}id"]
+    if fields:
+        # the sort field is needed for the cursor, even if it has not been selected
+        queryset = queryset.only(*fields, field)
+    docs = list(exclude_shadow_fields(queryset).order_by(*order).limit(limit).as_pymongo())
+
+    next_cursor = None
+    if limit and len(docs) == limit:
+        next_cursor = _encode_cursor(field, desc, docs[-1].get(db_field), docs[-1]["_id"])
+    if fields and field not in fields and field != "id":
+        for doc in docs: doc.pop(db_field, None)
+    return docs, next_cursor
+
+
+def _encode_cursor(field, desc, value, oid):
+    last = {"sort_by": field, "desc": bool(desc), "value": value, "id": oid}
+    return base64.urlsafe_b64encode(json_util.dumps(last, json_options=CANONICAL_JSON_OPTIONS).encode()).decode()
+
+
+def _decode_cursor(cursor):
+    try:
+        last = json_util.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not {"sort_by", "desc", "value", "id"} <= last.keys(): raise ValueError
+        return last
+    except (binascii.Error, ValueError, AttributeError, TypeError):
+        raise BadRequest("invalid cursor")
+
+
+def _after(db_field, value, oid, desc):
+    # documents after (value, oid) in the sort order, missing values and null are sorted first
+    if db_field == "_id":
+        return {"_id": {"$lt" if desc else "$gt": oid}}
+    if not desc:
+        if value is None:
+            return {"$or": [{db_field: None, "_id": {"$gt": oid}}, {db_field: {"$ne": None}}]}
+        return {"$or": [{db_field: {"$gt": value}}, {db_field: value, "_id": {"$gt": oid}}]}
+    if value is None:
+        return {db_field: None, "_id": {"$lt": oid}}
+    return {"$or": [{db_field: {"$lt": value}}, {db_field: value, "_id": {"$lt": oid}}, {db_field: None}]}
+
+
+# the page and the total number of documents of an ordered QuerySet in one round trip
+# count: 'exact' counts all documents matching the filter, 'estimated' uses the collection's
+# metadata if there is no filter (and counts exactly otherwise), 'none' skips the count
+# returns the raw documents of the page and the total count (None for 'none')
+def page_with_counts(queryset, limit=0, offset=0, count="exact", fields=None):
+    if fields:
+        queryset = queryset.only(*fields)
+    queryset = exclude_shadow_fields(queryset)
+    query = queryset._query
+
+    if count == "none" or (count == "estimated" and not query) or not limit:
+        docs = list(queryset.skip(offset).limit(limit).as_pymongo())
+        return docs, _total_count(queryset, len(docs), limit=limit, offset=offset, count=count)
+
+    page = []
+    if queryset._ordering: page.append({"$sort": SON(queryset._ordering)})
+    if offset: page.append({"$skip": offset})
+    page.append({"$limit": limit})
+    projection = queryset._loaded_fields.as_dict()
+    if projection: page.append({"$project": projection})
+    res = next(queryset._collection.aggregate([
+        {"$match": query},
+        {"$facet": {"page": page, "total": [{"$count": "total"}]}}
+    ], allowDiskUse=True))
+    return res["page"], res["total"][0]["total"] if res["total"] else 0
+
+
+# {key: [page], "meta": {"count", "offset", "total_count"}} response of an ordered QuerySet,
+# see page_with_counts, unbounded listings (no limit) and NDJSON are streamed
+def page_response(queryset, key, limit=0, offset=0, count="exact", fields=None):
+    if limit and not wants_ndjson():
+        docs, total_count = page_with_counts(queryset, limit=limit, offset=offset, count=count, fields=fields)
+        return get_response({
+            key: docs,
+            "meta": {
+                "count": len(docs),
+                "offset": offset,
+                "total_count": total_count
+            }
+        })
+
+    if fields:
+        queryset = queryset.only(*fields)
+    queryset = exclude_shadow_fields(queryset)
+
+    def meta(num):
+        return {
+            "count": num,
+            "offset": offset,
+            "total_count": _total_count(queryset, num, limit=limit, offset=offset, count=count)
+        }
+    return stream_response(queryset.skip(offset).limit(limit).as_pymongo(), key=key, meta=meta)
+
+
+def _total_count(queryset, num, limit=0, offset=0, count="exact"):
+    # total count without the $facet aggregation, num is the size of the page
+    if count == "none":
+        return None
+    if count == "estimated" and not queryset._query:
+        return queryset._collection.estimated_document_count()
+    # without a limit, the page contains all documents after the offset
+    if not limit and (num or not offset):
+        return offset + num
+    return queryset.count()
@@ -0,0 +1,92 @@
+# rest/_conditional.py
+from bson import ObjectId
+from flask import current_app, g, request
+
+from cache import page_tags
+from logic.data_state import data_version
+from ._common import wants_ndjson
+
+# not revalidated by the data version: authentication, exports (Last-Modified and their own
+# authorization), the cache statistics, the recalculation jobs, the notifications and the
+# simulations (they depend on the request body)
+EXCLUDED = ("/auth/", "/console/auth/", "/export/", "/console/export/", "/cache/", "/console/cache/",
+            "/recalculations/", "/console/recalculations/",
+            "/matches-notifications", "/console/matches-notifications",
+            "/simulations", "/console/simulations")
+
+# URL rule -> TTL in seconds of the cached read endpoints, can be changed (or disabled with None)
+# per rule with the RESPONSE_CACHE_ROUTES config
+CACHED_ROUTES = {
+    "/clan/<oid>": 60,
+    "/clans": 60,
+    "/matches": 60,
+    "/clan/<oid>/score_history": 300,
+    "/statistics/winrate/<oid>": 300,
+    "/statistics/winrate/<oid>/breakdown": 300,
+    "/statistics/result_types/<oid>": 300,
+    "/statistics/pr/<oid>": 300,
+    "/console/clan/<unique_identifier>": 60,
+    "/console/clans": 60,
+    "/console/matches": 60,
+    "/console/clan/<oid>/score_history": 300,
+    "/console/statistics/winrate/<oid>": 300,
+    "/console/statistics/winrate/<oid>/breakdown": 300,
+    "/console/statistics/result_types/<oid>": 300,
+    "/console/statistics/pr/<oid>": 300,
+}
+
+
+# conditional GET: the responses of the read endpoints carry the data version of their platform
+# as ETag, it changes with every write (see logic.data_state.data_changed), so a client (or cache)
+# revalidating with 'If-None-Match' gets a 304 before any query runs, the version is kept in memory
+# (the writes of other processes are noticed within logic.data_state.CHECK_INTERVAL seconds)
+def initialize_conditional_requests(app):
+    app.before_request(_not_modified)
+    app.after_request(_set_cache_headers)
+
+
+def _not_modified():
+    if request.method != "GET" or request.url_rule is None or request.path.startswith(EXCLUDED):
+        return None
+    console = _is_console()
+    # JSON and NDJSON are different representations of the same data
+    g.etag = f"{'console' if console else 'pc'}-{data_version(console=console)}"\
+             + ("-ndjson" if wants_ndjson() else "")
+    if request.if_none_match.contains_weak(g.etag):
+        return current_app.response_class(status=304)
+    return None
+
+
+def _set_cache_headers(response):
+    if "etag" not in g or response.status_code not in (200, 304):
+        return response
+    response.set_etag(g.etag, weak=True)
+    response.vary.add("Accept")
+    # only the public read endpoints may be stored by shared caches, which have to revalidate them
+    if cache_ttl() is not None:
+        response.headers["Cache-Control"] = "public, no-cache"
+        response.headers["Surrogate-Key"] = " ".join(request_tags())
+    return response
+
+
+def cache_ttl():
+    # TTL in seconds of the route of the request in the response cache, None if it is not cached
+    routes = {**CACHED_ROUTES, **current_app.config.get("RESPONSE_CACHE_ROUTES", {})}
+    return routes.get(request.url_rule.rule)
+
+
+def _is_console():
+    # the shared routes without a '/console' prefix use the platform of the deployment
+    if request.path == "/search":
+        return current_app.config["IS_CONSOLE_API"]
+    return request.path.startswith("/console/")
+
+
+def request_tags():
+    # the platform, and the clan or match of a page, so that a downstream cache
+    # can purge only the pages of the clans and matches that have been written
+    args = request.view_args or {}
+    rule = request.url_rule.rule
+    oid = args.get("oid") or args.get("unique_identifier")
+    clan = oid if oid and ("/clan/" in rule or "/statistics/" in rule) and ObjectId.is_valid(oid) else None
+    return page_tags(console=_is_console(), clan=clan, match=args.get("match_id"))
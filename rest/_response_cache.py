@@ -0,0 +1,74 @@
+# rest/_response_cache.py
+from urllib.parse import urlencode
+
+from flask import current_app, g, request
+
+from cache import create_backend, response_cache
+from ._common import wants_ndjson
+from ._conditional import cache_ttl, request_tags
+
+
+# caches the responses of the read endpoints in this process, or in a file shared by all workers
+# of the host, writes invalidate them by their tags (see logic.data_state.data_changed)
+def initialize_response_cache(app):
+    backend = create_backend(app.config.get("RESPONSE_CACHE_BACKEND", "memory"),
+                             path=app.config.get("RESPONSE_CACHE_PATH"),
+                             max_bytes=app.config.get("RESPONSE_CACHE_MAX_BYTES"),
+                             ttl=app.config.get("RESPONSE_CACHE_TTL"))
+    response_cache.configure(backend=backend, enabled=app.config.get("RESPONSE_CACHE_ENABLED"))
+    app.before_request(_cached_response)
+    app.after_request(_store_response)
+
+
+def _cached_response():
+    if request.method != "GET" or request.url_rule is None or not response_cache.enabled:
+        return None
+    ttl = cache_ttl()
+    if ttl is None:
+        return None
+    # normalized: the query arguments in order, JSON and NDJSON are cached separately, and
+    # the data version (the ETag), so that a write of another process or host is not served from
+    # a page of an older version once it has been noticed, even if its invalidation has not
+    # reached this cache
+    args = urlencode(sorted(request.args.items(multi=True)))
+    g.cache_key = f"{g.get('etag')}|{request.path}?{args}|{'ndjson' if wants_ndjson() else 'json'}"
+    g.cache_ttl = ttl
+    g.cache_generation = response_cache.generation
+    cached = response_cache.get(g.cache_key)
+    if cached is None:
+        return None
+    g.cache_hit = True
+    body, mimetype = cached
+    return current_app.response_class(body, mimetype=mimetype)
+
+
+def _store_response(response):
+    if "cache_key" not in g:
+        return response
+    response.headers["X-Cache"] = "HIT" if g.get("cache_hit") else "MISS"
+    if g.get("cache_hit") or response.status_code != 200:
+        return response
+    store = dict(key=g.cache_key, mimetype=response.mimetype, tags=request_tags(),
+                 ttl=g.cache_ttl, generation=g.cache_generation)
+    if response.is_streamed:
+        # stored after the last chunk has been sent
+        response.response = _tee(response.response, **store)
+    else:
+        response_cache.set(body=response.get_data(), **store)
+    return response
+
+
+def _tee(chunks, key, mimetype, tags, ttl, generation):
+    body, size = [], 0
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        if body is not None:
+            body.append(chunk)
+            size += len(chunk)
+            # too large to be cached
+            if size > response_cache.max_bytes // 4:
+                body = None
+        yield chunk
+    if body is not None:
+        response_cache.set(key, b"".join(body), mimetype, tags=tags, ttl=ttl, generation=generation)
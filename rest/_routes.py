@@ -7,8 +7,15 @@ from rest.clans import (
     ConsoleClansApi,
     ConsoleScoreHistoryApi,
 )
+from rest.cache_stats import CacheStatsApi
 from rest.clans import DiscordRoleApi
 from rest.events import EventApi, EventsApi
+from rest.export import (
+    ExportMatchesApi,
+    ExportScoresApi,
+    ConsoleExportMatchesApi,
+    ConsoleExportScoresApi,
+)
 from rest.matches import (
     MatchApi,
     MatchesApi,
@@ -17,13 +24,21 @@ from rest.matches import (
     MatchesNotificationApi,
 )
 from rest.scores import ScoreApi, ScoresApi, ConsoleScoreApi, ConsoleScoresApi
+from rest.recalculations import (
+    RecalculationJobApi,
+    ConsoleRecalculationJobApi,
+    RecalculationPreviewApi,
+    ConsoleRecalculationPreviewApi,
+)
 from rest.search import SearchApi
 from rest.simulations import SimulationsApi, ConsoleSimulationsApi
 from rest.statistics import (
     WinrateApi,
+    WinrateBreakdownApi,
     ResultTypesApi,
     PerformanceRatingApi,
     ConsoleWinrateApi,
+    ConsoleWinrateBreakdownApi,
     ConsoleResultTypesApi,
     ConsolePerformanceRatingApi,
 )
@@ -57,6 +72,9 @@ def initialize_routes(api, discord):
     # Search
     api.add_resource(SearchApi, "/search", "/console/search")
 
+    # Response cache
+    api.add_resource(CacheStatsApi, "/cache/stats", "/console/cache/stats")
+
     # PC
     # Clans
     api.add_resource(ClanApi, "/clan/<oid>")
@@ -78,8 +96,17 @@ def initialize_routes(api, discord):
     # Simulations
     api.add_resource(SimulationsApi, "/simulations")
 
+    # Recalculations
+    api.add_resource(RecalculationJobApi, "/recalculations/<job_id>")
+    api.add_resource(RecalculationPreviewApi, "/recalculations/preview")
+
+    # Export
+    api.add_resource(ExportMatchesApi, "/export/matches")
+    api.add_resource(ExportScoresApi, "/export/scores")
+
     # Statistics
     api.add_resource(WinrateApi, "/statistics/winrate/<oid>")
+    api.add_resource(WinrateBreakdownApi, "/statistics/winrate/<oid>/breakdown")
     api.add_resource(ResultTypesApi, "/statistics/result_types/<oid>")
     api.add_resource(PerformanceRatingApi, "/statistics/pr/<oid>")
 
@@ -102,7 +129,16 @@ def initialize_routes(api, discord):
     # Simulations
     api.add_resource(ConsoleSimulationsApi, "/console/simulations")
 
+    # Recalculations
+    api.add_resource(ConsoleRecalculationJobApi, "/console/recalculations/<job_id>")
+    api.add_resource(ConsoleRecalculationPreviewApi, "/console/recalculations/preview")
+
+    # Export
+    api.add_resource(ConsoleExportMatchesApi, "/console/export/matches")
+    api.add_resource(ConsoleExportScoresApi, "/console/export/scores")
+
     # Statistics
     api.add_resource(ConsoleWinrateApi, "/console/statistics/winrate/<oid>")
+    api.add_resource(ConsoleWinrateBreakdownApi, "/console/statistics/winrate/<oid>/breakdown")
     api.add_resource(ConsoleResultTypesApi, "/console/statistics/result_types/<oid>")
     api.add_resource(ConsolePerformanceRatingApi, "/console/statistics/pr/<oid>")
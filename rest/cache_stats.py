@@ -0,0 +1,16 @@
+# rest/cache_stats.py
+from flask_restful import Resource
+
+from cache import response_cache
+from ._common import admin_required, get_response, handle_error
+
+
+class CacheStatsApi(Resource):
+
+    # hit/miss counters and size of the response cache of this process
+    @admin_required()
+    def get(self):
+        try:
+            return get_response(response_cache.stats())
+        except:
+            return handle_error("error getting the response cache statistics")
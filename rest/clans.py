@@ -2,6 +2,9 @@
 from datetime import datetime
 import bson
 
+from database.db import shadow_values
+from logic.clan_cache import get_clan_cache
+from logic.data_state import data_changed
 from flask import request
 from flask_restful import Resource
 from models.clan import Clan
@@ -14,8 +17,8 @@ from mongoengine.queryset.visitor import Q
 from schemas.query_schemas import ClanQuerySchema, ScoreHistoryQuerySchema
 from werkzeug.exceptions import BadRequest
 
-from ._common import (admin_required, empty, get_response, handle_error,
-                      validate_schema)
+from ._common import (admin_required, cursor_page, empty, get_response,
+                      handle_error, page_response, prefix_filter, validate_schema)
 
 # https://stackoverflow.com/questions/30779584/flask-restful-passing-parameters-to-get-request
 # https://www.programcreek.com/python/example/108223/marshmallow.validate.OneOf
@@ -63,7 +66,10 @@ class ClanApi(Resource):
             clan_qs = Clan.objects(id=oid)
             # can also be upsert_one or update, more important is that we do this on a QuerySet
             # and not on a Document
-            res = clan_qs.update_one(upsert=True, last_updated=datetime.now(), **request.get_json(), full_result=True)
+            res = clan_qs.update_one(upsert=True, last_updated=datetime.now(), **request.get_json(),
+                                  **shadow_values(Clan, request.get_json()), full_result=True)
+            data_changed("clans", clans=[oid])
+            get_clan_cache().written([oid])
             if res.raw_result.get("updatedExisting"):
                 return get_response({"message": f"replaced clan with id: {oid}"}, 200)
 
@@ -81,7 +87,10 @@ class ClanApi(Resource):
     def patch(self, oid):
         try:
             clan = Clan.objects.get(id=oid)
-            clan.update(last_updated=datetime.now(), **request.get_json())
+            clan.update(last_updated=datetime.now(), **request.get_json(),
+                        **shadow_values(Clan, request.get_json()))
+            data_changed("clans", clans=[oid])
+            get_clan_cache().written([oid])
 
         except BadRequest:
             return handle_error("Bad Request", 400)
@@ -102,6 +111,8 @@ class ClanApi(Resource):
         try:
             clan = Clan.objects.get(id=oid)        
             clan = clan.delete()
+            data_changed("clans", clans=[oid])
+            get_clan_cache().written([oid])
 
         except OperationError:
             return handle_error(f"Authorization failed", 401)
@@ -137,6 +148,8 @@ class ClansApi(Resource):
             sort_by = request.args.get("sort_by", default=None, type=str)
             # descending order
             desc = request.args.get("desc", default=None, type=str)
+            # exact instead of prefix matches for the text filters
+            exact = request.args.get("exact", default="").lower() in ("true", "1")
 
             # optional, narrows the return to selected fields
             # should be a comma separated list
@@ -150,13 +163,36 @@ class ClansApi(Resource):
             # for every query parameter one by one
             filter = Q()
             
-            if not empty(tag): filter &= Q(tag__icontains=tag)
-            if not empty(name): filter &= Q(name__icontains=name)
+            # case insensitive prefix filters, or exact with 'exact=true'
+            if not empty(tag): filter &= prefix_filter("tag", tag, exact=exact)
+            if not empty(name): filter &= prefix_filter("name", name, exact=exact)
             if not empty(num): filter &= Q(num_matches=num)
             if not empty(score_from): filter &= Q(score__gte=score_from)
             if not empty(score_to): filter &= Q(score__lte=score_to)
             if empty(archived) and not archived: filter &= Q(archived=archived)
             
+            # keyset pagination, opt-in with the 'cursor' parameter (empty for the first page)
+            if "cursor" in request.args:
+                clans, next_cursor = cursor_page(Clan.objects(filter), request.args.get("cursor"),
+                                             sort_by=sort_by, desc=not empty(desc) and desc, limit=limit,
+                                             offset=offset, fields=fields, count=request.args.get("count"))
+                return get_response({
+                    "clans": clans,
+                    "meta": {
+                        "count": len(clans),
+                        "next_cursor": next_cursor
+                    }
+                })
+
+            # the page and the counts in one meta block, opt-in with the 'count' parameter
+            if "count" in request.args:
+                if not empty(desc) and desc:
+                    ordered = Clan.objects(filter).order_by(f"-{sort_by}")
+                else:
+                    ordered = Clan.objects(filter).order_by(f"+{sort_by}")
+                return page_response(ordered, "clans", limit=limit, offset=offset,
+                                     count=request.args.get("count"), fields=fields)
+
             if not empty(desc) and desc:
                 clans = Clan.objects(filter).only(*fields).limit(limit).skip(offset).order_by(f"-{sort_by}")
                 return get_response(clans)
@@ -182,6 +218,8 @@ class ClansApi(Resource):
             clan = Clan(**request.get_json())
             # todo - validate
             clan = clan.save()
+            data_changed("clans", clans=[str(clan.id)])
+            get_clan_cache().written([clan.id])
 
         except NotUniqueError:
             return handle_error(f"clan already exists in database: {clan.tag}", 400)
@@ -239,7 +277,7 @@ class DiscordRoleApi(Resource):
     # rid = role id
     def get(self, rid):
         try:
-            clan = Clan.objects.get(role_id=rid)
+            clan = get_clan_cache().by_role_id(rid)
             return get_response(clan)
 
         except DoesNotExist:
@@ -289,7 +327,10 @@ class ConsoleClanApi(Resource):
             clan_qs = ConsoleClan.objects(id=oid)
             # can also be upsert_one or update, more important is that we do this on a QuerySet
             # and not on a Document
-            res = clan_qs.update_one(upsert=True, last_updated=datetime.now(), **request.get_json(), full_result=True)
+            res = clan_qs.update_one(upsert=True, last_updated=datetime.now(), **request.get_json(),
+                                  **shadow_values(ConsoleClan, request.get_json()), full_result=True)
+            data_changed("clans", console=True, clans=[oid])
+            get_clan_cache(console=True).written([oid])
             if res.raw_result.get("updatedExisting"):
                 return get_response({"message": f"replaced clan with id: {oid}"}, 200)
 
@@ -307,7 +348,10 @@ class ConsoleClanApi(Resource):
     def patch(self, oid):
         try:
             clan = ConsoleClan.objects.get(id=oid)
-            clan.update(last_updated=datetime.now(), **request.get_json())
+            clan.update(last_updated=datetime.now(), **request.get_json(),
+                        **shadow_values(ConsoleClan, request.get_json()))
+            data_changed("clans", console=True, clans=[oid])
+            get_clan_cache(console=True).written([oid])
 
         except BadRequest:
             return handle_error("Bad Request", 400)
@@ -328,6 +372,8 @@ class ConsoleClanApi(Resource):
         try:
             clan = ConsoleClan.objects.get(id=oid)        
             clan = clan.delete()
+            data_changed("clans", console=True, clans=[oid])
+            get_clan_cache(console=True).written([oid])
 
         except OperationError:
             return handle_error(f"Authorization failed", 401)
@@ -363,6 +409,8 @@ class ConsoleClansApi(Resource):
             sort_by = request.args.get("sort_by", default=None, type=str)
             # descending order
             desc = request.args.get("desc", default=None, type=str)
+            # exact instead of prefix matches for the text filters
+            exact = request.args.get("exact", default="").lower() in ("true", "1")
 
             # optional, narrows the return to selected fields
             # should be a comma separated list
@@ -376,13 +424,36 @@ class ConsoleClansApi(Resource):
             # for every query parameter one by one
             filter = Q()
             
-            if not empty(tag): filter &= Q(tag__icontains=tag)
-            if not empty(name): filter &= Q(name__icontains=name)
+            # case insensitive prefix filters, or exact with 'exact=true'
+            if not empty(tag): filter &= prefix_filter("tag", tag, exact=exact)
+            if not empty(name): filter &= prefix_filter("name", name, exact=exact)
             if not empty(num): filter &= Q(num_matches=num)
             if not empty(score_from): filter &= Q(score__gte=score_from)
             if not empty(score_to): filter &= Q(score__lte=score_to)
             if empty(archived) and not archived: filter &= Q(archived=archived)
             
+            # keyset pagination, opt-in with the 'cursor' parameter (empty for the first page)
+            if "cursor" in request.args:
+                clans, next_cursor = cursor_page(ConsoleClan.objects(filter), request.args.get("cursor"),
+                                             sort_by=sort_by, desc=not empty(desc) and desc, limit=limit,
+                                             offset=offset, fields=fields, count=request.args.get("count"))
+                return get_response({
+                    "clans": clans,
+                    "meta": {
+                        "count": len(clans),
+                        "next_cursor": next_cursor
+                    }
+                })
+
+            # the page and the counts in one meta block, opt-in with the 'count' parameter
+            if "count" in request.args:
+                if not empty(desc) and desc:
+                    ordered = ConsoleClan.objects(filter).order_by(f"-{sort_by}")
+                else:
+                    ordered = ConsoleClan.objects(filter).order_by(f"+{sort_by}")
+                return page_response(ordered, "clans", limit=limit, offset=offset,
+                                     count=request.args.get("count"), fields=fields)
+
             if not empty(desc) and desc:
                 clans = ConsoleClan.objects(filter).only(*fields).limit(limit).skip(offset).order_by(f"-{sort_by}")
                 return get_response(clans)
@@ -408,6 +479,8 @@ class ConsoleClansApi(Resource):
             clan = ConsoleClan(**request.get_json())
             # todo - validate
             clan = clan.save()
+            data_changed("clans", console=True, clans=[str(clan.id)])
+            get_clan_cache(console=True).written([clan.id])
 
         except NotUniqueError:
             return handle_error(f"clan already exists in database: {clan.tag}", 400)
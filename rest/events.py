@@ -1,6 +1,7 @@
 # rest/events.py
 from flask import request
 from flask_restful import Resource
+from logic.data_state import data_changed
 from models.event import Event
 from mongoengine.errors import NotUniqueError
 
@@ -25,6 +26,7 @@ class EventApi(Resource):
             event = Event.objects.get(id=oid)
             try:
                 event.update(**request.get_json())
+                data_changed("events", clans=())
                 return '', 204
             except:
                 return handle_error(f"error updating event in database: {event.tag}")
@@ -38,6 +40,7 @@ class EventApi(Resource):
             event = Event.objects.get(id=oid)
             try:
                 event = event.delete()
+                data_changed("events", clans=())
                 return '', 204
             except:
                 return handle_error(f"error deleting event in database: {event.tag}")
@@ -72,6 +75,7 @@ class EventsApi(Resource):
             event = Event(**request.get_json())
             try:
                 event = event.save()
+                data_changed("events", clans=())
                 return get_response({ "id": event.id })
             except NotUniqueError:
                 return handle_error(f"event already exists in database: {event.tag}")
@@ -0,0 +1,125 @@
+# rest/export.py
+import csv
+import io
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from flask import Response, request
+from flask_restful import Resource
+from mongoengine.queryset.visitor import Q
+from werkzeug.exceptions import BadRequest
+
+from database.db import exclude_shadow_fields, shadow_db_fields
+from logic.data_state import last_modified
+from models.match import Match
+from models.score import Score
+from models.console.console_match import ConsoleMatch
+from models.console.console_score import ConsoleScore
+from schemas.query_schemas import ExportQuerySchema
+from ._common import empty, export_required, handle_error, stream_response, validate_schema
+
+
+# the whole collection (or a date range) from one cursor in natural _id order,
+# as NDJSON (default) or CSV, 304 if nothing has been written since 'If-Modified-Since'
+def export(document, date_field, collection, console=False):
+    try:
+        validate_schema(ExportQuerySchema(), request.args)
+        format = request.args.get("format", default="ndjson")
+        date_from = request.args.get("date_from")
+        date_to = request.args.get("date_to")
+
+        modified = last_modified(collection, console=console)
+        since = request.if_modified_since
+        if modified is not None and since is not None \
+                and modified.replace(microsecond=0) <= since.replace(tzinfo=None):
+            response = Response(status=304)
+            response.last_modified = modified
+            return response
+
+        filter = Q()
+        if not empty(date_from):
+            filter &= Q(**{f"{date_field}__gte": datetime(*[int(d) for d in date_from.split("-")])})
+        if not empty(date_to):
+            # the whole day of 'date_to'
+            date_to = datetime(*[int(d) for d in date_to.split("-")]) + timedelta(days=1)
+            filter &= Q(**{f"{date_field}__lt": date_to})
+        docs = exclude_shadow_fields(document.objects(filter)).order_by("+id").batch_size(1000).as_pymongo()
+
+        if format == "csv":
+            response = Response(_csv_lines(document, docs), mimetype="text/csv")
+        else:
+            response = stream_response(docs, batch_size=1000, ndjson=True)
+        response.last_modified = modified
+        response.headers["Content-Disposition"] = f"attachment; filename={collection}.{format}"
+        return response
+
+    except BadRequest as e:
+        # TODO: better error response
+        return handle_error(f"Bad Request, terminated with: {e}", 400)
+    except Exception as e:
+        return handle_error(f"error exporting {collection}, terminated with error: {e}", 500)
+
+
+def _csv_lines(document, docs, batch_size=1000):
+    # one column per field of the model, lists are joined with ';'
+    shadow = shadow_db_fields(document)
+    columns = ["_id"] + [document._fields[f].db_field for f in document._fields_ordered
+                         if f != "id" and document._fields[f].db_field not in shadow]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for i, doc in enumerate(docs, 1):
+        writer.writerow([_csv_value(doc.get(c)) for c in columns])
+        if i % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        return ";".join(str(_csv_value(v)) for v in value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    return value
+
+
+###############################################
+#                   PC APIs                   #
+###############################################
+
+class ExportMatchesApi(Resource):
+
+    @export_required()
+    def get(self):
+        return export(Match, "date", "matches")
+
+
+class ExportScoresApi(Resource):
+
+    @export_required()
+    def get(self):
+        return export(Score, "_created_at", "scores")
+
+
+###############################################
+#                CONSOLE APIs                 #
+###############################################
+
+class ConsoleExportMatchesApi(Resource):
+
+    @export_required()
+    def get(self):
+        return export(ConsoleMatch, "date", "matches", console=True)
+
+
+class ConsoleExportScoresApi(Resource):
+
+    @export_required()
+    def get(self):
+        return export(ConsoleScore, "_created_at", "scores", console=True)
@@ -1,14 +1,17 @@
 # rest/matches.py
-import json
+import logging
 from datetime import datetime
 from urllib.parse import urlparse
 
 import requests
+from database.db import shadow_values
 from flask import current_app, request
 from flask_jwt_extended import get_jwt_identity, jwt_required
 from flask_restful import Resource
-from logic.calculations import calc_scores
-from logic.recalculations import start_recalculation
+from logic._getter import get_clan_objects
+from logic.clan_stats import refresh_clan_stats
+from logic.data_state import data_changed
+from logic.recalculation_jobs import confirm_match, submit_recalculation
 from models.clan import Clan
 from models.console.console_match import ConsoleMatch
 from models.match import Match, Type
@@ -19,8 +22,15 @@ from mongoengine.queryset.visitor import Q
 from schemas.query_schemas import MatchQuerySchema
 from werkzeug.exceptions import BadRequest
 
-from ._common import (admin_required, empty, get_jwt, get_response,
-                      handle_error, validate_schema)
+from ._common import (admin_required, cursor_page, empty, get_jwt,
+                      get_response, handle_error, page_response,
+                      prefix_filter, validate_schema)
+
+# oids of the clans of a match, before and after an update with 'changes'
+def _clan_ids(match, changes=None):
+    changes = changes or {}
+    return match.clans1_ids + match.clans2_ids + changes.get("clans1_ids", []) + changes.get("clans2_ids", [])
+
 
 ###############################################
 #                   PC APIs                   #
@@ -48,11 +58,18 @@ class MatchApi(Resource):
             match.validate()
             # must be a QuerySet, therefore no get()
             match_qs = Match.objects(match_id=match_id)
-            res = match_qs.update_one(upsert=True, **request.get_json(), full_result=True)
+            replaced = match_qs.only("clans1_ids", "clans2_ids", "score_posted").first()
+            res = match_qs.update_one(upsert=True, **request.get_json(),
+                                   **shadow_values(Match, request.get_json()), full_result=True)
+            # the clans of a replaced match are unknown, all pages are affected
+            data_changed("matches")
             # load Match object for the logic instead of working with the QuerySet
             match = Match.objects.get(match_id=match_id)
+            # the statistics of a posted match are rebuilt, they cannot be counted again
+            if match.score_posted or (replaced is not None and replaced.score_posted):
+                refresh_clan_stats(_clan_ids(match) + (_clan_ids(replaced) if replaced is not None else []))
             if not match.needs_confirmations() and not match.score_posted:
-                err = calc_scores(match)
+                err = confirm_match(match)
                 if err is not None: raise ValueError
 
             if res.raw_result.get("updatedExisting"):
@@ -74,13 +91,19 @@ class MatchApi(Resource):
         """
         try:
             match = Match.objects.get(match_id=match_id)
-            match.update(**request.get_json())
+            clan_ids = _clan_ids(match, request.get_json())
+            match.update(**request.get_json(), **shadow_values(Match, request.get_json()))
+            data_changed("matches", clans=clan_ids, matches=[match_id])
+            # the statistics of a posted match are rebuilt, e.g. after a change of the map or the caps
+            if match.score_posted:
+                refresh_clan_stats(clan_ids)
             match.reload()
 
             if not match.needs_confirmations() and not match.score_posted:
-                err = calc_scores(match)
+                err = confirm_match(match)
                 if err is not None: raise ValueError
-                print("match confirmed")
+                # the calculation is queued while a recalculation runs (confirm_match logs it)
+                if match.score_posted: logging.info(f"match confirmed: {match.match_id}")
 
             claims = get_jwt()
             # if an admin starts a recalculation process
@@ -89,8 +112,8 @@ class MatchApi(Resource):
                 if "ADMIN" not in claims.get("roles"):
                     raise OperationError
                 else:
-                    start_recalculation(match)
-                    print("match and scores recalculated")
+                    job = submit_recalculation(match, requested_by=get_jwt_identity())
+                    return get_response({"job_id": str(job.id)}, 202)
 
         except DoesNotExist:
             return handle_error(f"error updating match in database, match not found by oid: {match_id}", 404)
@@ -124,6 +147,9 @@ class MatchApi(Resource):
                 return handle_error("object does not exist", 404)
 
             match.delete()
+            data_changed("matches", clans=_clan_ids(match), matches=[match_id])
+            if match.score_posted:
+                refresh_clan_stats(_clan_ids(match))
 
         except ValidationError:
             return handle_error("not a valid object id", 400)
@@ -163,6 +189,8 @@ class MatchesApi(Resource):
             sort_by = request.args.get("sort_by", default=None, type=str)
             # descending order
             desc = request.args.get("desc", default=None, type=str)
+            # exact instead of prefix matches for the text filters
+            exact = request.args.get("exact", default="").lower() in ("true", "1")
 
             date = request.args.get("date")
             date_from = request.args.get("date_from")
@@ -184,17 +212,18 @@ class MatchesApi(Resource):
             # for every query parameter one by one
             filter = Q()
 
-            if not empty(match_id): filter &= Q(match_id__icontains=match_id)
+            # case insensitive prefix filters, or exact with 'exact=true'
+            if not empty(match_id): filter &= prefix_filter("match_id", match_id, exact=exact)
             for id in clan_ids:
                 if not empty(id): filter &= (Q(clans1_ids=id) | Q(clans2_ids=id))
             if not empty(caps): filter &= (Q(caps1=caps) | Q(caps2=caps))
             if not empty(caps_from): filter &= (Q(caps1__gte=caps_from) | Q(caps2__gte=caps_from))
-            if not empty(map): filter &= Q(map__icontains=map)
+            if not empty(map): filter &= prefix_filter("map", map, exact=exact)
             if not empty(duration_from): filter &= Q(duration__gte=duration_from)
             if not empty(duration_to): filter &= Q(duration__lte=duration_to)
             if not empty(factor): filter &= Q(factor=factor)
             if not empty(conf): filter &= (Q(conf1=conf) | Q(conf2=conf))
-            if not empty(event): filter &= Q(event__icontains=event)
+            if not empty(event): filter &= prefix_filter("event", event, exact=exact)
             if not empty(side):
                 if len(clan_ids) > 0:
                     # if a side has been specified, the clan id must be on that side
@@ -211,11 +240,27 @@ class MatchesApi(Resource):
             if not empty(date_to): filter &= Q(date__lte=date_to)
 
             filtered = Match.objects(filter)
-            limited = filtered.only(*fields).limit(limit).skip(offset)
+
+            # keyset pagination, opt-in with the 'cursor' parameter (empty for the first page)
+            if "cursor" in request.args:
+                matches, next_cursor = cursor_page(filtered, request.args.get("cursor"), sort_by=sort_by,
+                                                   desc=not empty(desc) and desc, limit=limit,
+                                                   offset=offset, fields=fields, count=request.args.get("count"))
+                return get_response({
+                    'matches': matches,
+                    'meta': {
+                        'count': len(matches),
+                        'next_cursor': next_cursor,
+                    },
+                })
+
             if not empty(desc) and desc:
-                matches = limited.order_by(f"-{sort_by}")
+                ordered = filtered.order_by(f"-{sort_by}")
             else:
-                matches = limited.order_by(f"+{sort_by}")
+                ordered = filtered.order_by(f"+{sort_by}")
+            # the page and the counts in one round trip, unbounded listings are streamed
+            return page_response(ordered, 'matches', limit=limit, offset=offset,
+                                 count=request.args.get("count", default="exact"), fields=fields)
 
         except BadRequest as e:
             # TODO: better error response
@@ -224,15 +269,6 @@ class MatchesApi(Resource):
             return handle_error(f"cannot resolve field 'select={select}'", 400)
         except Exception as e:
             return handle_error(f"error getting matches, terminated with error: {e}", 500)
-        else:
-            return get_response({
-                'matches': json.loads(matches.to_json()),
-                'meta': {
-                    'count': matches.count(True),
-                    'offset': offset,
-                    'total_count': filtered.count(False),
-                },
-            })
 
     # add new match
     @admin_required()
@@ -243,11 +279,12 @@ class MatchesApi(Resource):
             match.conf2 = ""
             match.score_posted = False
             match = match.save()
+            data_changed("matches", clans=_clan_ids(match), matches=[match.match_id])
 
             claims = get_jwt()
             if Role.Admin.value in claims["roles"]:
                 match.conf2 = get_jwt_identity()
-                err = calc_scores(match)
+                err = confirm_match(match)
                 if err is not None:
                     raise ValueError
 
@@ -284,8 +321,9 @@ class MatchesNotificationApi(Resource):
         if match.type == Type.Competitive:
             event_comment = " (%s)" % match.event
 
-        axis = self.__clan_player_count(match.player_dist1, Clan.objects(id__in=match.clans1_ids), match.players)
-        allies = self.__clan_player_count(match.player_dist2, Clan.objects(id__in=match.clans2_ids), match.players)
+        clans1, clans2 = get_clan_objects(match)
+        axis = self.__clan_player_count(match.player_dist1, clans1, match.players)
+        allies = self.__clan_player_count(match.player_dist2, clans2, match.players)
 
         caps = "/".join(match.strongpoints)
         fields = [
@@ -338,6 +376,8 @@ class MatchesNotificationApi(Resource):
             )
             if res.status_code != 204:
                 return handle_error(f"error while posting result: {res.text}", 500)
+        except DoesNotExist as e:
+            return handle_error(f"{e}", 404)
         except NotUniqueError:
             return handle_error("match already exists in database", 400)
         except ValidationError as e:
@@ -378,13 +418,21 @@ class ConsoleMatchApi(Resource):
             match.validate()
             # must be a QuerySet, therefore no get()
             match_qs = ConsoleMatch.objects(match_id=match_id)
-            res = match_qs.update_one(upsert=True, **request.get_json(), full_result=True)
+            replaced = match_qs.only("clans1_ids", "clans2_ids", "score_posted").first()
+            res = match_qs.update_one(upsert=True, **request.get_json(),
+                                   **shadow_values(ConsoleMatch, request.get_json()), full_result=True)
+            # the clans of a replaced match are unknown, all pages are affected
+            data_changed("matches", console=True)
             # load Match object for the logic instead of working with the QuerySet
             match = ConsoleMatch.objects.get(match_id=match_id)
+            # the statistics of a posted match are rebuilt, they cannot be counted again
+            if match.score_posted or (replaced is not None and replaced.score_posted):
+                refresh_clan_stats(_clan_ids(match) + (_clan_ids(replaced) if replaced is not None else []), console=True)
             if not match.needs_confirmations() and not match.score_posted:
-                err = calc_scores(match, console=True)
+                err = confirm_match(match, console=True)
                 if err is not None: raise ValueError
-                print("match confirmed")
+                # the calculation is queued while a recalculation runs (confirm_match logs it)
+                if match.score_posted: logging.info(f"match confirmed: {match.match_id}")
 
             if res.raw_result.get("updatedExisting"):
                 return get_response({"message": f"replaced match with id: {match_id}"}, 200)
@@ -405,13 +453,19 @@ class ConsoleMatchApi(Resource):
         """
         try:
             match = ConsoleMatch.objects.get(match_id=match_id)
-            match.update(**request.get_json())
+            clan_ids = _clan_ids(match, request.get_json())
+            match.update(**request.get_json(), **shadow_values(ConsoleMatch, request.get_json()))
+            data_changed("matches", console=True, clans=clan_ids, matches=[match_id])
+            # the statistics of a posted match are rebuilt, e.g. after a change of the map or the caps
+            if match.score_posted:
+                refresh_clan_stats(clan_ids, console=True)
             match.reload()
 
             if not match.needs_confirmations() and not match.score_posted:
-                err = calc_scores(match, console=True)
+                err = confirm_match(match, console=True)
                 if err is not None: raise ValueError
-                print("match confirmed")
+                # the calculation is queued while a recalculation runs (confirm_match logs it)
+                if match.score_posted: logging.info(f"match confirmed: {match.match_id}")
 
             claims = get_jwt()
             # if an admin starts a recalculation process
@@ -420,8 +474,8 @@ class ConsoleMatchApi(Resource):
                 if not "ADMIN" in claims.get("roles"):
                     raise OperationError
                 else:
-                    start_recalculation(match, console=True)
-                    print("match and scores recalculated")
+                    job = submit_recalculation(match, console=True, requested_by=get_jwt_identity())
+                    return get_response({"job_id": str(job.id)}, 202)
 
         except DoesNotExist:
             return handle_error(f"error updating match in database, match not found by oid: {match_id}", 404)
@@ -438,6 +492,9 @@ class ConsoleMatchApi(Resource):
         try:
             match = ConsoleMatch.objects.get(match_id=match_id)
             match.delete()
+            data_changed("matches", console=True, clans=_clan_ids(match), matches=[match_id])
+            if match.score_posted:
+                refresh_clan_stats(_clan_ids(match), console=True)
 
         except ValidationError:
             return handle_error("not a valid object id", 400)
@@ -478,6 +535,8 @@ class ConsoleMatchesApi(Resource):
             sort_by = request.args.get("sort_by", default=None, type=str)
             # descending order
             desc = request.args.get("desc", default=None, type=str)
+            # exact instead of prefix matches for the text filters
+            exact = request.args.get("exact", default="").lower() in ("true", "1")
 
             date = request.args.get("date")
             date_from = request.args.get("date_from")
@@ -499,17 +558,18 @@ class ConsoleMatchesApi(Resource):
             # for every query parameter one by one
             filter = Q()
 
-            if not empty(match_id): filter &= Q(match_id__icontains=match_id)
+            # case insensitive prefix filters, or exact with 'exact=true'
+            if not empty(match_id): filter &= prefix_filter("match_id", match_id, exact=exact)
             for id in clan_ids:
                 if not empty(id): filter &= (Q(clans1_ids=id) | Q(clans2_ids=id))
             if not empty(caps): filter &= (Q(caps1=caps) | Q(caps2=caps))
             if not empty(caps_from): filter &= (Q(caps1__gte=caps_from) | Q(caps2__gte=caps_from))
-            if not empty(map): filter &= Q(map__icontains=map)
+            if not empty(map): filter &= prefix_filter("map", map, exact=exact)
             if not empty(duration_from): filter &= Q(duration__gte=duration_from)
             if not empty(duration_to): filter &= Q(duration__lte=duration_to)
             if not empty(factor): filter &= Q(factor=factor)
             if not empty(conf): filter &= (Q(conf1=conf) | Q(conf2=conf))
-            if not empty(event): filter &= Q(event__icontains=event)
+            if not empty(event): filter &= prefix_filter("event", event, exact=exact)
 
             if not empty(date): filter &= Q(date=date)
             # TODO: lesbares Datumsformat bei Anfrage mit Konvertierung
@@ -517,6 +577,28 @@ class ConsoleMatchesApi(Resource):
             if not empty(date_from): filter &= Q(date__gte=date_from)
             if not empty(date_to): filter &= Q(date__lte=date_to)
 
+            # keyset pagination, opt-in with the 'cursor' parameter (empty for the first page)
+            if "cursor" in request.args:
+                matches, next_cursor = cursor_page(ConsoleMatch.objects(filter), request.args.get("cursor"),
+                                                   sort_by=sort_by, desc=not empty(desc) and desc, limit=limit,
+                                                   offset=offset, fields=fields, count=request.args.get("count"))
+                return get_response({
+                    'matches': matches,
+                    'meta': {
+                        'count': len(matches),
+                        'next_cursor': next_cursor,
+                    },
+                })
+
+            # the page and the counts in one meta block, opt-in with the 'count' parameter
+            if "count" in request.args:
+                if not empty(desc) and desc:
+                    ordered = ConsoleMatch.objects(filter).order_by(f"-{sort_by}")
+                else:
+                    ordered = ConsoleMatch.objects(filter).order_by(f"+{sort_by}")
+                return page_response(ordered, 'matches', limit=limit, offset=offset,
+                                     count=request.args.get("count"), fields=fields)
+
             if not empty(desc) and desc:
                 matches = ConsoleMatch.objects(filter).only(*fields).limit(limit).skip(offset).order_by(f"-{sort_by}")
                 return get_response(matches)
@@ -542,11 +624,12 @@ class ConsoleMatchesApi(Resource):
             match.conf2 = ""
             match.score_posted = False
             match = match.save()
+            data_changed("matches", console=True, clans=_clan_ids(match), matches=[match.match_id])
 
             claims = get_jwt()
             if Role.Admin.value in claims["roles"]:
                 match.conf2 = get_jwt_identity()
-                err = calc_scores(match, console=True)
+                err = confirm_match(match, console=True)
                 if err is not None:
                     raise ValueError
 
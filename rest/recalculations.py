@@ -0,0 +1,105 @@
+# rest/recalculations.py
+from flask import request
+from flask_restful import Resource
+from logic.recalculations import preview_recalculation
+from models.match import Match
+from models.recalculation_job import RecalculationJob
+from models.console.console_match import ConsoleMatch
+from models.console.console_recalculation_job import ConsoleRecalculationJob
+from mongoengine.errors import DoesNotExist, FieldDoesNotExist, ValidationError
+
+from ._common import admin_required, get_response, handle_error
+
+
+# the match of a preview: the stored match with the fields of the request, a new match,
+# or the stored match that would be deleted ('delete': true)
+def _preview_match(match_obj, body):
+    body = dict(body)
+    removed = body.pop("delete", False)
+    if not body.get("match_id"):
+        raise ValidationError("field 'match_id' is required")
+    stored = match_obj.objects(match_id=body["match_id"]).first()
+    if removed:
+        if stored is None:
+            raise DoesNotExist(f"match not found: {body['match_id']}")
+        return stored, True
+    fields = stored.to_mongo().to_dict() if stored is not None else {}
+    fields.pop("_id", None)
+    match = match_obj(**{**fields, **body})
+    match.validate()
+    # converted like a stored match, e.g. the date
+    return match_obj._from_son(match.to_mongo()), False
+
+
+class RecalculationJobApi(Resource):
+
+    # status and progress of a recalculation job (replayed / total matches)
+    @admin_required()
+    def get(self, job_id):
+        try:
+            job = RecalculationJob.objects(id=job_id).exclude("match_ids").as_pymongo().first()
+            if job is None:
+                raise DoesNotExist
+            return get_response(job)
+        except ValidationError:
+            return handle_error("not a valid object id", 400)
+        except DoesNotExist:
+            return handle_error("object does not exist", 404)
+        except Exception as e:
+            return handle_error(f"error getting recalculation job, terminated with error: {e}", 500)
+
+
+class ConsoleRecalculationJobApi(Resource):
+
+    # status and progress of a recalculation job (replayed / total matches)
+    @admin_required()
+    def get(self, job_id):
+        try:
+            job = ConsoleRecalculationJob.objects(id=job_id).exclude("match_ids").as_pymongo().first()
+            if job is None:
+                raise DoesNotExist
+            return get_response(job)
+        except ValidationError:
+            return handle_error("not a valid object id", 400)
+        except DoesNotExist:
+            return handle_error("object does not exist", 404)
+        except Exception as e:
+            return handle_error(f"error getting recalculation job, terminated with error: {e}", 500)
+
+
+class RecalculationPreviewApi(Resource):
+
+    # what a recalculation after an edit, insertion or deletion of a match would change,
+    # nothing is written
+    @admin_required()
+    def post(self):
+        try:
+            match, removed = _preview_match(Match, request.get_json() or {})
+            return get_response(preview_recalculation(match, removed=removed))
+        except (ValidationError, FieldDoesNotExist) as e:
+            return handle_error(f"validation failed: {e}", 400)
+        except DoesNotExist as e:
+            return handle_error(f"object does not exist: {e}", 404)
+        except (RuntimeError, ValueError) as e:
+            return handle_error(f"{e} - calculations went wrong", 400)
+        except Exception as e:
+            return handle_error(f"error previewing recalculation, terminated with error: {e}", 500)
+
+
+class ConsoleRecalculationPreviewApi(Resource):
+
+    # what a recalculation after an edit, insertion or deletion of a match would change,
+    # nothing is written
+    @admin_required()
+    def post(self):
+        try:
+            match, removed = _preview_match(ConsoleMatch, request.get_json() or {})
+            return get_response(preview_recalculation(match, console=True, removed=removed))
+        except (ValidationError, FieldDoesNotExist) as e:
+            return handle_error(f"validation failed: {e}", 400)
+        except DoesNotExist as e:
+            return handle_error(f"object does not exist: {e}", 404)
+        except (RuntimeError, ValueError) as e:
+            return handle_error(f"{e} - calculations went wrong", 400)
+        except Exception as e:
+            return handle_error(f"error previewing recalculation, terminated with error: {e}", 500)
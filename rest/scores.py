@@ -5,10 +5,13 @@ from mongoengine import Q
 from mongoengine.errors import LookUpError, ValidationError, DoesNotExist, OperationError
 from werkzeug.exceptions import BadRequest
 
+from logic.checkpoints import scores_written
+from logic.clan_stats import refresh_clan_stats
+from logic.data_state import data_changed
 from models.score import Score
 from models.console.console_score import ConsoleScore
 from schemas.query_schemas import ScoreQuerySchema
-from ._common import get_response, handle_error, empty, admin_required, validate_schema
+from ._common import get_response, handle_error, empty, admin_required, validate_schema, cursor_page, page_response
 
 
 ###############################################
@@ -41,7 +44,13 @@ class ScoreApi(Resource):
             score = Score(**request.get_json())
             score.validate()
             scores_qs = Score.objects(id=oid)
+            replaced = scores_qs.only("match_id").as_pymongo().first()
             res = scores_qs.update_one(upsert=True, **request.get_json(), full_result=True)
+            # the clan of a replaced score is unknown, all pages are affected
+            scores_written()
+            # the opponents' strength in the statistics
+            refresh_clan_stats(match_ids=[score.match_id] + ([replaced["match_id"]] if replaced is not None else []))
+            data_changed("scores")
             if res.raw_result.get("updatedExisting"):
                 return get_response({"message": f"replaced score with id: {oid}"}, 200)
 
@@ -57,7 +66,11 @@ class ScoreApi(Resource):
     def patch(self, oid):
         try:
             scores = Score.objects.get(id=oid)
+            scores.id = oid # work around objects.get() not returning an ObjectId
             scores.update(**request.get_json())
+            scores_written()
+            data_changed("scores", clans=[scores.clan, request.get_json().get("clan", scores.clan)])
+            refresh_clan_stats(match_ids=[scores.match_id, request.get_json().get("match_id", scores.match_id)])
 
         except ValidationError:
                 return handle_error("not a valid object id", 400)
@@ -74,7 +87,11 @@ class ScoreApi(Resource):
     def delete(self, oid):
         try:
             scores = Score.objects.get(id=oid)
-            scores = scores.delete()
+            scores.id = oid # work around objects.get() not returning an ObjectId
+            scores.delete()
+            scores_written()
+            data_changed("scores", clans=[scores.clan])
+            refresh_clan_stats(match_ids=[scores.match_id])
 
         except ValidationError:
                 return handle_error("not a valid object id", 400)
@@ -123,6 +140,28 @@ class ScoresApi(Resource):
             if not empty(score_from): filter &= Q(score__gte=score_from)
             if not empty(score_to): filter &= Q(score__lte=score_from)
 
+            # keyset pagination, opt-in with the 'cursor' parameter (empty for the first page)
+            if "cursor" in request.args:
+                scores, next_cursor = cursor_page(Score.objects(filter), request.args.get("cursor"),
+                                             sort_by=sort_by, desc=not empty(desc) and desc, limit=limit,
+                                             offset=offset, fields=fields, count=request.args.get("count"))
+                return get_response({
+                    "scores": scores,
+                    "meta": {
+                        "count": len(scores),
+                        "next_cursor": next_cursor
+                    }
+                })
+
+            # the page and the counts in one meta block, opt-in with the 'count' parameter
+            if "count" in request.args:
+                if not empty(desc) and desc:
+                    ordered = Score.objects(filter).order_by(f"-{sort_by}")
+                else:
+                    ordered = Score.objects(filter).order_by(f"+{sort_by}")
+                return page_response(ordered, "scores", limit=limit, offset=offset,
+                                     count=request.args.get("count"), fields=fields)
+
             if not empty(desc) and desc:
                 scores = Score.objects(filter).only(*fields).limit(limit).skip(offset).order_by(f"-{sort_by}")
                 return get_response(scores)
@@ -148,6 +187,9 @@ class ScoresApi(Resource):
             if "_created_at" in request.get_json().keys(): raise ValidationError("private field '_created_at' must not be set")
             score = Score(**request.get_json())
             score = score.save()
+            scores_written()
+            data_changed("scores", clans=[score.clan])
+            refresh_clan_stats(match_ids=[score.match_id])
 
         except ValidationError as e:
             return handle_error(f"validation failed: {e}", 400)
@@ -188,7 +230,13 @@ class ConsoleScoreApi(Resource):
             score = ConsoleScore(**request.get_json())
             score.validate()
             scores_qs = ConsoleScore.objects(id=oid)
+            replaced = scores_qs.only("match_id").as_pymongo().first()
             res = scores_qs.update_one(upsert=True, **request.get_json(), full_result=True)
+            # the clan of a replaced score is unknown, all pages are affected
+            scores_written(console=True)
+            # the opponents' strength in the statistics
+            refresh_clan_stats(match_ids=[score.match_id] + ([replaced["match_id"]] if replaced is not None else []), console=True)
+            data_changed("scores", console=True)
             if res.raw_result.get("updatedExisting"):
                 return get_response({"message": f"replaced score with id: {oid}"}, 200)
 
@@ -204,7 +252,11 @@ class ConsoleScoreApi(Resource):
     def patch(self, oid):
         try:
             scores = ConsoleScore.objects.get(id=oid)
+            scores.id = oid # work around objects.get() not returning an ObjectId
             scores.update(**request.get_json())
+            scores_written(console=True)
+            data_changed("scores", console=True, clans=[scores.clan, request.get_json().get("clan", scores.clan)])
+            refresh_clan_stats(match_ids=[scores.match_id, request.get_json().get("match_id", scores.match_id)], console=True)
 
         except ValidationError:
                 return handle_error("not a valid object id", 400)
@@ -223,6 +275,9 @@ class ConsoleScoreApi(Resource):
             score = ConsoleScore.objects.get(id=oid)
             score.id = oid # work around objects.get() not returning an ObjectId
             score.delete()
+            scores_written(console=True)
+            data_changed("scores", console=True, clans=[score.clan])
+            refresh_clan_stats(match_ids=[score.match_id], console=True)
 
         except ValidationError:
                 return handle_error("not a valid object id", 400)
@@ -271,6 +326,28 @@ class ConsoleScoresApi(Resource):
             if not empty(score_from): filter &= Q(score__gte=score_from)
             if not empty(score_to): filter &= Q(score__lte=score_from)
 
+            # keyset pagination, opt-in with the 'cursor' parameter (empty for the first page)
+            if "cursor" in request.args:
+                scores, next_cursor = cursor_page(ConsoleScore.objects(filter), request.args.get("cursor"),
+                                             sort_by=sort_by, desc=not empty(desc) and desc, limit=limit,
+                                             offset=offset, fields=fields, count=request.args.get("count"))
+                return get_response({
+                    "scores": scores,
+                    "meta": {
+                        "count": len(scores),
+                        "next_cursor": next_cursor
+                    }
+                })
+
+            # the page and the counts in one meta block, opt-in with the 'count' parameter
+            if "count" in request.args:
+                if not empty(desc) and desc:
+                    ordered = ConsoleScore.objects(filter).order_by(f"-{sort_by}")
+                else:
+                    ordered = ConsoleScore.objects(filter).order_by(f"+{sort_by}")
+                return page_response(ordered, "scores", limit=limit, offset=offset,
+                                     count=request.args.get("count"), fields=fields)
+
             if not empty(desc) and desc:
                 scores = ConsoleScore.objects(filter).only(*fields).limit(limit).skip(offset).order_by(f"-{sort_by}")
                 return get_response(scores)
@@ -296,6 +373,9 @@ class ConsoleScoresApi(Resource):
             if "_created_at" in request.get_json().keys(): raise ValidationError("private field '_created_at' must not be set")
             score = ConsoleScore(**request.get_json())
             score = score.save()
+            scores_written(console=True)
+            data_changed("scores", console=True, clans=[score.clan])
+            refresh_clan_stats(match_ids=[score.match_id], console=True)
 
         except ValidationError as e:
             return handle_error(f"validation failed: {e}", 400)
@@ -6,8 +6,7 @@ from mongoengine.errors import ValidationError, DoesNotExist
 
 from logic.helo_functions import get_new_scores, get_coop_scores,\
                     get_new_console_scores, get_console_coop_scores
-from models.clan import Clan
-from models.console.console_clan import ConsoleClan
+from logic._getter import get_clans
 from schemas.request_schemas import SimulationsSchema, ConsoleSimulationsSchema
 from schemas.query_schemas import SimulationsQuerySchema
 from ._common import get_response, handle_error, validate_schema
@@ -29,8 +28,9 @@ class SimulationsApi(Resource):
             ignore = ignore.split(",") if ignore is not None else []
 
             # get clans by their provided ids
-            clans1 = [Clan.objects.get(id=clan_id) for clan_id in request.get_json().get("clans1_ids")]
-            clans2 = [Clan.objects.get(id=clan_id) for clan_id in request.get_json().get("clans2_ids")]
+            clans1_ids = request.get_json().get("clans1_ids")
+            clans = get_clans(clans1_ids + request.get_json().get("clans2_ids"))
+            clans1, clans2 = clans[:len(clans1_ids)], clans[len(clans1_ids):]
 
             # competitive factor, if provided
             c = 1 if request.get_json().get("factor") is None else request.get_json().get("factor")
@@ -107,8 +107,9 @@ class ConsoleSimulationsApi(Resource):
             ignore = ignore.split(",") if ignore is not None else []
 
             # get clans by their provided ids
-            clans1 = [ConsoleClan.objects.get(id=clan_id) for clan_id in request.get_json().get("clans1_ids")]
-            clans2 = [ConsoleClan.objects.get(id=clan_id) for clan_id in request.get_json().get("clans2_ids")]
+            clans1_ids = request.get_json().get("clans1_ids")
+            clans = get_clans(clans1_ids + request.get_json().get("clans2_ids"), console=True)
+            clans1, clans2 = clans[:len(clans1_ids)], clans[len(clans1_ids):]
 
             # competitive factor, if provided
             c = 1 if request.get_json().get("factor") is None else request.get_json().get("factor")
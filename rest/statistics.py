@@ -4,18 +4,22 @@ from flask import send_file
 from flask_restful import Resource
 from marshmallow import ValidationError
 from werkzeug.exceptions import BadRequest
+from mongoengine.errors import DoesNotExist
 from mongoengine.queryset.visitor import Q
 import numpy as np
 import matplotlib.pyplot as plt
 import io
+from datetime import datetime
 import PIL
 
-from models.clan import Clan
-from models.console.console_clan import ConsoleClan
+from logic.clan_cache import get_clan_cache
+from logic.clan_stats import get_stats_cell
 from models.match import Match
+from models.score import Score
 from models.console.console_match import ConsoleMatch
+from models.console.console_score import ConsoleScore
 from models.console.console_image import ConsoleImage
-from schemas.query_schemas import StatisticsQuerySchema
+from schemas.query_schemas import StatisticsQuerySchema, PerformanceRatingQuerySchema
 from ._common import get_response, handle_error, empty, validate_schema
 
 
@@ -33,7 +37,7 @@ class WinrateApi(Resource):
             # for winrate per side, allowed values: Axis, Allies
             side = request.args.get("side")
 
-            clan = Clan.objects.get(id=oid)
+            clan = get_clan_cache().get(oid)
             # get all matches where the clan was either on side1 and caps1 > caps2 (condition 1)
             # or on side2 and caps1 < caps2 (condition 2)
             win_cond1 = Q(clans1_ids=str(clan.id)) & Q(caps1__gte=3)
@@ -43,27 +47,36 @@ class WinrateApi(Resource):
             side_cond1 = Q(clans1_ids=str(clan.id)) & Q(side1__iexact=side)
             side_cond2 = Q(clans2_ids=str(clan.id)) & Q(side2__iexact=side)
 
+            # only posted (confirmed) matches count, like in the materialized statistics
+            posted = Q(score_posted=True)
+
+            # the materialized statistics, if they have been built for the clan
+            cell = get_stats_cell(str(clan.id), map=map, side=side)
+
+            if cell is not None:
+                total, wins = cell["total"], cell["wins"]
+
             # only map is specified
-            if not empty(map) and empty(side):
+            elif not empty(map) and empty(side):
                 total = Match.objects((Q(clans1_ids=str(clan.id)) | Q(clans2_ids=str(clan.id)))
-                                        & Q(map__iexact=map)).count()
-                wins = Match.objects((win_cond1 | win_cond2) & Q(map__iexact=map)).count()
+                                        & Q(map__iexact=map) & posted).count()
+                wins = Match.objects((win_cond1 | win_cond2) & Q(map__iexact=map) & posted).count()
 
             # only side is specified
             elif not empty(side) and empty(map):
-                total = Match.objects(side_cond1 | side_cond2).count()
-                wins = Match.objects((win_cond1 | win_cond2) & (side_cond1 | side_cond2)).count()
+                total = Match.objects((side_cond1 | side_cond2) & posted).count()
+                wins = Match.objects((win_cond1 | win_cond2) & (side_cond1 | side_cond2) & posted).count()
 
             # map and side are specified
             elif not empty(map) and not empty(side):
-                total = Match.objects((side_cond1 | side_cond2) & Q(map__iexact=map)).count()
+                total = Match.objects((side_cond1 | side_cond2) & Q(map__iexact=map) & posted).count()
                 wins = Match.objects((win_cond1 | win_cond2) & (side_cond1 | side_cond2)
-                                    & Q(map__iexact=map)).count()
+                                    & Q(map__iexact=map) & posted).count()
 
             # neither map nor side is specified, user requested general winrate
             else:
                 total = clan.num_matches
-                wins = Match.objects((win_cond1 | win_cond2)).count()
+                wins = Match.objects((win_cond1 | win_cond2) & posted).count()
 
             return get_response({
                 "total": total,
@@ -85,6 +98,21 @@ class WinrateApi(Resource):
             return handle_error(f"error fetching items from database, terminated with error: {e}", 500)
 
 
+class WinrateBreakdownApi(Resource):
+
+    def get(self, oid):
+        try:
+            clan = get_clan_cache().get(oid)
+            breakdown = _winrate_breakdown(Match, str(clan.id))
+
+        except DoesNotExist:
+            return handle_error("object does not exist", 404)
+        except Exception as e:
+            return handle_error(f"error fetching items from database, terminated with error: {e}", 500)
+        else:
+            return get_response(breakdown)
+
+
 class ResultTypesApi(Resource):
 
     def get(self, oid):
@@ -95,41 +123,25 @@ class ResultTypesApi(Resource):
             # for winrate per side, allowed values: Axis, Allies
             side = request.args.get("side")
 
-            clan = Clan.objects.get(id=oid)
+            clan = get_clan_cache().get(oid)
 
             # if a side has been specified, the clan id must be on that side
             side_cond1 = Q(clans1_ids=str(clan.id)) & Q(side1__iexact=side)
             side_cond2 = Q(clans2_ids=str(clan.id)) & Q(side2__iexact=side)
 
-            filter = Q()
+            # only posted (confirmed) matches count, like in the materialized statistics
+            filter = Q(score_posted=True)
 
             if not empty(map): filter &= Q(map__iexact=map)
             if not empty(side): filter &= (side_cond1 | side_cond2)
 
-            # 5-0 victories
-            vic_5 = Match.objects(((Q(clans1_ids=str(clan.id)) & Q(caps1=5))
-                                        | (Q(clans2_ids=str(clan.id)) & Q(caps2=5)))
-                                        & filter).count()
-            # 4-1 victories
-            vic_4 = Match.objects(((Q(clans1_ids=str(clan.id)) & Q(caps1=4))
-                                        | (Q(clans2_ids=str(clan.id)) & Q(caps2=4)))
-                                        & filter).count()
-            # 3-2 victories
-            vic_3 = Match.objects(((Q(clans1_ids=str(clan.id)) & Q(caps1=3))
-                                        | (Q(clans2_ids=str(clan.id)) & Q(caps2=3)))
-                                        & filter).count()
-            # 2-3 defeats
-            def_2 = Match.objects(((Q(clans1_ids=str(clan.id)) & Q(caps1=2))
-                                        | (Q(clans2_ids=str(clan.id)) & Q(caps2=2)))
-                                        & filter).count()
-            # 1-4 defeats
-            def_1 = Match.objects(((Q(clans1_ids=str(clan.id)) & Q(caps1=1))
-                                        | (Q(clans2_ids=str(clan.id)) & Q(caps2=1)))
-                                        & filter).count()
-            # 0-5 defeats
-            def_0 = Match.objects(((Q(clans1_ids=str(clan.id)) & Q(caps1=0))
-                                        | (Q(clans2_ids=str(clan.id)) & Q(caps2=0)))
-                                        & filter).count()
+            # number of matches per caps of the clan, from 5-0 victories to 0-5 defeats
+            cell = get_stats_cell(str(clan.id), map=map, side=side)
+            if cell is not None:
+                caps = {int(c): count for c, count in cell["caps"].items()}
+            else:
+                caps = _count_result_types(Match, str(clan.id), filter)
+            vic_5, vic_4, vic_3, def_2, def_1, def_0 = [caps.get(c, 0) for c in (5, 4, 3, 2, 1, 0)]
 
             total = def_0 + def_1 + def_2 + vic_3 + vic_4 + vic_5
             if total == 0: total = 1    # to avoid multiple zero division errors
@@ -174,30 +186,29 @@ class PerformanceRatingApi(Resource):
 
     def get(self, oid):
         try:
-            clan = Clan.objects.get(id=oid)
-            matches_side1 = Match.objects(Q(clans1_ids=str(clan.id)))
-            matches_side2 = Match.objects(Q(clans2_ids=str(clan.id)))
-
-            strengths = []
-            for match in matches_side1:
-                scores = [Clan.objects.get(id=clan_id).score for clan_id in match.clans2_ids]
-                strengths.append(np.average(scores))
-            for match in matches_side2:
-                scores = [Clan.objects.get(id=clan_id).score for clan_id in match.clans1_ids]
-                strengths.append(sum(scores)/len(scores))
-
-            # get all matches where the clan was either on side1 and caps1 > caps2 (condition 1)
-            # or on side2 and caps1 < caps2 (condition 2)
-            win_cond1 = Q(clans1_ids=str(clan.id)) & Q(caps1__gte=3)
-            win_cond2 = Q(clans2_ids=str(clan.id)) & Q(caps2__gte=3)
-
-            total = clan.num_matches
-            wins = Match.objects(win_cond1 | win_cond2).count()
+            validate_schema(PerformanceRatingQuerySchema(), request.args)
+            # only the last n matches of the clan
+            last = request.args.get("last", default=None, type=int)
+            # only matches since the date, format: YYYY-MM-DD
+            since = request.args.get("since")
+            if not empty(since):
+                since = datetime(*[int(d) for d in since.split("-")])
+
+            clan = get_clan_cache().get(oid)
+            # the materialized statistics cover all matches (not a window), they can only be used
+            # if the opponents' scores of all matches are known
+            cell = get_stats_cell(str(clan.id)) if not last and empty(since) else None
+            if cell is not None and cell["rated"] == cell["total"]:
+                total, wins, strengths = cell["total"], cell["wins"], cell["strength"]
+            else:
+                total, wins, strengths = _performance_rating(Match, Score, str(clan.id), last=last, since=since)
 
-            pr = (sum(strengths) + 400 * (wins - (total - wins))) / total
+            pr = float((strengths + 400 * (wins - (total - wins))) / total)
 
-            return get_response({"pr": round(pr, 2)})
+            return get_response({"pr": round(pr, 2), "total": total})
 
+        except ZeroDivisionError:
+            return get_response({"pr": 0, "total": 0})
         except ValidationError as e:
             return handle_error(f"validation failed: {e}", 400)
         except BadRequest as e:
@@ -212,6 +223,98 @@ class PerformanceRatingApi(Resource):
 ###############################################
 
 
+def _performance_rating(match_obj, score_obj, clan_id, last=None, since=None):
+    # the strength of the opponents in a match is the average of their Score objects of that
+    # match, joined in the same aggregation instead of querying the clans one by one
+    filter = (Q(clans1_ids=clan_id) | Q(clans2_ids=clan_id)) & Q(score_posted=True)
+    if since is not None: filter &= Q(date__gte=since)
+    matches = match_obj.objects(filter).order_by("-date")
+    if last: matches = matches.limit(last)
+
+    side1 = {"$in": [clan_id, "$clans1_ids"]}
+    pipeline = [
+        {"$project": {
+            "match_id": 1,
+            "opponents": {"$cond": [side1, "$clans2_ids", "$clans1_ids"]},
+            "win": {"$cond": [{"$gte": [{"$cond": [side1, "$caps1", "$caps2"]}, 3]}, 1, 0]}
+        }},
+        {"$lookup": {
+            "from": score_obj._get_collection_name(),
+            "localField": "match_id",
+            "foreignField": "match_id",
+            "as": "scores"
+        }},
+        {"$project": {
+            "win": 1,
+            "scores": {"$filter": {"input": "$scores", "cond": {"$in": ["$$this.clan", "$opponents"]}}}
+        }},
+        # matches without Score objects of the opponents cannot be rated, they are dropped here
+        {"$unwind": "$scores"},
+        {"$group": {"_id": "$_id", "win": {"$first": "$win"}, "strength": {"$avg": "$scores.score"}}},
+        {"$group": {"_id": None, "total": {"$sum": 1}, "wins": {"$sum": "$win"}, "strengths": {"$sum": "$strength"}}}
+    ]
+    res = next(matches.aggregate(pipeline), None)
+    if res is None:
+        return 0, 0, 0
+    return res["total"], res["wins"], res["strengths"]
+
+
+def _winrate_breakdown(match_obj, clan_id):
+    # total, wins and winrate of a clan overall, per map, per side and per map and side,
+    # all from one aggregation, of the posted matches with maps compared case insensitive like in WinrateApi
+    group = {"total": {"$sum": 1}, "wins": {"$sum": "$win"}}
+    pipeline = [
+        # the first spelling of a map in the sort order is used as its name
+        {"$sort": {"map": 1}},
+        {"$project": {
+            "map": 1,
+            "map_key": {"$toLower": "$map"},
+            "side": {"$cond": [{"$in": [clan_id, "$clans1_ids"]}, "$side1", "$side2"]},
+            "win": {"$cond": [{"$gte": [{"$cond": [{"$in": [clan_id, "$clans1_ids"]}, "$caps1", "$caps2"]}, 3]}, 1, 0]}
+        }},
+        {"$facet": {
+            "total": [{"$group": {"_id": None, **group}}],
+            "maps": [{"$group": {"_id": "$map_key", "map": {"$first": "$map"}, **group}}],
+            # matches without a side are only counted in total and maps
+            "sides": [{"$match": {"side": {"$ne": None}}},
+                      {"$group": {"_id": "$side", **group}}],
+            "maps_sides": [{"$match": {"side": {"$ne": None}}},
+                           {"$group": {"_id": {"map": "$map_key", "side": "$side"}, "map": {"$first": "$map"}, **group}}]
+        }}
+    ]
+    matches = match_obj.objects((Q(clans1_ids=clan_id) | Q(clans2_ids=clan_id)) & Q(score_posted=True))
+    res = next(matches.aggregate(pipeline))
+
+    def winrate(doc):
+        return {
+            "total": doc["total"],
+            "wins": doc["wins"],
+            "winrate": round(doc["wins"] / doc["total"], 3) if doc["total"] > 0 else 0
+        }
+
+    maps = {doc["_id"]: doc["map"] for doc in res["maps"]}
+    maps_sides = {}
+    for doc in res["maps_sides"]:
+        maps_sides.setdefault(maps[doc["_id"]["map"]], {})[doc["_id"]["side"]] = winrate(doc)
+    return {
+        "total": winrate(res["total"][0]) if res["total"] else winrate({"total": 0, "wins": 0}),
+        "maps": {doc["map"]: winrate(doc) for doc in res["maps"]},
+        "sides": {doc["_id"]: winrate(doc) for doc in res["sides"]},
+        "maps_sides": maps_sides
+    }
+
+
+def _count_result_types(match_obj, clan_id, filter):
+    # one aggregation instead of one count per result type, grouped by the caps of the clan's side
+    # (a clan is never on both sides of a match)
+    pipeline = [
+        {"$project": {"caps": {"$cond": [{"$in": [clan_id, "$clans1_ids"]}, "$caps1", "$caps2"]}}},
+        {"$group": {"_id": "$caps", "count": {"$sum": 1}}}
+    ]
+    matches = match_obj.objects((Q(clans1_ids=clan_id) | Q(clans2_ids=clan_id)) & filter)
+    return {doc["_id"]: doc["count"] for doc in matches.aggregate(pipeline)}
+
+
 def _plot(x, y=None, ptype="pie", labels=None, clantag=None, m=None, side=None, colors=None):
     if ptype == "pie":
         plt.figure()
@@ -248,7 +351,7 @@ class ConsoleWinrateApi(Resource):
             # whether to return the statistics as plot or not
             as_img = request.args.get("as_img")
 
-            clan = ConsoleClan.objects.get(id=oid)
+            clan = get_clan_cache(console=True).get(oid)
             # get all matches where the clan was either on side1 and caps1 > caps2 (condition 1)
             # or on side2 and caps1 < caps2 (condition 2)
             win_cond1 = Q(clans1_ids=str(clan.id)) & Q(caps1__gte=3)
@@ -258,27 +361,36 @@ class ConsoleWinrateApi(Resource):
             side_cond1 = Q(clans1_ids=str(clan.id)) & Q(side1__iexact=side)
             side_cond2 = Q(clans2_ids=str(clan.id)) & Q(side2__iexact=side)
 
+            # only posted (confirmed) matches count, like in the materialized statistics
+            posted = Q(score_posted=True)
+
+            # the materialized statistics, if they have been built for the clan
+            cell = get_stats_cell(str(clan.id), map=map, side=side, console=True)
+
+            if cell is not None:
+                total, wins = cell["total"], cell["wins"]
+
             # only map is specified
-            if not empty(map) and empty(side):
+            elif not empty(map) and empty(side):
                 total = ConsoleMatch.objects((Q(clans1_ids=str(clan.id)) | Q(clans2_ids=str(clan.id)))
-                                        & Q(map__iexact=map)).count()
-                wins = ConsoleMatch.objects((win_cond1 | win_cond2) & Q(map__iexact=map)).count()
+                                        & Q(map__iexact=map) & posted).count()
+                wins = ConsoleMatch.objects((win_cond1 | win_cond2) & Q(map__iexact=map) & posted).count()
 
             # only side is specified
             elif not empty(side) and empty(map):
-                total = ConsoleMatch.objects(side_cond1 | side_cond2).count()
-                wins = ConsoleMatch.objects((win_cond1 | win_cond2) & (side_cond1 | side_cond2)).count()
+                total = ConsoleMatch.objects((side_cond1 | side_cond2) & posted).count()
+                wins = ConsoleMatch.objects((win_cond1 | win_cond2) & (side_cond1 | side_cond2) & posted).count()
 
             # map and side are specified
             elif not empty(map) and not empty(side):
-                total = ConsoleMatch.objects((side_cond1 | side_cond2) & Q(map__iexact=map)).count()
+                total = ConsoleMatch.objects((side_cond1 | side_cond2) & Q(map__iexact=map) & posted).count()
                 wins = ConsoleMatch.objects((win_cond1 | win_cond2) & (side_cond1 | side_cond2)
-                                    & Q(map__iexact=map)).count()
+                                    & Q(map__iexact=map) & posted).count()
 
             # neither map nor side is specified, user requested general winrate
             else:
                 total = clan.num_matches
-                wins = ConsoleMatch.objects((win_cond1 | win_cond2)).count()
+                wins = ConsoleMatch.objects((win_cond1 | win_cond2) & posted).count()
 
             if as_img and total > 0:
                 plt = _plot((wins, total-wins), ptype="pie", labels=("victories", "defeats"), clantag=clan.tag, m=map, side=side)
@@ -309,6 +421,21 @@ class ConsoleWinrateApi(Resource):
             return handle_error(f"error fetching items from database, terminated with error: {e}", 500)
 
 
+class ConsoleWinrateBreakdownApi(Resource):
+
+    def get(self, oid):
+        try:
+            clan = get_clan_cache(console=True).get(oid)
+            breakdown = _winrate_breakdown(ConsoleMatch, str(clan.id))
+
+        except DoesNotExist:
+            return handle_error("object does not exist", 404)
+        except Exception as e:
+            return handle_error(f"error fetching items from database, terminated with error: {e}", 500)
+        else:
+            return get_response(breakdown)
+
+
 class ConsoleResultTypesApi(Resource):
 
     def get(self, oid):
@@ -321,41 +448,25 @@ class ConsoleResultTypesApi(Resource):
             # whether to return the statistics as plot or not
             as_img = request.args.get("as_img")
 
-            clan = ConsoleClan.objects.get(id=oid)
+            clan = get_clan_cache(console=True).get(oid)
 
             # if a side has been specified, the clan id must be on that side
             side_cond1 = Q(clans1_ids=str(clan.id)) & Q(side1__iexact=side)
             side_cond2 = Q(clans2_ids=str(clan.id)) & Q(side2__iexact=side)
 
-            filter = Q()
+            # only posted (confirmed) matches count, like in the materialized statistics
+            filter = Q(score_posted=True)
 
             if not empty(map): filter &= Q(map__iexact=map)
             if not empty(side): filter &= (side_cond1 | side_cond2)
 
-            # 5-0 victories
-            vic_5 = ConsoleMatch.objects(((Q(clans1_ids=str(clan.id)) & Q(caps1=5))
-                                        | (Q(clans2_ids=str(clan.id)) & Q(caps2=5)))
-                                        & filter).count()
-            # 4-1 victories
-            vic_4 = ConsoleMatch.objects(((Q(clans1_ids=str(clan.id)) & Q(caps1=4))
-                                        | (Q(clans2_ids=str(clan.id)) & Q(caps2=4)))
-                                        & filter).count()
-            # 3-2 victories
-            vic_3 = ConsoleMatch.objects(((Q(clans1_ids=str(clan.id)) & Q(caps1=3))
-                                        | (Q(clans2_ids=str(clan.id)) & Q(caps2=3)))
-                                        & filter).count()
-            # 2-3 defeats
-            def_2 = ConsoleMatch.objects(((Q(clans1_ids=str(clan.id)) & Q(caps1=2))
-                                        | (Q(clans2_ids=str(clan.id)) & Q(caps2=2)))
-                                        & filter).count()
-            # 1-4 defeats
-            def_1 = ConsoleMatch.objects(((Q(clans1_ids=str(clan.id)) & Q(caps1=1))
-                                        | (Q(clans2_ids=str(clan.id)) & Q(caps2=1)))
-                                        & filter).count()
-            # 0-5 defeats
-            def_0 = ConsoleMatch.objects(((Q(clans1_ids=str(clan.id)) & Q(caps1=0))
-                                        | (Q(clans2_ids=str(clan.id)) & Q(caps2=0)))
-                                        & filter).count()
+            # number of matches per caps of the clan, from 5-0 victories to 0-5 defeats
+            cell = get_stats_cell(str(clan.id), map=map, side=side, console=True)
+            if cell is not None:
+                caps = {int(c): count for c, count in cell["caps"].items()}
+            else:
+                caps = _count_result_types(ConsoleMatch, str(clan.id), filter)
+            vic_5, vic_4, vic_3, def_2, def_1, def_0 = [caps.get(c, 0) for c in (5, 4, 3, 2, 1, 0)]
 
             total = def_0 + def_1 + def_2 + vic_3 + vic_4 + vic_5
             if total == 0: total = 1    # to avoid multiple zero division errors
@@ -409,30 +520,29 @@ class ConsolePerformanceRatingApi(Resource):
 
     def get(self, oid):
         try:
-            clan = ConsoleClan.objects.get(id=oid)
-            matches_side1 = ConsoleMatch.objects(Q(clans1_ids=str(clan.id)))
-            matches_side2 = ConsoleMatch.objects(Q(clans2_ids=str(clan.id)))
-
-            strengths = []
-            for match in matches_side1:
-                scores = [ConsoleClan.objects.get(id=clan_id).score for clan_id in match.clans2_ids]
-                strengths.append(sum(scores)/len(scores))
-            for match in matches_side2:
-                scores = [ConsoleClan.objects.get(id=clan_id).score for clan_id in match.clans1_ids]
-                strengths.append(sum(scores)/len(scores))
-
-            # get all matches where the clan was either on side1 and caps1 > caps2 (condition 1)
-            # or on side2 and caps1 < caps2 (condition 2)
-            win_cond1 = Q(clans1_ids=str(clan.id)) & Q(caps1__gte=3)
-            win_cond2 = Q(clans2_ids=str(clan.id)) & Q(caps2__gte=3)
-
-            total = clan.num_matches
-            wins = ConsoleMatch.objects(win_cond1 | win_cond2).count()
+            validate_schema(PerformanceRatingQuerySchema(), request.args)
+            # only the last n matches of the clan
+            last = request.args.get("last", default=None, type=int)
+            # only matches since the date, format: YYYY-MM-DD
+            since = request.args.get("since")
+            if not empty(since):
+                since = datetime(*[int(d) for d in since.split("-")])
+
+            clan = get_clan_cache(console=True).get(oid)
+            # the materialized statistics cover all matches (not a window), they can only be used
+            # if the opponents' scores of all matches are known
+            cell = get_stats_cell(str(clan.id), console=True) if not last and empty(since) else None
+            if cell is not None and cell["rated"] == cell["total"]:
+                total, wins, strengths = cell["total"], cell["wins"], cell["strength"]
+            else:
+                total, wins, strengths = _performance_rating(ConsoleMatch, ConsoleScore, str(clan.id), last=last, since=since)
 
-            pr = float((sum(strengths) + 400 * (wins - (total - wins))) / total)
+            pr = float((strengths + 400 * (wins - (total - wins))) / total)
 
-            return get_response({"pr": round(pr, 2)})
+            return get_response({"pr": round(pr, 2), "total": total})
 
+        except ZeroDivisionError:
+            return get_response({"pr": 0, "total": 0})
         except ValidationError as e:
             return handle_error(f"validation failed: {e}", 400)
         except BadRequest as e:
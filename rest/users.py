@@ -6,7 +6,7 @@ from flask_jwt_extended import create_access_token
 from flask_restful import Resource
 from mongoengine import DoesNotExist
 
-from models.clan import Clan
+from logic.clan_cache import get_clan_cache
 from models.user import User, Role
 from ._common import get_response, handle_error
 
@@ -50,7 +50,7 @@ class DiscordCallback(Resource):
                 helo_roles.append(Role.TeamManager.value)
             else:
                 try:
-                    clan = Clan.objects.get(role_id=r)
+                    clan = get_clan_cache().by_role_id(r)
                     helo_clans.append(str(clan.id))
                 except DoesNotExist:
                     continue
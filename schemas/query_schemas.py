@@ -48,11 +48,17 @@ class ClanQuerySchema(Schema):
     score_to = fields.Integer(validate=Range(min=0, min_inclusive=True))
     limit = fields.Integer(validate=Range(min=0, min_inclusive=True))
     offset = fields.Integer(validate=Range(min=0, min_inclusive=True))
+    # opaque cursor of keyset pagination, empty for the first page
+    cursor = fields.String()
+    # how to count all matching documents for the meta block
+    count = fields.String(validate=OneOf(["estimated", "exact", "none"]))
     sort_by = fields.String(validate=OneOf(["tag", "name", "score", "num_matches"]))
     select = fields.String(validate=In(Clan.__dict__.keys()))
     # TODO: make this better
     desc = fields.Boolean()
     archived = fields.Boolean()
+    # exact instead of prefix matches for tag and name
+    exact = fields.Boolean()
 
 
 # Schema for queries in '/matches'
@@ -70,12 +76,18 @@ class MatchQuerySchema(Schema):
     event = fields.String()
     limit = fields.Integer(validate=Range(min=0, min_inclusive=True))
     offset = fields.Integer(validate=Range(min=0, min_inclusive=True))
+    # opaque cursor of keyset pagination, empty for the first page
+    cursor = fields.String()
+    # how to count all matching documents for the meta block
+    count = fields.String(validate=OneOf(["estimated", "exact", "none"]))
     sort_by = fields.String(validate=OneOf(["match_id", "date", "players", "caps1", "factor", "score_posted", "clans1_ids", "clans2_ids"]))
     date = fields.Date()
     date_from = fields.Date()
     date_to = fields.Date()
     desc = fields.Boolean()
     side = fields.String(validate=OneOf(["Allies", "Axis"]))
+    # exact instead of prefix matches for match_id, map and event
+    exact = fields.Boolean()
 
 
 # Schema for queries on '/search'
@@ -103,6 +115,10 @@ class ScoreQuerySchema(Schema):
     score_to = fields.Integer(validate=Range(min=0, min_inclusive=True))
     limit = fields.Integer(validate=Range(min=0, min_inclusive=True))
     offset = fields.Integer(validate=Range(min=0, min_inclusive=True))
+    # opaque cursor of keyset pagination, empty for the first page
+    cursor = fields.String()
+    # how to count all matching documents for the meta block
+    count = fields.String(validate=OneOf(["estimated", "exact", "none"]))
     sort_by = fields.String(validate=OneOf(["tag", "name", "score", "num_matches"]))
     desc = fields.Boolean()
 
@@ -115,11 +131,25 @@ class ScoreHistoryQuerySchema(Schema):
     desc = fields.Boolean()
 
 
+# Schema for queries in '/export/matches' and '/export/scores'
+class ExportQuerySchema(Schema):
+    format = fields.String(validate=OneOf(["ndjson", "csv"]))
+    # date range of the matches / of the Score objects, both inclusive
+    date_from = fields.Date()
+    date_to = fields.Date()
+
+
 # Schema for queries in '/statistics/winrate/{oid}'
 class StatisticsQuerySchema(Schema):
     map = fields.String()
     side = fields.String(validate=validate_side)
     as_img = fields.Boolean() # only for console
 
+
+# Schema for queries in '/statistics/pr/{oid}'
+class PerformanceRatingQuerySchema(Schema):
+    last = fields.Integer(validate=Range(min=1, min_inclusive=True))
+    since = fields.Date()
+
 class SimulationsQuerySchema(Schema):
     ignore = fields.String(validate=In(["factor", "num_matches", "players"]))
@@ -0,0 +1,123 @@
+"""
+The recalculation of the baseline: start_recalculation with calc_scores for every later match,
+the scores are read from the database before every match (get_by_clan_id, get_by_num_matches).
+The code of the baseline without its prints (the scores of a match are calculated with
+get_match_scores, which the baseline had inline), the reference of the replay.
+"""
+
+from datetime import datetime
+
+from mongoengine.errors import DoesNotExist
+from mongoengine.queryset.visitor import Q
+
+from logic.calculations import get_match_scores
+from models.clan import Clan
+from models.match import Match
+from models.score import Score
+from models.console.console_clan import ConsoleClan
+from models.console.console_match import ConsoleMatch
+from models.console.console_score import ConsoleScore
+
+
+def start_recalculation(match, console=False, num_offset=0):
+    """The baseline recalculation.
+
+    Args:
+        match (Match): the edited (or added) match
+        console (bool, optional): console database. Defaults to False.
+        num_offset (int, optional): added to the number of matches of a posted match, the
+            baseline passes the number including the match (0), calc_scores the number before
+            it (-1). Defaults to 0.
+    """
+    match_obj = Match if not console else ConsoleMatch
+    clans1, clans2 = get_clan_objects(match)
+    scores1, num_matches1 = zip(*[_get_score_and_num_matches(match, clan, console, num_offset) for clan in clans1])
+    scores2, num_matches2 = zip(*[_get_score_and_num_matches(match, clan, console, num_offset) for clan in clans2])
+    calc_scores(match, scores1, num_matches1, scores2, num_matches2, recalculate=True, console=console)
+
+    all_matches = [m for m in match_obj.objects(date__gte=match.date) if m.match_id != match.match_id]
+    all_matches.sort(key=lambda x: x.date)
+    for m in all_matches:
+        clans1, clans2 = get_clan_objects(m)
+        scores1, num_matches1 = zip(*[_get_score_and_num_matches(m, clan, console, num_offset) for clan in clans1])
+        scores2, num_matches2 = zip(*[_get_score_and_num_matches(m, clan, console, num_offset) for clan in clans2])
+        calc_scores(m, scores1, num_matches1, scores2, num_matches2, recalculate=True, console=console)
+
+    match.recalculate = False
+    match.save()
+
+
+def _get_score_and_num_matches(match, clan, console=False, num_offset=0):
+    score_obj = get_by_clan_id(match, str(clan.id))
+    num = score_obj.num_matches
+    if match.score_posted:
+        score_obj = get_by_num_matches(str(clan.id), num - 1, console)
+        num += num_offset
+    return score_obj.score, num
+
+
+def calc_scores(match, scores1, num_matches1, scores2, num_matches2, recalculate=False, console=False):
+    clans1, clans2 = get_clan_objects(match)
+    scores1, scores2, err = get_match_scores(match, list(scores1), list(num_matches1), list(scores2),
+                                             list(num_matches2), console=console)
+    _save_clans_and_scores(match, clans1, clans2, scores1, scores2, num_matches1,
+                           num_matches2, recalculate=recalculate, console=console)
+    match.score_posted = True
+    match.save()
+    return err
+
+
+def _save_clans_and_scores(match, clans1, clans2, scores1, scores2, num_matches1,
+                           num_matches2, recalculate=False, console=False):
+    score_obj, match_obj = (Score, Match) if not console else (ConsoleScore, ConsoleMatch)
+    for clan, score, num_matches in list(zip(clans1, scores1, num_matches1)) + list(zip(clans2, scores2, num_matches2)):
+        score_queryset = score_obj.objects(Q(match_id=match.match_id) & Q(clan=str(clan.id)))
+        res = score_queryset.update_one(set__score=score, upsert=True, full_result=True)
+        if res.raw_result.get("updatedExisting"):
+            clan.update(score=score, last_updated=datetime.now())
+        else:
+            clan.update(score=score, last_updated=datetime.now(), inc__num_matches=1)
+            score_queryset.update_one(set___created_at=match.date)
+            if recalculate:
+                num = num_matches + 1
+                matches_after = match_obj.objects(Q(date__gte=match.date))
+                scores_after = [score_obj.objects(Q(clan=str(clan.id)) & Q(match_id=m.match_id)) for m in matches_after]
+                for s in scores_after:
+                    s.update_one(inc__num_matches=1)
+                score_queryset.update_one(set__num_matches=num)
+            else:
+                clan.reload()
+                score_queryset.update_one(set__num_matches=clan.num_matches)
+
+
+def get_clan_objects(match):
+    clan_obj = Clan if isinstance(match, Match) else ConsoleClan
+    clans1 = [clan_obj.objects.get(id=oid) for oid in match.clans1_ids]
+    clans2 = [clan_obj.objects.get(id=oid) for oid in match.clans2_ids]
+    return clans1, clans2
+
+
+def get_by_clan_id(match, clan_id: str):
+    if isinstance(match, Match):
+        score_obj, match_obj, console = Score, Match, False
+    else:
+        score_obj, match_obj, console = ConsoleScore, ConsoleMatch, True
+    try:
+        return score_obj.objects.get(Q(match_id=match.match_id) & Q(clan=clan_id))
+    except DoesNotExist:
+        matches = [m for m in match_obj.objects(Q(date__lte=match.date) & (Q(clans1_ids__in=[clan_id])
+                                                                           | Q(clans2_ids__in=[clan_id])))
+                   if m.match_id != match.match_id]
+        matches.sort(key=lambda x: x.date, reverse=True)
+        try:
+            return get_by_clan_id(matches[0], clan_id)
+        except IndexError:
+            return score_obj(clan_id, 0, "DefaultScore", 600 if not console else 1000)
+
+
+def get_by_num_matches(clan_id: str, num_matches: int, console=False):
+    score_obj = Score if not console else ConsoleScore
+    try:
+        return score_obj.objects.get(Q(clan=clan_id) & Q(num_matches=num_matches))
+    except DoesNotExist:
+        return score_obj(clan_id, 0, "DefaultScore", 600 if not console else 1000)
@@ -0,0 +1,148 @@
+"""
+Fixtures for the tests, the PC and console databases are replaced by mongomock
+"""
+
+import random
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask
+from flask_jwt_extended import JWTManager, create_access_token
+from flask_restful import Api
+from mongoengine import connect, disconnect_all
+
+from database.indexes import get_models
+from logic.calculations import calc_scores
+from logic.clan_cache import get_clan_cache
+from logic.data_state import get_data_version
+from models.user import Role
+from rest._conditional import initialize_conditional_requests
+from rest._response_cache import initialize_response_cache
+from rest._routes import initialize_routes
+from models.clan import Clan
+from models.match import Match
+from models.score import Score
+from models.console.console_clan import ConsoleClan
+from models.console.console_match import ConsoleMatch
+from models.console.console_score import ConsoleScore
+
+
+def reset_database():
+    """Connects both aliases to empty mongomock databases."""
+    disconnect_all()
+    connect("helo", host="mongomock://localhost", alias="default", uuidRepresentation="standard")
+    connect("helo_console", host="mongomock://localhost", alias="console", uuidRepresentation="standard")
+    for model in get_models() + get_models(console=True):
+        model.drop_collection()
+    for console in (False, True):
+        get_clan_cache(console).clear()
+        get_data_version(console).clear()
+
+
+@pytest.fixture
+def database():
+    reset_database()
+    yield reset_database
+    disconnect_all()
+
+
+def create_app(**config):
+    """The app with all routes (without the discord login), the response cache is disabled
+    unless it is configured.
+
+    Returns:
+        Flask: the app
+    """
+    app = Flask("helo-test")
+    app.config.update({"JWT_SECRET_KEY": "a secret of the tests, at least 32 bytes long", "EXPORT_TOKEN": "export-token",
+                       "IS_CONSOLE_API": False, "RESPONSE_CACHE_ENABLED": False, **config})
+    JWTManager(app)
+    initialize_routes(Api(app), None)
+    initialize_conditional_requests(app)
+    initialize_response_cache(app)
+    return app
+
+
+@pytest.fixture
+def app(database):
+    return create_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def auth_headers(app, *roles, clans=()):
+    """The Authorization header of a user with the given roles (default: admin).
+
+    Returns:
+        dict: headers of a request
+    """
+    with app.app_context():
+        token = create_access_token(identity="user", additional_claims={
+            "roles": [role.value for role in roles or [Role.Admin]], "clans": list(clans)})
+    return {"Authorization": f"Bearer {token}"}
+
+
+def build_history(seed, console=False, num_clans=8, num_matches=40):
+    """Creates clans and random matches (with coop matches), every match is confirmed
+    with calc_scores in the order of its date.
+
+    Args:
+        seed (int): seed of the random history
+        console (bool, optional): console database. Defaults to False.
+        num_clans (int, optional): number of clans. Defaults to 8.
+        num_matches (int, optional): number of matches. Defaults to 40.
+
+    Returns:
+        list: the Match or ConsoleMatch objects, ordered by date
+    """
+    rnd = random.Random(seed)
+    clan_obj, match_obj = (Clan, Match) if not console else (ConsoleClan, ConsoleMatch)
+    clans = [clan_obj(tag=f"C{num}").save() for num in range(num_clans)]
+    start = datetime(2022, 1, 1)
+    matches = []
+    for num in range(num_matches):
+        size1 = 1 if rnd.random() < 0.8 else 2
+        size2 = 1 if rnd.random() < 0.8 else 2
+        picked = [str(clan.id) for clan in rnd.sample(clans, size1 + size2)]
+        caps1 = rnd.randint(0, 5)
+        # the seconds make the dates unique, the order of matches on one date is not tested
+        kwargs = dict(match_id=f"m{num}", clans1_ids=picked[:size1], clans2_ids=picked[size1:],
+                      caps1=caps1, caps2=5 - caps1, map="Foy", conf1="a", conf2="b",
+                      date=start + timedelta(days=rnd.randint(0, 40), seconds=num), score_posted=False)
+        if size1 > 1:
+            kwargs["player_dist1"] = [rnd.randint(5, 25) for _ in range(size1)]
+        if size2 > 1:
+            kwargs["player_dist2"] = [rnd.randint(5, 25) for _ in range(size2)]
+        if not console:
+            kwargs.update(factor=rnd.choice([0.6, 2.0]), players=rnd.choice([30, 40, 50]))
+        else:
+            kwargs.update(factor=rnd.choice([0.8, 1.0]), players1=rnd.randint(20, 50),
+                          players2=rnd.randint(20, 50), team_size1=50, team_size2=50, offensive=False)
+        matches.append(kwargs)
+    matches.sort(key=lambda kwargs: kwargs["date"])
+    history = []
+    for kwargs in matches:
+        match = match_obj(**kwargs).save()
+        calc_scores(match, console=console)
+        history.append(match)
+    return history
+
+
+def snapshot(console=False):
+    """All Score objects, clan scores and confirmed matches, by clan tag instead of id, so
+    that the states of two databases can be compared.
+
+    Returns:
+        tuple: sorted Score, Clan and Match tuples
+    """
+    clan_obj, match_obj, score_obj = (Clan, Match, Score) if not console \
+        else (ConsoleClan, ConsoleMatch, ConsoleScore)
+    tags = {str(doc["_id"]): doc["tag"] for doc in clan_obj.objects.as_pymongo()}
+    scores = sorted((tags[doc["clan"]], doc["match_id"], doc["num_matches"], float(doc["score"]))
+                    for doc in score_obj.objects.as_pymongo())
+    clans = sorted((doc["tag"], float(doc["score"]), doc["num_matches"]) for doc in clan_obj.objects.as_pymongo())
+    matches = sorted((doc["match_id"], bool(doc.get("score_posted"))) for doc in match_obj.objects.as_pymongo())
+    return scores, clans, matches
@@ -0,0 +1,124 @@
+"""
+Cache backends: the LRU, the TTL and the tags, the shared backend across instances and processes
+"""
+
+import multiprocessing
+import time
+
+import pytest
+
+from cache import MemoryCache, SharedCache
+
+JSON = "application/json"
+# bodies of 10 bytes, with a key of one letter 3 entries fit into 40 bytes
+BODY = b"0123456789"
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "response-cache.sqlite3")
+
+
+@pytest.fixture(params=["memory", "shared"])
+def backend(request, path, monkeypatch):
+    if request.param == "memory":
+        return MemoryCache(max_bytes=40, ttl=60)
+    # every hit is recorded as use
+    monkeypatch.setattr("cache.shared.USED_RESOLUTION", 0)
+    return SharedCache(path, max_bytes=40, ttl=60)
+
+
+def test_least_recently_used_entry_is_evicted(backend):
+    for key in "abc":
+        backend.set(key, BODY, JSON)
+    assert backend.get("a") == (BODY, JSON)
+
+    backend.set("d", BODY, JSON)
+    assert backend.get("b") is None
+    assert [backend.get(key) is not None for key in "acd"] == [True, True, True]
+    assert backend.stats()["evictions"] == 1
+    assert backend.stats()["bytes"] == 33
+
+
+def test_large_bodies_are_not_stored(backend):
+    backend.set("a", BODY + b"!", JSON)
+    assert backend.get("a") is None
+
+
+def test_entries_expire(backend):
+    backend.set("a", BODY, JSON, ttl=0.05)
+    backend.set("b", BODY, JSON)
+    assert backend.get("a") == (BODY, JSON)
+    time.sleep(0.1)
+    assert backend.get("a") is None
+    assert backend.get("b") == (BODY, JSON)
+
+
+def test_invalidation_by_tags(backend):
+    backend.set("a", BODY, JSON, tags=["pc", "pc-clan-1"])
+    backend.set("b", BODY, JSON, tags=["pc", "pc-clan-2"])
+    assert backend.invalidate(["pc-clan-1"]) == 1
+    assert backend.get("a") is None
+    assert backend.get("b") == (BODY, JSON)
+
+
+def test_stale_set_is_not_stored(backend):
+    generation = backend.generation
+    # the response was being computed while a write invalidated the cache
+    backend.invalidate(["pc-clan-1"])
+    backend.set("a", BODY, JSON, tags=["pc-clan-2"], generation=generation)
+    assert backend.get("a") is None
+    backend.set("a", BODY, JSON, tags=["pc-clan-2"], generation=backend.generation)
+    assert backend.get("a") == (BODY, JSON)
+
+
+def test_shared_entry_is_a_hit_in_other_instances(path):
+    worker1, worker2 = SharedCache(path), SharedCache(path)
+    worker1.set("a", BODY, JSON, tags=["pc"])
+    assert worker2.get("a") == (BODY, JSON)
+    assert (worker1.stats()["stores"], worker2.stats()["hits"]) == (1, 1)
+
+
+def test_shared_invalidation_is_a_miss_in_all_instances(path):
+    worker1, worker2 = SharedCache(path), SharedCache(path)
+    worker1.set("a", BODY, JSON, tags=["pc-clan-1"])
+    worker1.set("b", BODY, JSON, tags=["pc-clan-2"])
+    assert worker2.get("a") == (BODY, JSON)
+
+    assert worker2.invalidate(["pc-clan-1"]) == 1
+    assert worker1.get("a") is None
+    assert worker2.get("a") is None
+    assert worker1.get("b") == (BODY, JSON)
+
+
+def test_shared_stale_set_of_another_instance_is_not_stored(path):
+    worker1, worker2 = SharedCache(path), SharedCache(path)
+    generation = worker1.generation
+    # an invalidation by another worker while worker1 was computing the response
+    worker2.invalidate(["pc-clan-1"])
+    worker1.set("a", BODY, JSON, tags=["pc-clan-1"], generation=generation)
+    assert worker1.get("a") is None
+    assert worker2.get("a") is None
+
+
+def _store(path):
+    SharedCache(path).set("a", BODY, JSON, tags=["pc-clan-1"])
+
+
+def _invalidate(path):
+    SharedCache(path).invalidate(["pc-clan-1"])
+
+
+def test_shared_cache_across_processes(path):
+    cache = SharedCache(path)
+    # the connection of this process is open while the other process writes
+    assert cache.get("a") is None
+    context = multiprocessing.get_context("spawn")
+    for target in (_store, _invalidate):
+        process = context.Process(target=target, args=(path,))
+        process.start()
+        process.join(timeout=30)
+        assert process.exitcode == 0
+        if target is _store:
+            assert cache.get("a") == (BODY, JSON)
+    assert cache.get("a") is None
@@ -0,0 +1,73 @@
+"""
+The bulk writes of the scores of a match against the per-document writes of the baseline (tests/baseline.py)
+"""
+
+from datetime import timedelta
+
+import pytest
+
+import baseline
+from conftest import build_history, reset_database, snapshot
+from logic._getter import get_clan_objects
+from logic.calculations import _save_clans_and_scores
+from models.match import Match
+from models.score import Score
+from models.console.console_match import ConsoleMatch
+from models.console.console_score import ConsoleScore
+
+
+def confirm_last(history, console):
+    # a new match after the history, saved as when it is confirmed
+    match_obj = Match if not console else ConsoleMatch
+    last = history[-1]
+    match = match_obj(**{**_fields(last), "match_id": "new", "date": last.date + timedelta(days=1)}).save()
+    return match, False
+
+
+def save_again(history, console):
+    # a confirmed match, e.g. with new caps
+    return history[len(history) // 2], False
+
+
+def insert(history, console):
+    # a match in the middle of the history, saved as by a recalculation
+    match_obj = Match if not console else ConsoleMatch
+    before = history[len(history) // 3]
+    match = match_obj(**{**_fields(before), "match_id": "inserted",
+                         "date": before.date + timedelta(milliseconds=500)}).save()
+    return match, True
+
+
+def _fields(match):
+    return {key: value for key, value in match.to_mongo().to_dict().items()
+            if key not in ("_id", "match_id") and not key.endswith("_lower")}
+
+
+def saved(save, change, seed, console):
+    """Saves the scores of a match with a save function in a new database.
+
+    Returns:
+        tuple: snapshot of the database and the creation times of the Score objects
+    """
+    reset_database()
+    history = build_history(seed, console=console, num_matches=25)
+    match, recalculate = change(history, console)
+    clans1, clans2 = get_clan_objects(match, max_age=0)
+    # the number of matches before the match, as the recalculation passes it
+    score_obj = Score if not console else ConsoleScore
+    nums1 = [score_obj.objects(clan=str(clan.id), _created_at__lt=match.date).count() for clan in clans1]
+    nums2 = [score_obj.objects(clan=str(clan.id), _created_at__lt=match.date).count() for clan in clans2]
+    scores1 = [700 + num for num in range(len(clans1))]
+    scores2 = [500 + num for num in range(len(clans2))]
+    save(match, clans1, clans2, scores1, scores2, nums1, nums2, recalculate=recalculate, console=console)
+    created = sorted((doc["match_id"], doc["num_matches"], doc["_created_at"])
+                     for doc in score_obj.objects.as_pymongo())
+    return snapshot(console=console), created
+
+
+@pytest.mark.parametrize("console", [False, True])
+@pytest.mark.parametrize("change", [confirm_last, save_again, insert])
+@pytest.mark.parametrize("seed", range(2))
+def test_bulk_save_equals_per_document_save(database, console, change, seed):
+    expected = saved(baseline._save_clans_and_scores, change, seed, console)
+    assert saved(_save_clans_and_scores, change, seed, console) == expected
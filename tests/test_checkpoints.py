@@ -0,0 +1,134 @@
+"""
+The scores before a match from the rating checkpoints against get_scores_before
+"""
+
+from datetime import timedelta
+
+import pytest
+
+from conftest import build_history, reset_database, snapshot
+from logic._getter import get_scores_before
+from logic.checkpoints import get_scores_before_match, match_confirmed, prune_checkpoints, scores_written, \
+    write_checkpoint
+from logic.recalculations import start_recalculation
+from models.match import Match
+from models.rating_checkpoint import RatingCheckpoint
+from models.console.console_match import ConsoleMatch
+from models.console.console_rating_checkpoint import ConsoleRatingCheckpoint
+
+
+def score_tuples(scores):
+    return {key: (score.clan, score.match_id, score.num_matches, float(score.score))
+            for key, score in scores.items()}
+
+
+def assert_equals_get_scores_before(matches, clan_ids, console):
+    for match in matches:
+        expected = get_scores_before([(oid, match) for oid in clan_ids], console=console, inclusive=False)
+        assert score_tuples(get_scores_before_match(clan_ids, match, console=console)) == score_tuples(expected), \
+            match.match_id
+
+
+def clan_ids_of(history):
+    # the clans of the history and one without matches
+    return sorted({oid for match in history for oid in match.clans1_ids + match.clans2_ids}) \
+        + ["000000000000000000000000"]
+
+
+@pytest.mark.parametrize("console", [False, True])
+@pytest.mark.parametrize("seed", range(2))
+def test_scores_before_match_equal_get_scores_before(database, console, seed):
+    history = build_history(seed, console=console, num_matches=60)
+    clan_ids = clan_ids_of(history)
+    # without checkpoints, and with several ones, the matches on a checkpoint's date included
+    assert_equals_get_scores_before(history, clan_ids, console)
+    for match in history[10::15]:
+        write_checkpoint(match, console=console)
+    assert_equals_get_scores_before(history, clan_ids, console)
+
+
+@pytest.mark.parametrize("console", [False, True])
+@pytest.mark.parametrize("moved_past", [10, 30])
+def test_match_moved_past_a_checkpoint(database, console, moved_past):
+    history = build_history(0, console=console, num_matches=40)
+    clan_ids = clan_ids_of(history)
+    # the checkpoint holds the Score objects of the match as the last ones of its clans, right
+    # after it they are still the last ones before the match
+    match = history[10]
+    write_checkpoint(match, console=console)
+    match.update(date=history[moved_past].date + timedelta(milliseconds=500))
+    match.reload()
+    assert_equals_get_scores_before([match] + history[11:], clan_ids, console)
+
+
+@pytest.mark.parametrize("console", [False, True])
+def test_checkpoints_equal_a_checkpoint_built_from_scratch(database, monkeypatch, console):
+    checkpoint_obj, match_obj = (RatingCheckpoint, Match) if not console else (ConsoleRatingCheckpoint, ConsoleMatch)
+    monkeypatch.setattr("logic.checkpoints.CHECKPOINT_EVERY", 10)
+    history = build_history(1, console=console, num_matches=50)
+    # as after the confirmation of the matches in the order of their dates
+    checkpoint_obj.objects.delete()
+    match_obj._get_collection().update_many({}, {"$set": {"score_posted": False}})
+    for match in history:
+        match_obj._get_collection().update_one({"_id": match.id}, {"$set": {"score_posted": True}})
+        match_confirmed(console=console)
+    checkpoints = list(checkpoint_obj.objects.order_by("date").as_pymongo())
+    assert [doc["match_id"] for doc in checkpoints] == [match.match_id for match in history[9::10]]
+
+    # every checkpoint (but the first) is built from the one before it
+    for doc in checkpoints:
+        checkpoint_obj.objects.delete()
+        match = next(match for match in history if match.match_id == doc["match_id"])
+        assert write_checkpoint(match, console=console).clans == doc["clans"]
+
+    assert prune_checkpoints(console=console, keep=2) == 0
+    checkpoint_obj.objects.delete()
+    for doc in checkpoints:
+        checkpoint_obj(**{k: v for k, v in doc.items() if k != "_id"}).save()
+    assert prune_checkpoints(console=console, keep=2) == len(checkpoints) - 2
+    assert list(checkpoint_obj.objects.order_by("date").scalar("match_id")) \
+        == [doc["match_id"] for doc in checkpoints[-2:]]
+
+
+@pytest.mark.parametrize("console", [False, True])
+def test_written_scores_delete_the_outdated_checkpoints(database, console):
+    checkpoint_obj = RatingCheckpoint if not console else ConsoleRatingCheckpoint
+    history = build_history(2, console=console, num_matches=40)
+    for match in history[5::10]:
+        write_checkpoint(match, console=console)
+    # Score objects created on the date of a checkpoint outdate it
+    scores_written(history[25].date, console=console)
+    assert list(checkpoint_obj.objects.order_by("date").scalar("match_id")) \
+        == [history[5].match_id, history[15].match_id]
+    scores_written(console=console)
+    assert checkpoint_obj.objects.count() == 0
+
+
+def replayed(seed, console, checkpoints):
+    """Replays an edited match of a history with checkpoints in a new database.
+
+    Returns:
+        tuple: snapshot of the database, the match ids of the remaining checkpoints and of the
+            checkpoints before the match
+    """
+    checkpoint_obj = RatingCheckpoint if not console else ConsoleRatingCheckpoint
+    reset_database()
+    history = build_history(seed, console=console, num_matches=60)
+    match = history[30]
+    for checkpoint in checkpoints(history):
+        write_checkpoint(checkpoint, console=console)
+    match.update(caps1=5 - match.caps1, caps2=5 - match.caps2, recalculate=True)
+    match.reload()
+    start_recalculation(match, console=console)
+    return snapshot(console), list(checkpoint_obj.objects.order_by("date").scalar("match_id")), \
+        [checkpoint.match_id for checkpoint in checkpoints(history) if checkpoint.date < match.date]
+
+
+@pytest.mark.parametrize("console", [False, True])
+@pytest.mark.parametrize("seed", range(2))
+def test_replay_from_a_checkpoint_equals_the_replay_without(database, console, seed):
+    expected, _, _ = replayed(seed, console, lambda history: [])
+    replay, remaining, before = replayed(seed, console, lambda history: history[5:60:10])
+    assert replay == expected
+    # the checkpoints after the edited match are outdated
+    assert remaining == before and len(before) == 3
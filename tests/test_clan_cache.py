@@ -0,0 +1,102 @@
+"""
+The clan cache of two processes against the clans in the database
+"""
+
+import random
+
+import pytest
+
+from logic.clan_cache import ClanCache
+from logic.data_state import data_changed
+from models.clan import Clan
+from models.console.console_clan import ConsoleClan
+
+
+def clan_tuples(clans):
+    return [(str(clan.id), clan.tag, clan.score, clan.num_matches, getattr(clan, "role_id", None))
+            for clan in clans]
+
+
+@pytest.mark.parametrize("console", [False, True])
+def test_writes_of_another_process(database, monkeypatch, console):
+    clan_obj = Clan if not console else ConsoleClan
+    a, b = clan_obj(tag="A").save(), clan_obj(tag="B").save()
+    # the caches of two processes
+    cache1, cache2 = ClanCache(console=console), ClanCache(console=console)
+    assert cache1.get(a.id).score == a.score
+    cache2.get(a.id)
+
+    # the other process renames a clan, changes its score and deletes one
+    clan_obj.objects(id=a.id).update(tag="A2", score=700)
+    clan_obj.objects(id=b.id).delete()
+    cache2.written([a.id, b.id])
+    data_changed("clans", console=console)
+    assert cache2.get(a.id).tag == "A2"
+
+    # noticed with the next check
+    assert cache1.get(a.id).tag == "A"
+    assert cache1.get(a.id, max_age=0).tag == "A2"
+    monkeypatch.setattr("logic.clan_cache.CHECK_INTERVAL", 0)
+    assert (cache1.get(a.id).score, cache1.by_tag("A2").tag) == (700, "A2")
+    with pytest.raises(clan_obj.DoesNotExist):
+        cache1.by_tag("A")
+    with pytest.raises(clan_obj.DoesNotExist):
+        cache1.get(b.id)
+
+
+def test_clans_written_without_data_changed_are_loaded(database):
+    cache = ClanCache()
+    cache.get(Clan(tag="A").save().id)
+    # e.g. a clan created by another process, the version has not changed
+    new = Clan(tag="B").save()
+    assert cache.get(new.id).tag == "B"
+
+
+def test_lookups_return_copies(database):
+    cache = ClanCache()
+    oid = Clan(tag="A", score=600).save().id
+    clan = cache.get(oid)
+    clan.score = 1
+    assert cache.get(oid).score == 600
+
+
+def test_several_clans_with_a_role(database):
+    cache = ClanCache()
+    Clan(tag="A", role_id="1").save(), Clan(tag="B", role_id="1").save()
+    with pytest.raises(Clan.MultipleObjectsReturned):
+        cache.by_role_id("1")
+    with pytest.raises(Clan.DoesNotExist):
+        cache.by_role_id("2")
+
+
+@pytest.mark.parametrize("console", [False, True])
+@pytest.mark.parametrize("seed", range(3))
+def test_random_writes_of_two_processes_equal_the_database(database, console, seed):
+    rnd = random.Random(seed)
+    clan_obj = Clan if not console else ConsoleClan
+    caches = [ClanCache(console=console), ClanCache(console=console)]
+    clans = [clan_obj(tag=f"C{num}").save() for num in range(6)]
+    for step in range(60):
+        writer = rnd.choice(caches)
+        oid = rnd.choice(clans).id
+        op = rnd.choice(["score", "tag", "delete", "create"])
+        if op == "score":
+            clan_obj.objects(id=oid).update(score=rnd.randint(300, 900), inc__num_matches=1)
+        elif op == "tag":
+            clan_obj.objects(id=oid).update(tag=f"T{step}", **({"role_id": str(step)} if not console else {}))
+        elif op == "delete":
+            clan_obj.objects(id=oid).delete()
+        else:
+            oid = clan_obj(tag=f"N{step}").save().id
+            clans.append(clan_obj.objects.get(id=oid))
+        # every write path of a process updates its cache and the data version
+        writer.written([oid])
+        data_changed("clans", console=console)
+
+        expected = list(clan_obj.objects.order_by("id"))
+        for cache in caches:
+            assert clan_tuples(cache.get_many([clan.id for clan in expected], max_age=0)) == clan_tuples(expected)
+            for clan in expected:
+                assert str(cache.by_tag(clan.tag).id) == str(clan.id)
+                if getattr(clan, "role_id", None) is not None:
+                    assert str(cache.by_role_id(clan.role_id).id) == str(clan.id)
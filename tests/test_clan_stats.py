@@ -0,0 +1,118 @@
+"""
+Materialized statistics of the clans
+"""
+
+import time
+
+import pytest
+from mongoengine.queryset.visitor import Q
+
+from conftest import auth_headers, build_history
+from logic.calculations import calc_scores
+from logic.clan_stats import build_clan_stats, get_stats_cell, refresh_clan_stats, verify_clan_stats
+from models.clan import Clan
+from models.clan_stats import ClanStats
+from models.match import Match
+from models.score import Score
+from models.console.console_clan import ConsoleClan
+from models.console.console_clan_stats import ConsoleClanStats
+from models.console.console_match import ConsoleMatch
+from models.console.console_score import ConsoleScore
+
+
+@pytest.mark.parametrize("console", [False, True])
+def test_confirmation_before_the_statistics_are_built(database, console):
+    stats_obj, match_obj = (ClanStats, Match) if not console else (ConsoleClanStats, ConsoleMatch)
+    history = build_history(0, console=console, num_matches=20)
+    # the matches have been posted before the statistics existed
+    stats_obj.drop_collection()
+    fields = {k: v for k, v in history[-1].to_mongo().to_dict().items() if k != "_id"}
+    match = match_obj(**{**fields, "match_id": "new", "score_posted": False}).save()
+    calc_scores(match, console=console)
+
+    clan_ids = match.clans1_ids + match.clans2_ids
+    expected = build_clan_stats(clan_ids, console=console)
+    for clan_id in clan_ids:
+        cell = get_stats_cell(clan_id, console=console)
+        assert cell["total"] == match_obj.objects((Q(clans1_ids=clan_id) | Q(clans2_ids=clan_id))
+                                                  & Q(score_posted=True)).count()
+        assert cell == {"total": 0, "wins": 0, "caps": {}, "strength": 0, "rated": 0, **expected[clan_id]["total"]}
+    # the other clans do not have statistics yet
+    assert stats_obj.objects.count() == len(set(clan_ids))
+
+
+@pytest.mark.parametrize("console", [False, True])
+def test_statistics_follow_edited_and_deleted_matches(database, console):
+    match_obj = Match if not console else ConsoleMatch
+    history = build_history(1, console=console, num_matches=20)
+    assert verify_clan_stats(console=console) == []
+
+    edited, deleted = history[5], history[10]
+    edited.update(map="Carentan", caps1=edited.caps2, caps2=edited.caps1)
+    refresh_clan_stats(edited.clans1_ids + edited.clans2_ids, console=console)
+    match_obj.objects(match_id=deleted.match_id).delete()
+    refresh_clan_stats(deleted.clans1_ids + deleted.clans2_ids, console=console)
+    assert verify_clan_stats(console=console) == []
+
+
+def match_body(match, **changes):
+    # the JSON of a match for PUT and POST, without the id and the lowercase copies
+    doc = {k: v for k, v in match.to_mongo().to_dict().items() if k != "_id" and not k.endswith("_lower")}
+    return {**doc, "date": match.date.isoformat(), **changes}
+
+
+@pytest.mark.parametrize("console", [False, True])
+def test_statistics_follow_the_write_endpoints(app, client, console):
+    clan_obj, match_obj, score_obj = (Clan, Match, Score) if not console else (ConsoleClan, ConsoleMatch, ConsoleScore)
+    prefix = "" if not console else "/console"
+    headers = auth_headers(app)
+    history = build_history(2, console=console, num_matches=15)
+    clans = [str(oid) for oid in clan_obj.objects.scalar("id")]
+    assert verify_clan_stats(console=console) == []
+
+    # confirmation of a new match (an admin posts it)
+    body = match_body(history[-1], match_id="new", clans1_ids=clans[:1], clans2_ids=clans[1:2],
+                      player_dist1=[], player_dist2=[], conf1="", conf2="", score_posted=False)
+    response = client.post(f"{prefix}/matches", json=body, headers=headers)
+    assert (response.status_code, response.json["confirmed"]) == (201, True)
+    assert verify_clan_stats(console=console) == []
+
+    # map, side and caps of a posted match
+    match = history[3]
+    response = client.patch(f"{prefix}/match/{match.match_id}", headers=headers,
+                            json={"map": "Carentan", "caps1": match.caps2, "caps2": match.caps1,
+                                  "side1": "Allies", "side2": "Axis"})
+    assert response.status_code == 204
+    assert verify_clan_stats(console=console) == []
+
+    # the clans of a posted match
+    match = history[5]
+    others = [c for c in clans if c not in match.clans1_ids + match.clans2_ids]
+    body = match_body(match, clans1_ids=others[:1], clans2_ids=match.clans2_ids[:1], player_dist1=[], player_dist2=[])
+    response = client.put(f"{prefix}/match/{match.match_id}", json=body, headers=headers)
+    assert response.status_code == 200
+    assert verify_clan_stats(console=console) == []
+
+    response = client.delete(f"{prefix}/match/{history[7].match_id}", headers=headers)
+    assert response.status_code == 204
+    assert verify_clan_stats(console=console) == []
+
+    # the opponents' scores (strength) of the statistics
+    # raw, the Score documents are built without their id
+    score = score_obj.objects(match_id=history[9].match_id).as_pymongo().first()
+    assert client.patch(f"{prefix}/score/{score['_id']}", json={"score": 900}, headers=headers).status_code == 204
+    assert verify_clan_stats(console=console) == []
+    score = score_obj.objects(match_id=history[10].match_id).as_pymongo().first()
+    body = {"clan": score["clan"], "match_id": history[11].match_id, "num_matches": score["num_matches"], "score": 700}
+    assert client.put(f"{prefix}/score/{score['_id']}", json=body, headers=headers).status_code == 200
+    assert verify_clan_stats(console=console) == []
+    score = score_obj.objects(match_id=history[12].match_id).as_pymongo().first()
+    assert client.delete(f"{prefix}/score/{score['_id']}", headers=headers).status_code == 204
+    assert verify_clan_stats(console=console) == []
+
+
+@pytest.mark.parametrize("stats_obj", [ClanStats, ConsoleClanStats])
+def test_last_updated_is_the_time_of_the_write(database, stats_obj):
+    first = stats_obj(clan="a").save().last_updated
+    time.sleep(0.01)
+    assert stats_obj(clan="b").save().last_updated > first
@@ -0,0 +1,63 @@
+"""
+Conditional GET by the data version of a platform
+"""
+
+from conftest import build_history
+from logic.data_state import data_changed, get_data_version
+from models.data_state import DataState
+
+
+class CountingReads:
+    # in place of the DataState class of the data version, counts its reads
+    def __init__(self):
+        self.reads = 0
+
+    @property
+    def objects(self):
+        self.reads += 1
+        return DataState.objects
+
+
+def test_revalidation_does_not_read_the_database(client, monkeypatch):
+    build_history(0, num_matches=3)
+    data_changed("matches")
+    etag = client.get("/clans").headers["ETag"]
+    state = CountingReads()
+    monkeypatch.setattr(get_data_version(), "state_obj", state)
+
+    for path in ("/clans", "/matches", "/clans?limit=5"):
+        assert client.get(path, headers={"If-None-Match": etag}).status_code == 304
+    assert state.reads == 0
+
+
+def test_writes_change_the_etag(client, monkeypatch):
+    build_history(0, num_matches=3)
+    etag = client.get("/clans").headers["ETag"]
+    assert client.get("/clans", headers={"If-None-Match": etag}).status_code == 304
+
+    # a write of this process, noticed right away
+    data_changed("clans")
+    response = client.get("/clans", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+
+    # a write of another process, noticed with the next check
+    DataState.objects(collection="clans").update(inc__version=1)
+    assert client.get("/clans", headers={"If-None-Match": etag}).status_code == 304
+    monkeypatch.setattr("logic.data_state.CHECK_INTERVAL", 0)
+    assert client.get("/clans", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_only_cached_read_endpoints_are_public(client):
+    history = build_history(0, num_matches=3)
+    for path in ("/clans", "/matches", f"/clan/{history[0].clans1_ids[0]}"):
+        response = client.get(path)
+        assert response.headers["Cache-Control"] == "public, no-cache", path
+        assert response.headers["Surrogate-Key"], path
+
+    for path in ("/scores", f"/match/{history[0].match_id}", "/events"):
+        response = client.get(path)
+        assert response.status_code == 200, path
+        assert "ETag" in response.headers, path
+        assert "Cache-Control" not in response.headers, path
+        assert "Surrogate-Key" not in response.headers, path
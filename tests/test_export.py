@@ -0,0 +1,72 @@
+"""
+Bulk exports: the authorization and the exported documents against the list endpoints
+"""
+
+import csv
+import io
+import json
+
+import pytest
+
+from conftest import auth_headers, build_history, create_app
+from logic.data_state import data_changed
+from models.user import Role
+
+TOKEN = {"X-Export-Token": "export-token"}
+PATHS = ["/export/matches", "/export/scores", "/console/export/matches", "/console/export/scores"]
+
+
+def ndjson(response):
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+@pytest.mark.parametrize("path", PATHS)
+def test_export_authorization(app, client, path):
+    assert client.get(path).status_code == 401
+    assert client.get(path, headers={"X-Export-Token": "wrong"}).status_code == 401
+    assert client.get(path, headers={"X-Export-Token": ""}).status_code == 401
+    assert client.get(path, headers=auth_headers(app, Role.User)).status_code == 401
+    assert client.get(path, headers=TOKEN).status_code == 200
+    assert client.get(path, headers=auth_headers(app)).status_code == 200
+
+
+def test_export_token_is_disabled_without_config(database):
+    client = create_app(EXPORT_TOKEN=None).test_client()
+    assert client.get("/export/matches", headers={"X-Export-Token": "None"}).status_code == 401
+    assert client.get("/export/matches", headers=TOKEN).status_code == 401
+
+
+@pytest.mark.parametrize("console", [False, True])
+def test_export_equals_the_list_endpoints(client, console):
+    build_history(0, console=console, num_matches=20)
+    prefix = "" if not console else "/console"
+    for collection in ("matches", "scores"):
+        listed = client.get(f"{prefix}/{collection}").json
+        # the matches in an envelope with their count
+        listed = listed[collection] if isinstance(listed, dict) else listed
+        exported = ndjson(client.get(f"{prefix}/export/{collection}", headers=TOKEN))
+        assert sorted(exported, key=lambda doc: doc["_id"]["$oid"]) \
+            == sorted(listed, key=lambda doc: doc["_id"]["$oid"])
+
+        rows = list(csv.DictReader(io.StringIO(
+            client.get(f"{prefix}/export/{collection}?format=csv", headers=TOKEN).get_data(as_text=True))))
+        assert [row["_id"] for row in rows] == [doc["_id"]["$oid"] for doc in exported]
+
+
+def test_export_date_range_and_if_modified_since(client):
+    history = build_history(1, num_matches=20)
+    data_changed("matches")
+    date_from, date_to = history[5].date.date(), history[14].date.date()
+    exported = ndjson(client.get("/export/matches", headers=TOKEN, query_string={
+        "date_from": date_from.isoformat(), "date_to": date_to.isoformat()}))
+    # both days inclusive
+    assert sorted(doc["match_id"] for doc in exported) \
+        == sorted(match.match_id for match in history if date_from <= match.date.date() <= date_to)
+
+    response = client.get("/export/matches", headers=TOKEN)
+    modified = response.headers["Last-Modified"]
+    assert client.get("/export/matches", headers={**TOKEN, "If-Modified-Since": modified}).status_code == 304
+    # written since an older 'If-Modified-Since'
+    older = "Mon, 01 Jan 2001 00:00:00 GMT"
+    assert client.get("/export/matches", headers={**TOKEN, "If-Modified-Since": older}).status_code == 200
@@ -0,0 +1,131 @@
+"""
+The getter functions against the lookups of the baseline (tests/baseline.py)
+"""
+
+import random
+from datetime import timedelta
+
+import pytest
+from bson import ObjectId
+
+import baseline
+from conftest import build_history
+from logic._getter import get_by_clan_id, get_clan_objects, get_clans, get_score_before, get_scores_before
+from logic.data_state import data_changed
+from logic.helo_functions import get_coop_scores
+from models.clan import Clan
+from models.match import Match
+from models.console.console_clan import ConsoleClan
+from models.console.console_match import ConsoleMatch
+
+
+def add_unconfirmed(history, console, num=10, seed=0):
+    """Adds matches without Score objects between the matches of the history, some of them
+    right after another unconfirmed match of the same clans.
+
+    Returns:
+        list: the unconfirmed Match or ConsoleMatch objects
+    """
+    rnd = random.Random(seed)
+    match_obj = Match if not console else ConsoleMatch
+    added = []
+    for i in range(num):
+        before = rnd.choice(added + history) if added and rnd.random() < 0.3 else rnd.choice(history)
+        kwargs = dict(match_id=f"u{i}", clans1_ids=before.clans1_ids, clans2_ids=before.clans2_ids,
+                      caps1=3, caps2=2, map="Foy", conf1="a", conf2="b", score_posted=False,
+                      date=before.date + timedelta(milliseconds=rnd.randint(1, 900)))
+        if not console:
+            kwargs.update(factor=1.0, players=50)
+        else:
+            kwargs.update(factor=1.0, players1=40, players2=40, team_size1=50, team_size2=50, offensive=False)
+        added.append(match_obj(**kwargs).save())
+    return added
+
+
+def pairs(matches):
+    return [(clan_id, match) for match in matches for clan_id in match.clans1_ids + match.clans2_ids]
+
+
+def score_tuple(score):
+    return score.clan, score.match_id, score.num_matches, score.score
+
+
+@pytest.mark.parametrize("console", [False, True])
+def test_get_by_clan_id_equals_the_recursive_lookup(database, console):
+    history = build_history(3, console=console, num_matches=30)
+    unconfirmed = add_unconfirmed(history, console)
+
+    for clan_id, match in pairs(history + unconfirmed):
+        assert score_tuple(get_by_clan_id(match, clan_id)) == score_tuple(baseline.get_by_clan_id(match, clan_id))
+
+
+@pytest.mark.parametrize("console", [False, True])
+def test_get_scores_before_equals_get_score_before(database, console):
+    history = build_history(4, console=console, num_matches=30)
+    unconfirmed = add_unconfirmed(history, console)
+    # every clan in several matches, several rounds of the batch
+    all_pairs = pairs(history + unconfirmed)
+    assert len(all_pairs) > len({clan_id for clan_id, _ in all_pairs})
+
+    for inclusive in (True, False):
+        scores = get_scores_before(all_pairs, console=console, inclusive=inclusive)
+        assert len(scores) == len({(clan_id, match.match_id) for clan_id, match in all_pairs})
+        for clan_id, match in all_pairs:
+            expected = get_score_before(match, clan_id, inclusive=inclusive)
+            assert score_tuple(scores[(clan_id, match.match_id)]) == score_tuple(expected)
+
+
+def clan_tuples(clans):
+    return [(str(clan.id), clan.tag, clan.score, clan.num_matches) for clan in clans]
+
+
+@pytest.mark.parametrize("console", [False, True])
+def test_get_clan_objects_equals_the_per_id_lookup(database, console):
+    history = build_history(5, console=console, num_matches=20)
+    # the scores of the clans written by another process after they have been cached
+    clan_obj = Clan if not console else ConsoleClan
+    clan_obj.objects.update(inc__score=1)
+    data_changed("clans", console=console)
+
+    for match in history:
+        clans1, clans2 = get_clan_objects(match, max_age=0)
+        expected1, expected2 = baseline.get_clan_objects(match)
+        assert (clan_tuples(clans1), clan_tuples(clans2)) == (clan_tuples(expected1), clan_tuples(expected2))
+
+
+@pytest.mark.parametrize("console", [False, True])
+def test_get_clans_keeps_the_order_and_lists_all_missing_ids(database, console):
+    clan_obj = Clan if not console else ConsoleClan
+    a, b, c = [clan_obj(tag=tag).save() for tag in "ABC"]
+    ids = [str(c.id), str(a.id), str(c.id), str(b.id)]
+    assert [clan.tag for clan in get_clans(ids, console=console)] == ["C", "A", "C", "B"]
+
+    missing = [str(ObjectId()), str(ObjectId())]
+    with pytest.raises(clan_obj.DoesNotExist) as e:
+        get_clans([str(a.id)] + missing, console=console)
+    assert all(oid in str(e.value) for oid in missing)
+
+
+def test_simulation_uses_the_clans_of_the_request(client):
+    build_history(6, num_matches=20)
+    clans = list(Clan.objects)
+    clans1_ids, clans2_ids = [str(clans[3].id), str(clans[0].id)], [str(clans[5].id)]
+    body = dict(clans1_ids=clans1_ids, clans2_ids=clans2_ids, caps1=4, caps2=1, player_dist1=[30, 20],
+                player_dist2=[50], factor=2.0, players=50)
+    response = client.get("/simulations", json=body)
+    assert response.status_code == 200, response.get_data(as_text=True)
+
+    # the clans of the baseline, one query per id
+    clans1 = [Clan.objects.get(id=oid) for oid in clans1_ids]
+    clans2 = [Clan.objects.get(id=oid) for oid in clans2_ids]
+    scores1, scores2, _ = get_coop_scores([clan.score for clan in clans1], [clan.score for clan in clans2], 4, 1,
+                                          c=2.0, player_dist1=[30, 20], player_dist2=[50], num_players=50,
+                                          num_matches1=[clan.num_matches for clan in clans1],
+                                          num_matches2=[clan.num_matches for clan in clans2])
+    assert [(side["name"], side["new_score"]) for side in response.json["side1"]] \
+        == [(clan.tag, score) for clan, score in zip(clans1, scores1)]
+    assert [(side["name"], side["new_score"]) for side in response.json["side2"]] \
+        == [(clan.tag, score) for clan, score in zip(clans2, scores2)]
+
+    body["clans2_ids"] = [str(ObjectId())]
+    assert client.get("/simulations", json=body).status_code == 404
@@ -0,0 +1,75 @@
+"""
+The batch HeLO functions against the scalar ones, element by element
+"""
+
+import random
+
+import numpy as np
+import pytest
+
+from logic.helo_functions import (get_new_console_scores, get_new_console_scores_batch,
+                                  get_new_scores, get_new_scores_batch, get_win_prob, get_win_probs)
+
+
+def matchups(seed, num=5000):
+    rnd = random.Random(seed)
+    for _ in range(num):
+        caps1 = rnd.randint(0, 5)
+        # a few matchups with an invalid sum of caps
+        caps2 = 5 - caps1 if rnd.random() < 0.95 else rnd.randint(0, 5 - caps1)
+        # the scores close to each other or more than 400 apart, the numbers of matches
+        # around the thresholds
+        yield dict(score1=rnd.randint(300, 900), score2=rnd.randint(300, 900), caps1=caps1, caps2=caps2,
+                   matches1=rnd.choice([0, 9, 10, 11, 29, 30, 31, 32, rnd.randint(0, 200)]),
+                   matches2=rnd.choice([0, 9, 10, 11, 29, 30, 31, 32, rnd.randint(0, 200)]))
+
+
+def columns(rows):
+    # the arguments of the batch functions, 'scores1' instead of 'score1'
+    names = {"score1": "scores1", "score2": "scores2"}
+    return {names.get(key, key): np.array([row[key] for row in rows]) for key in rows[0]}
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_win_probs_equal_get_win_prob(seed):
+    rows = list(matchups(seed))
+    cols = columns(rows)
+    prob1, prob2 = get_win_probs(cols["scores1"], cols["scores2"])
+    assert list(zip(prob1, prob2)) == [get_win_prob(row["score1"], row["score2"]) for row in rows]
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_batch_equals_get_new_scores(seed):
+    rnd = random.Random(seed)
+    rows = [{**row, "c": rnd.choice([0.5, 0.6, 0.8, 1, 1.2, 2]), "number_of_players": rnd.randint(6, 50)}
+            for row in matchups(seed)]
+    new1, new2, err = get_new_scores_batch(**columns(rows))
+    for row, score1, score2, failed in zip(rows, new1, new2, err):
+        expected1, expected2, expected_err = get_new_scores(**row)
+        assert failed == (expected_err is not None)
+        if not failed:
+            assert (score1, score2) == (expected1, expected2)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_batch_equals_get_new_console_scores(seed):
+    rnd = random.Random(seed)
+    rows = []
+    for row in matchups(seed):
+        t1, t2 = rnd.randint(20, 50), rnd.randint(20, 50)
+        rows.append({**row, "c": rnd.choice([0.8, 1, 1.2]), "t1": t1, "t2": t2,
+                     "n1": rnd.randint(t1 // 2, t1), "n2": rnd.randint(t2 // 2, t2),
+                     "offensive": rnd.random() < 0.3})
+    new1, new2, err = get_new_console_scores_batch(**columns(rows))
+    for row, score1, score2, failed in zip(rows, new1, new2, err):
+        expected1, expected2, expected_err = get_new_console_scores(**row)
+        assert failed == (expected_err is not None)
+        if not failed:
+            assert (score1, score2) == (expected1, expected2)
+
+
+def test_batch_broadcasts_scalars():
+    new1, new2, err = get_new_scores_batch([600, 700], 650, [5, 1], [0, 4], matches1=31)
+    assert [(a, b) for a, b in zip(new1, new2)] == [get_new_scores(600, 650, 5, 0, 31)[:2],
+                                                   get_new_scores(700, 650, 1, 4, 31)[:2]]
+    assert not err.any()
@@ -0,0 +1,65 @@
+"""
+Indexes of the frequent queries
+"""
+
+import os
+
+import pytest
+from mongoengine import connect, disconnect_all
+
+from database.indexes import find_collscans, get_hot_queries, sync_indexes
+
+# a mongo db for the query plans, mongomock does not explain queries
+MONGODB_HOST = os.environ.get("HELO_TEST_MONGODB_HOST")
+
+
+def _branches(query):
+    # the sets of filtered fields, one for every branch of $or
+    branches = [set()]
+    for key, value in query.items():
+        if key == "$or":
+            subs = [sub for q in value for sub in _branches(q)]
+            branches = [branch | sub for branch in branches for sub in subs]
+        elif key == "$and":
+            for q in value:
+                branches = [branch | sub for branch in branches for sub in _branches(q)]
+        else:
+            branches = [branch | {key} for branch in branches]
+    return branches
+
+
+def _leading_fields(model):
+    # the first field of every declared (not text) index
+    fields = {"_id"}
+    for spec in model._meta["index_specs"]:
+        field, direction = spec["fields"][0]
+        if direction != "text":
+            fields.add(field)
+    return fields
+
+
+@pytest.mark.parametrize("console", [False, True])
+def test_frequent_queries_filter_by_an_indexed_field(database, console):
+    unindexed = []
+    for description, queryset in get_hot_queries(console):
+        leading = _leading_fields(queryset._document)
+        if not all(branch & leading for branch in _branches(queryset._query)):
+            unindexed.append(description)
+    assert unindexed == []
+
+
+@pytest.fixture
+def mongodb():
+    if not MONGODB_HOST:
+        pytest.skip("HELO_TEST_MONGODB_HOST is not set")
+    disconnect_all()
+    connect("helo_test", host=MONGODB_HOST, alias="default")
+    connect("helo_test_console", host=MONGODB_HOST, alias="console")
+    yield
+    disconnect_all()
+
+
+@pytest.mark.parametrize("console", [False, True])
+def test_frequent_queries_do_not_scan_collections(mongodb, console):
+    sync_indexes(console=console)
+    assert find_collscans(console=console) == []
@@ -0,0 +1,79 @@
+"""
+The lease of the recalculations, held by one process at a time
+"""
+
+import threading
+import time
+
+import pytest
+
+from logic.lease import LeaseLost, MongoLease
+
+
+@pytest.fixture
+def leases(database):
+    # the leases of two processes, released after the test
+    held = []
+
+    def lease(name="recalculation", **kwargs):
+        held.append(MongoLease(name, **kwargs))
+        return held[-1]
+
+    yield lease
+    for lease in held:
+        lease.release()
+
+
+def test_one_holder_at_a_time(leases):
+    first, second = leases(purpose="replay"), leases(purpose="confirmation")
+    assert first.acquire()
+    assert not second.acquire()
+    assert second.holder() == "replay"
+    # other names and the other platform are independent
+    assert leases("other").acquire()
+    assert leases(console=True).acquire()
+
+    first.release()
+    assert first.holder() is None
+    assert second.acquire()
+    assert first.holder() == "confirmation"
+
+
+def test_acquire_waits_for_the_release(leases):
+    first, second = leases(), leases()
+    assert first.acquire()
+    threading.Timer(0.2, first.release).start()
+    assert not second.acquire(wait=0.05)
+    assert second.acquire(wait=5)
+
+
+def test_heartbeat_keeps_the_lease(leases):
+    first, second = leases(ttl=0.3), leases(ttl=0.3)
+    assert first.acquire()
+    time.sleep(0.6)
+    assert not second.acquire()
+    first.check()
+
+
+def test_expired_lease_is_taken_over(leases):
+    first, second = leases(ttl=0.3, purpose="replay"), leases(ttl=0.3, purpose="replay")
+    assert first.acquire()
+    # the holder stops extending the lease, e.g. its process hangs
+    first._stop.set()
+    first._heartbeat.join()
+    assert not second.acquire()
+    time.sleep(0.4)
+    assert second.holder() is None
+    assert second.acquire()
+
+    # the former holder notices with its next heartbeat, and stops writing
+    first._stop.clear()
+    first._heartbeat = threading.Thread(target=first._extend, daemon=True)
+    first._heartbeat.start()
+    first._heartbeat.join(timeout=5)
+    with pytest.raises(LeaseLost):
+        first.check()
+    # its release does not release the lease of the new holder
+    first.release()
+    assert first.holder() == "replay"
+    second.check()
@@ -0,0 +1,85 @@
+"""
+Pagination of the list endpoints
+"""
+
+import random
+
+import pytest
+from flask import Flask
+from flask_restful import Api
+
+from models.clan import Clan
+from models.console.console_clan import ConsoleClan
+from rest.clans import ClansApi, ConsoleClansApi
+from rest.matches import ConsoleMatchesApi, MatchesApi
+from rest.scores import ConsoleScoresApi, ScoresApi
+
+RESOURCES = {"/clans": ClansApi, "/matches": MatchesApi, "/scores": ScoresApi,
+             "/console/clans": ConsoleClansApi, "/console/matches": ConsoleMatchesApi,
+             "/console/scores": ConsoleScoresApi}
+
+
+@pytest.fixture
+def client(database):
+    app = Flask(__name__)
+    api = Api(app)
+    for path, resource in RESOURCES.items():
+        api.add_resource(resource, path)
+    return app.test_client()
+
+
+@pytest.mark.parametrize("path", list(RESOURCES))
+@pytest.mark.parametrize("cursor", ["", "eyJ9"])
+def test_count_cannot_be_used_with_a_cursor(client, path, cursor):
+    response = client.get(path, query_string={"cursor": cursor, "count": "exact", "limit": 10})
+    assert response.status_code == 400
+    assert "'count' cannot be used with a cursor" in response.get_data(as_text=True)
+
+
+@pytest.mark.parametrize("path", list(RESOURCES))
+def test_cursor_and_count_pages(client, path):
+    assert client.get(path, query_string={"cursor": "", "limit": 10}).status_code == 200
+    assert client.get(path, query_string={"count": "exact", "limit": 10}).status_code == 200
+
+
+@pytest.mark.parametrize("path", list(RESOURCES))
+@pytest.mark.parametrize("cursor", ["", "eyJ9"])
+def test_offset_cannot_be_used_with_a_cursor(client, path, cursor):
+    response = client.get(path, query_string={"cursor": cursor, "offset": 5, "limit": 10})
+    assert response.status_code == 400
+    assert "'offset' cannot be used with a cursor" in response.get_data(as_text=True)
+
+
+def walk(client, path, key, **query):
+    # the documents of all pages, following the cursors
+    docs, cursor = [], ""
+    while cursor is not None:
+        response = client.get(path, query_string={**query, "cursor": cursor})
+        assert response.status_code == 200, response.get_data(as_text=True)
+        docs += response.json[key]
+        cursor = response.json["meta"]["next_cursor"]
+    return docs
+
+
+@pytest.mark.parametrize("path, clan_obj", [("/clans", Clan), ("/console/clans", ConsoleClan)])
+@pytest.mark.parametrize("sort_by", ["name", "score"])
+@pytest.mark.parametrize("desc", [None, "true"])
+@pytest.mark.parametrize("limit", [1, 3, 4])
+def test_cursor_walks_every_document_once(client, path, clan_obj, sort_by, desc, limit):
+    rnd = random.Random(limit)
+    for num in range(20):
+        # duplicate values, missing and null values
+        clan = clan_obj(tag=f"C{num}", name=rnd.choice(["A", "B", "C", None]), score=rnd.choice([500, 600, 700]))
+        clan.save()
+    clan_obj._get_collection().insert_many([{"tag": "N1", "name": None, "score": None},
+                                            {"tag": "N2", "name": None, "score": 600}])
+    query = {"sort_by": sort_by, "limit": limit, **({"desc": desc} if desc else {})}
+
+    docs = walk(client, path, "clans", **query)
+    tags = [doc["tag"] for doc in docs]
+    assert sorted(tags) == sorted(clan_obj.objects.scalar("tag"))
+    # the order of the documents in one query, null (and missing) values first
+    expected = sorted(clan_obj._get_collection().find(), key=lambda doc: (doc.get(sort_by) is not None,
+                                                                             doc.get(sort_by) or 0, doc["_id"]),
+                      reverse=bool(desc))
+    assert tags == [doc["tag"] for doc in expected]
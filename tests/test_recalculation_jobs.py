@@ -0,0 +1,118 @@
+"""
+Recalculations as background jobs
+"""
+
+from datetime import datetime
+
+import pytest
+
+import logic.recalculation_jobs
+import logic.recalculations
+from conftest import snapshot
+from logic.calculations import calc_scores
+from logic.lease import MongoLease
+from logic.recalculation_jobs import resume_failed_jobs, run_next_job, submit_recalculation
+from logic.recalculations import start_recalculation
+from models.clan import Clan
+from models.match import Match
+from models.console.console_clan import ConsoleClan
+from models.console.console_match import ConsoleMatch
+
+
+def two_edits(reset, recalculate, console, num_edited=2):
+    reset()
+    clan_obj, match_obj = (Clan, Match) if not console else (ConsoleClan, ConsoleMatch)
+    a, b, c, d = [str(clan_obj(tag=tag).save().id) for tag in "ABCD"]
+    kwargs = dict(caps1=4, caps2=1, map="Foy", conf1="a", conf2="b", score_posted=False)
+    kwargs.update(dict(factor=2.0, players=50) if not console else
+                  dict(factor=1.0, players1=50, players2=50, team_size1=50, team_size2=50, offensive=False))
+    matches = [match_obj(match_id="e1", clans1_ids=[a], clans2_ids=[b], date=datetime(2022, 1, 1), **kwargs),
+               match_obj(match_id="e2", clans1_ids=[c], clans2_ids=[d], date=datetime(2022, 1, 2), **kwargs),
+               match_obj(match_id="m3", clans1_ids=[a], clans2_ids=[d], date=datetime(2022, 1, 3), **kwargs)]
+    for match in matches:
+        calc_scores(match.save(), console=console)
+    edited = matches[:num_edited]
+    for match in edited:
+        match.update(caps1=1, caps2=4, recalculate=True)
+        match.reload()
+    recalculate(edited, console)
+    return snapshot(console)
+
+
+def one_by_one(edited, console):
+    for match in edited:
+        start_recalculation(match, console=console)
+
+
+def coalesced(edited, console):
+    jobs = [submit_recalculation(match, console=console) for match in edited]
+    assert len({job.id for job in jobs}) == 1
+    job = run_next_job(console=console)
+    assert job.status == "done"
+
+
+@pytest.mark.parametrize("console", [False, True])
+def test_coalesced_recalculation_replays_every_requested_match(database, console):
+    expected = two_edits(database, one_by_one, console)
+    assert two_edits(database, coalesced, console) == expected
+    match_obj = Match if not console else ConsoleMatch
+    assert match_obj.objects(recalculate=True).count() == 0
+
+
+@pytest.mark.parametrize("console", [False, True])
+def test_failed_recalculation_resumes_after_the_committed_matches(database, monkeypatch, console):
+    get_match_scores = logic.recalculations.get_match_scores
+    replayed = []
+
+    def fail_once(match, *args, **kwargs):
+        # the calculation of the second replayed match fails the first time
+        replayed.append(match.match_id)
+        if len(replayed) == 2:
+            raise ValueError("calculation failed")
+        return get_match_scores(match, *args, **kwargs)
+
+    def failed_and_resumed(edited, console):
+        [match] = edited
+        submit_recalculation(match, console=console)
+        job = run_next_job(console=console)
+        assert (job.status, job.replayed, job.error) == ("failed", 1, "calculation failed")
+        assert type(job).objects.get(id=job.id).replayed == 1
+        assert resume_failed_jobs(console=console) == 1
+        job = run_next_job(console=console)
+        assert (job.status, job.replayed, job.total) == ("done", 2, 2)
+
+    expected = two_edits(database, one_by_one, console, num_edited=1)
+    monkeypatch.setattr(logic.recalculation_jobs, "COMMIT_EVERY", 1)
+    monkeypatch.setattr(logic.recalculations, "get_match_scores", fail_once)
+    assert two_edits(database, failed_and_resumed, console, num_edited=1) == expected
+    # the resumed job does not replay the committed match again
+    assert replayed == ["e1", "m3", "m3"]
+
+
+@pytest.mark.parametrize("console", [False, True])
+def test_lost_lease_stops_the_recalculation(database, monkeypatch, console):
+    check = MongoLease.check
+    checks = []
+
+    def lost_after_the_first_commit(self):
+        # the lease is taken over by another process after the first committed match
+        checks.append(self.purpose)
+        if len(checks) == 2:
+            self.lost = True
+        return check(self)
+
+    def stopped_and_resumed(edited, console):
+        [match] = edited
+        submit_recalculation(match, console=console)
+        monkeypatch.setattr(MongoLease, "check", lost_after_the_first_commit)
+        job = run_next_job(console=console)
+        # not failed, the process that has taken over the lease resumes it
+        stored = type(job).objects.get(id=job.id)
+        assert (stored.status, stored.replayed) == ("running", 1)
+        monkeypatch.setattr(MongoLease, "check", check)
+        job = run_next_job(console=console)
+        assert (job.status, job.replayed, job.total) == ("done", 2, 2)
+
+    expected = two_edits(database, one_by_one, console, num_edited=1)
+    monkeypatch.setattr(logic.recalculation_jobs, "COMMIT_EVERY", 1)
+    assert two_edits(database, stopped_and_resumed, console, num_edited=1) == expected
@@ -0,0 +1,124 @@
+"""
+Previews of recalculations: nothing is written, and the changes equal the ones of the recalculation
+"""
+
+from datetime import timedelta
+
+import pytest
+
+from conftest import auth_headers, build_history
+from database.indexes import get_models
+from logic.checkpoints import write_checkpoint
+from logic.data_state import data_changed
+from logic.recalculations import Replay, preview_recalculation, start_recalculation
+from models.clan import Clan
+from models.match import Match
+from models.user import Role
+from models.console.console_clan import ConsoleClan
+from models.console.console_match import ConsoleMatch
+
+
+def database_state():
+    # every document of both databases
+    return {model._get_collection_name(): sorted(map(repr, model._get_collection().find()))
+            for model in get_models() + get_models(console=True)}
+
+
+def ranked_clans(console):
+    """The score, number of matches and rank (1 is the best, shared by equal scores) of every clan.
+
+    Returns:
+        dict: clan id -> (score, num_matches, rank)
+    """
+    clan_obj = Clan if not console else ConsoleClan
+    field = clan_obj._fields["score"]
+    clans = {str(doc["_id"]): (float(field.to_python(doc["score"])), doc["num_matches"])
+             for doc in clan_obj.objects.as_pymongo()}
+    return {oid: (score, num, 1 + sum(other > score for other, _ in clans.values()))
+            for oid, (score, num) in clans.items()}
+
+
+def edit(history, console):
+    match = history[len(history) // 3]
+    match.caps1, match.caps2 = 5 - match.caps1, 5 - match.caps2
+    return match, False
+
+
+def insert(history, console):
+    match_obj = Match if not console else ConsoleMatch
+    before = history[len(history) // 3]
+    kwargs = dict(match_id="added", clans1_ids=before.clans1_ids[:1], clans2_ids=before.clans2_ids[:1],
+                  caps1=4, caps2=1, map="Foy", conf1="a", conf2="b", date=before.date + timedelta(milliseconds=500),
+                  score_posted=False)
+    if not console:
+        kwargs.update(factor=2.0, players=50)
+    else:
+        kwargs.update(factor=1.0, players1=50, players2=40, team_size1=50, team_size2=50, offensive=False)
+    return match_obj(**kwargs), False
+
+
+def delete(history, console):
+    return history[len(history) // 3], True
+
+
+def recalculate(match, removed, console):
+    # what the recalculation writes after the edit, the insertion or the deletion
+    if not removed:
+        match.recalculate = True
+        match.save()
+        start_recalculation(match, console=console)
+    else:
+        replay = Replay(match, console=console, removed=True)
+        replay.load()
+        replay.run()
+        replay.commit()
+        match.delete()
+
+
+@pytest.mark.parametrize("console", [False, True])
+@pytest.mark.parametrize("change", [edit, insert, delete])
+@pytest.mark.parametrize("seed", range(2))
+def test_preview_writes_nothing_and_equals_the_recalculation(database, console, change, seed):
+    history = build_history(seed, console=console, num_matches=40)
+    write_checkpoint(history[5], console=console)
+    data_changed("matches", "scores", "clans", console=console)
+    match, removed = change(history, console)
+    before, old = database_state(), ranked_clans(console)
+
+    preview = preview_recalculation(match, console=console, removed=removed)
+    assert database_state() == before
+
+    recalculate(match, removed, console)
+    new = ranked_clans(console)
+    changed = [oid for oid in old if old[oid][0] != new[oid][0] or old[oid][2] != new[oid][2]]
+    assert changed
+    assert sorted(clan["clan"] for clan in preview["clans"]) == sorted(changed)
+    for clan in preview["clans"]:
+        oid = clan["clan"]
+        assert (clan["old_score"], clan["old_num_matches"], clan["old_rank"]) == old[oid]
+        assert (clan["new_score"], clan["new_num_matches"], clan["new_rank"]) == new[oid]
+        assert clan["rank_change"] == old[oid][2] - new[oid][2]
+    assert [clan["new_rank"] for clan in preview["clans"]] == sorted(clan["new_rank"] for clan in preview["clans"])
+
+
+@pytest.mark.parametrize("console", [False, True])
+def test_preview_endpoint(app, client, console):
+    history = build_history(0, console=console, num_matches=30)
+    path = "/recalculations/preview" if not console else "/console/recalculations/preview"
+    match = history[10]
+    body = {"match_id": match.match_id, "caps1": 5 - match.caps1, "caps2": 5 - match.caps2}
+    before = database_state()
+
+    response = client.post(path, json=body, headers=auth_headers(app))
+    assert response.status_code == 200, response.get_data(as_text=True)
+    match.caps1, match.caps2 = body["caps1"], body["caps2"]
+    assert response.json == preview_recalculation(match, console=console)
+    response = client.post(path, json={"match_id": match.match_id, "delete": True}, headers=auth_headers(app))
+    assert response.status_code == 200
+    assert response.json["removed"] and response.json["clans"]
+    assert database_state() == before
+
+    assert client.post(path, json=body, headers=auth_headers(app, Role.User)).status_code == 401
+    assert client.post(path, json={"match_id": "unknown", "delete": True},
+                       headers=auth_headers(app)).status_code == 404
+    assert client.post(path, json={"caps1": 5}, headers=auth_headers(app)).status_code == 400
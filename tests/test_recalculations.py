@@ -0,0 +1,129 @@
+"""
+The in-memory replay against the recalculation of the baseline (tests/baseline.py)
+"""
+
+from datetime import datetime, timedelta
+from functools import partial
+
+import pytest
+
+import baseline
+from conftest import build_history, snapshot
+from logic.calculations import calc_scores
+from logic.recalculations import start_recalculation
+from models.clan import Clan
+from models.match import Match
+from models.console.console_clan import ConsoleClan
+from models.console.console_match import ConsoleMatch
+
+# the baseline passes the number of matches including a posted match to the HeLO functions,
+# the replay (and calc_scores when a match is confirmed) the number before the match
+per_match_recalculation = partial(baseline.start_recalculation, num_offset=-1)
+# long enough that clans cross the thresholds of the HeLO functions (more than 30 matches on PC,
+# more than 10 and 30 on console)
+LONG_HISTORY = dict(num_clans=4, num_matches=120)
+
+
+def edit(history, console):
+    match = history[len(history) // 3]
+    match.update(caps1=5 - match.caps1, caps2=5 - match.caps2, recalculate=True)
+    match.reload()
+    return match
+
+
+def insert(history, console):
+    match_obj = Match if not console else ConsoleMatch
+    before = history[len(history) // 3]
+    # between the match and the next one, the dates of the history are whole seconds
+    kwargs = dict(match_id="added", clans1_ids=before.clans1_ids[:1], clans2_ids=before.clans2_ids[:1],
+                  caps1=4, caps2=1, map="Foy", conf1="a", conf2="b", date=before.date + timedelta(milliseconds=500),
+                  score_posted=False, recalculate=True)
+    if not console:
+        kwargs.update(factor=2.0, players=50)
+    else:
+        kwargs.update(factor=1.0, players1=50, players2=40, team_size1=50, team_size2=50, offensive=False)
+    return match_obj(**kwargs).save()
+
+
+def recalculated(reset, recalculate, change, seed, console, **history_kwargs):
+    reset()
+    history = build_history(seed, console=console, **history_kwargs)
+    recalculate(change(history, console), console=console)
+    return snapshot(console)
+
+
+@pytest.mark.parametrize("console", [False, True])
+@pytest.mark.parametrize("change", [edit, insert])
+@pytest.mark.parametrize("seed", range(3))
+def test_replay_equals_per_match_recalculation(database, console, change, seed):
+    expected = recalculated(database, per_match_recalculation, change, seed, console)
+    assert recalculated(database, start_recalculation, change, seed, console) == expected
+
+
+@pytest.mark.parametrize("console", [False, True])
+@pytest.mark.parametrize("change", [edit, insert])
+@pytest.mark.parametrize("seed", range(2))
+def test_replay_equals_per_match_recalculation_across_the_thresholds(database, console, change, seed):
+    expected = recalculated(database, per_match_recalculation, change, seed, console, **LONG_HISTORY)
+    clan_obj = Clan if not console else ConsoleClan
+    assert max(clan_obj.objects.scalar("num_matches")) > 30
+    assert recalculated(database, start_recalculation, change, seed, console, **LONG_HISTORY) == expected
+
+
+@pytest.mark.parametrize("console", [False, True])
+def test_baseline_changes_the_scores_of_unchanged_matches_across_the_thresholds(database, console):
+    # the baseline calculates a posted match with the number of matches including it, so
+    # the clans past a threshold get other scores than at their confirmation, the replay
+    # calculates it like the confirmation
+    history = build_history(0, console=console, **LONG_HISTORY)
+    confirmed = snapshot(console)
+    baseline.start_recalculation(history[0], console=console)
+    assert snapshot(console) != confirmed
+
+    database()
+    history = build_history(0, console=console, **LONG_HISTORY)
+    start_recalculation(history[0], console=console)
+    assert snapshot(console) == confirmed
+
+
+@pytest.mark.parametrize("console", [False, True])
+def test_replay_equals_the_baseline_before_the_thresholds(database, console):
+    # PC has no threshold below 31 matches, console one at 10
+    history_kwargs = dict(num_matches=40) if not console else dict(num_matches=12)
+    expected = recalculated(database, baseline.start_recalculation, edit, 0, console, **history_kwargs)
+    clan_obj = Clan if not console else ConsoleClan
+    assert max(clan_obj.objects.scalar("num_matches")) <= (30 if not console else 10)
+    assert recalculated(database, start_recalculation, edit, 0, console, **history_kwargs) == expected
+
+
+@pytest.mark.parametrize("console", [False, True])
+def test_replay_of_unchanged_matches_keeps_the_scores(database, console):
+    history = build_history(0, console=console)
+    expected = snapshot(console)
+    start_recalculation(history[0], console=console)
+    assert snapshot(console) == expected
+
+
+def late_confirmation(reset, recalculate, console):
+    reset()
+    clan_obj, match_obj = (Clan, Match) if not console else (ConsoleClan, ConsoleMatch)
+    a, b, c, d = [str(clan_obj(tag=tag).save().id) for tag in "ABCD"]
+    kwargs = dict(caps1=4, caps2=1, map="Foy", conf1="a", conf2="b", score_posted=False)
+    kwargs.update(dict(factor=2.0, players=50) if not console else
+                  dict(factor=1.0, players1=50, players2=50, team_size1=50, team_size2=50, offensive=False))
+    m1 = match_obj(match_id="m1", clans1_ids=[a], clans2_ids=[b], date=datetime(2022, 1, 1), **kwargs).save()
+    m2 = match_obj(match_id="m2", clans1_ids=[a], clans2_ids=[d], date=datetime(2022, 1, 2), **kwargs).save()
+    m3 = match_obj(match_id="m3", clans1_ids=[a], clans2_ids=[c], date=datetime(2022, 1, 3), **kwargs).save()
+    # m2 is confirmed after m3, its Score object of A has num_matches 3
+    for match in (m1, m3, m2):
+        calc_scores(match, console=console)
+    m3.update(caps1=1, caps2=4, recalculate=True)
+    m3.reload()
+    recalculate(m3, console=console)
+    return snapshot(console)
+
+
+@pytest.mark.parametrize("console", [False, True])
+def test_replay_reads_scores_of_late_confirmed_matches(database, console):
+    expected = late_confirmation(database, per_match_recalculation, console)
+    assert late_confirmation(database, start_recalculation, console) == expected
@@ -0,0 +1,43 @@
+"""
+Response cache of the read endpoints
+"""
+
+from flask import Flask, jsonify
+
+from cache import response_cache
+from models.clan import Clan
+from models.data_state import DataState
+from rest._conditional import initialize_conditional_requests
+from rest._response_cache import initialize_response_cache
+
+
+def create_app():
+    app = Flask(__name__)
+    app.config.update(RESPONSE_CACHE_ENABLED=True, IS_CONSOLE_API=False)
+
+    @app.route("/clans")
+    def clans():
+        return jsonify(sorted(Clan.objects.scalar("tag")))
+
+    initialize_conditional_requests(app)
+    initialize_response_cache(app)
+    return app
+
+
+def test_pages_of_an_older_data_version_are_not_served(database, monkeypatch):
+    client = create_app().test_client()
+    Clan(tag="A").save()
+    DataState(collection="clans", version=1).save()
+    assert client.get("/clans").json == ["A"]
+    assert client.get("/clans").headers["X-Cache"] == "HIT"
+
+    # a write of another process, whose invalidation has not reached this cache
+    Clan(tag="B").save()
+    DataState.objects(collection="clans").update(inc__version=1)
+    # noticed with the next check of the data version
+    assert client.get("/clans").headers["X-Cache"] == "HIT"
+    monkeypatch.setattr("logic.data_state.CHECK_INTERVAL", 0)
+    response = client.get("/clans")
+    assert response.headers["X-Cache"] == "MISS"
+    assert response.json == ["A", "B"]
+    response_cache.clear()
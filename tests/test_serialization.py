@@ -0,0 +1,108 @@
+"""
+Serialization of the documents in the responses and exports
+"""
+
+import csv
+import io
+import json
+from datetime import datetime
+
+import pytest
+from bson import Decimal128, ObjectId, json_util
+from bson.json_util import LEGACY_JSON_OPTIONS
+from mongoengine.queryset import QuerySet
+
+from conftest import build_history
+from database.db import MongoJSONEncoder, exclude_shadow_fields
+from models.clan import Clan
+from models.match import Match
+from models.score import Score
+from models.console.console_clan import ConsoleClan
+from models.console.console_match import ConsoleMatch
+from models.console.console_score import ConsoleScore
+from rest._common import stream_response
+
+NDJSON = {"Accept": "application/x-ndjson"}
+
+
+def documents(response):
+    # the documents of a JSON list, page or document, NDJSON or CSV response
+    assert response.status_code == 200, response.get_data(as_text=True)
+    if response.mimetype == "application/x-ndjson":
+        return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    if response.mimetype == "text/csv":
+        return list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    body = response.json
+    if isinstance(body, dict):
+        return body.get("clans", body.get("matches", [body]))
+    return body
+
+
+@pytest.mark.parametrize("console", [False, True])
+def test_responses_do_not_contain_the_shadow_fields(client, console):
+    build_history(0, console=console, num_matches=10)
+    clan_obj, match_obj = (Clan, Match) if not console else (ConsoleClan, ConsoleMatch)
+    prefix = "" if not console else "/console"
+    oid = str(clan_obj.objects.first().id)
+    match_id = match_obj.objects.first().match_id
+    export = {"X-Export-Token": "export-token"}
+    responses = {
+        "clan": client.get(f"{prefix}/clan/{oid}"),
+        "match": client.get(f"{prefix}/match/{match_id}"),
+        "export csv": client.get(f"{prefix}/export/matches?format=csv", headers=export),
+        "export ndjson": client.get(f"{prefix}/export/matches", headers=export),
+    }
+    for path in ("clans", "matches"):
+        for query in ("", "?limit=5", "?limit=5&count=exact", "?limit=5&count=none", "?cursor=&limit=5",
+                      "?select=tag,name" if path == "clans" else "?select=match_id,map"):
+            responses[f"{path}{query}"] = client.get(f"{prefix}/{path}{query}")
+        responses[f"{path} ndjson"] = client.get(f"{prefix}/{path}", headers=NDJSON)
+
+    for name, response in responses.items():
+        docs = documents(response)
+        assert docs, name
+        assert [key for doc in docs for key in doc if key.endswith("_lower")] == [], name
+    # the other fields are still there
+    assert {"tag", "score", "num_matches"} <= documents(responses["clans"])[0].keys()
+    assert {"match_id", "map", "caps1"} <= documents(responses["match"])[0].keys()
+
+
+def baseline_json(queryset):
+    # QuerySet.to_json of mongoengine (json_util with LEGACY_JSON_OPTIONS), without the shadow fields
+    return QuerySet.to_json(exclude_shadow_fields(queryset), json_options=LEGACY_JSON_OPTIONS)
+
+
+def test_encoder_equals_json_util():
+    docs = [{"_id": ObjectId(), "name": "Ünïcode ☃ \"quoted\"", "date": datetime(2022, 3, 4, 5, 6, 7, 891234),
+             "score": Decimal128("1012.35"), "factor": 0.6, "num": 3, "none": None, "flag": True,
+             "ids": [ObjectId(), ObjectId()], "nested": {"date": datetime(2021, 1, 1), "list": [1.5, "a"]}}]
+    assert json.dumps(docs, cls=MongoJSONEncoder) == json_util.dumps(docs, json_options=LEGACY_JSON_OPTIONS)
+
+
+@pytest.mark.parametrize("console", [False, True])
+def test_to_json_equals_the_queryset_to_json(database, console):
+    build_history(1, console=console, num_matches=15)
+    objs = (Clan, Match, Score) if not console else (ConsoleClan, ConsoleMatch, ConsoleScore)
+    for obj in objs:
+        for queryset in (obj.objects.order_by("id"), obj.objects.order_by("-id").limit(4),
+                         obj.objects.only(*list(obj._fields)[1:3])):
+            assert queryset.to_json() == baseline_json(queryset)
+            assert "".join(stream_response(exclude_shadow_fields(queryset).as_pymongo(), ndjson=False,
+                                           batch_size=4).response) \
+                == baseline_json(queryset)
+
+
+@pytest.mark.parametrize("console", [False, True])
+def test_list_responses_equal_the_queryset_to_json(client, console):
+    build_history(2, console=console, num_matches=15)
+    clan_obj, match_obj, score_obj = (Clan, Match, Score) if not console else (ConsoleClan, ConsoleMatch, ConsoleScore)
+    prefix = "" if not console else "/console"
+    for path, obj, key in (("clans", clan_obj, "clans"), ("matches", match_obj, "matches"),
+                           ("scores", score_obj, "scores")):
+        expected = sorted(json.loads(baseline_json(obj.objects)), key=lambda doc: doc["_id"]["$oid"])
+        for query in ("", "?limit=100", "?limit=100&count=exact", "?cursor=&limit=100"):
+            response = client.get(f"{prefix}/{path}{query}")
+            assert response.status_code == 200, path + query
+            body = response.json
+            docs = body[key] if isinstance(body, dict) else body
+            assert sorted(docs, key=lambda doc: doc["_id"]["$oid"]) == expected, path + query
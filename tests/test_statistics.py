@@ -0,0 +1,170 @@
+"""
+The aggregations of the statistics endpoints against the count queries of the baseline
+"""
+
+import random
+from datetime import datetime
+
+import numpy as np
+import pytest
+from mongoengine.queryset.visitor import Q
+
+from conftest import build_history
+from logic.clan_stats import refresh_clan_stats
+from logic.data_state import data_changed
+from models.clan import Clan
+from models.match import Match
+from models.score import Score
+from models.console.console_clan import ConsoleClan
+from models.console.console_match import ConsoleMatch
+from models.console.console_score import ConsoleScore
+from rest.statistics import _count_result_types, _winrate_breakdown
+
+# spellings of the maps, compared case insensitive
+MAPS = ["Foy", "foy", "Carentan", "Hill 400"]
+FILTERS = [dict(), dict(map="foy"), dict(side="Axis"), dict(map="Carentan", side="Allies")]
+
+
+def varied_history(seed, console):
+    """A history with random maps and sides (some matches without sides) and an unconfirmed match.
+
+    Returns:
+        tuple: Match (or ConsoleMatch) and Clan (or ConsoleClan) class
+    """
+    rnd = random.Random(seed)
+    clan_obj, match_obj = (Clan, Match) if not console else (ConsoleClan, ConsoleMatch)
+    history = build_history(seed, console=console, num_clans=5, num_matches=40)
+    for match in history:
+        side1 = rnd.choice(["Axis", "Allies", None])
+        sides = {"side1": side1, "side2": {"Axis": "Allies", "Allies": "Axis"}.get(side1)}
+        match_obj._get_collection().update_one({"_id": match.id}, {"$set": {"map": rnd.choice(MAPS),
+                                                                        **{k: v for k, v in sides.items() if v}}})
+    # the statistics of the endpoints, as after an edit of the matches
+    refresh_clan_stats(match_ids=[match.match_id for match in history], console=console)
+    # not counted
+    unconfirmed = history[0]
+    match_obj(**{**{k: v for k, v in unconfirmed.to_mongo().to_dict().items() if k != "_id"},
+                 "match_id": "unconfirmed", "score_posted": False}).save()
+    return match_obj, clan_obj
+
+
+def statistics_filter(clan_id, map=None, side=None):
+    # the filter of the statistics endpoints
+    filter = Q(score_posted=True)
+    if map: filter &= Q(map__iexact=map)
+    if side: filter &= (Q(clans1_ids=clan_id) & Q(side1__iexact=side)) | (Q(clans2_ids=clan_id) & Q(side2__iexact=side))
+    return filter
+
+
+def counts_per_result(match_obj, clan_id, filter):
+    # the baseline, one count per result
+    return {caps: match_obj.objects(((Q(clans1_ids=clan_id) & Q(caps1=caps))
+                                     | (Q(clans2_ids=clan_id) & Q(caps2=caps))) & filter).count()
+            for caps in range(6)}
+
+
+@pytest.mark.parametrize("console", [False, True])
+@pytest.mark.parametrize("filters", FILTERS)
+def test_result_types_equal_the_counts_per_result(database, console, filters):
+    match_obj, clan_obj = varied_history(0, console)
+    for clan in clan_obj.objects:
+        clan_id = str(clan.id)
+        filter = statistics_filter(clan_id, **filters)
+        expected = counts_per_result(match_obj, clan_id, filter)
+        caps = _count_result_types(match_obj, clan_id, filter)
+        assert {c: caps.get(c, 0) for c in range(6)} == expected
+        assert set(caps) <= set(range(6))
+
+
+def test_result_types_endpoint(client):
+    match_obj, clan_obj = varied_history(1, console=False)
+    for clan in clan_obj.objects:
+        for filters in FILTERS:
+            response = client.get(f"/statistics/result_types/{clan.id}", query_string=filters)
+            assert response.status_code == 200
+            caps = counts_per_result(match_obj, str(clan.id), statistics_filter(str(clan.id), **filters))
+            assert [response.json[result]["count"] for result in ("5-0", "4-1", "3-2", "2-3", "1-4", "0-5")] \
+                == [caps[c] for c in (5, 4, 3, 2, 1, 0)]
+
+
+def winrate_counts(match_obj, clan_id, map=None, side=None):
+    # the baseline, the count queries of WinrateApi
+    filter = statistics_filter(clan_id, map=map, side=side)
+    total = match_obj.objects((Q(clans1_ids=clan_id) | Q(clans2_ids=clan_id)) & filter).count()
+    wins = match_obj.objects(((Q(clans1_ids=clan_id) & Q(caps1__gte=3)) | (Q(clans2_ids=clan_id) & Q(caps2__gte=3)))
+                             & filter).count()
+    return {"total": total, "wins": wins, "winrate": round(wins / total, 3) if total else 0}
+
+
+@pytest.mark.parametrize("console", [False, True])
+def test_winrate_breakdown_equals_the_winrate_counts(client, console):
+    match_obj, clan_obj = varied_history(2, console)
+    prefix = "" if not console else "/console"
+    for clan in clan_obj.objects:
+        clan_id = str(clan.id)
+        response = client.get(f"{prefix}/statistics/winrate/{clan_id}/breakdown")
+        assert response.status_code == 200
+        breakdown = response.json
+        assert breakdown == _winrate_breakdown(match_obj, clan_id)
+
+        assert breakdown["total"] == winrate_counts(match_obj, clan_id)
+        # every map once, whatever its spelling
+        played = {m.lower() for m in match_obj.objects((Q(clans1_ids=clan_id) | Q(clans2_ids=clan_id))
+                                                       & Q(score_posted=True)).scalar("map")}
+        assert {m.lower() for m in breakdown["maps"]} == played
+        for map, winrate in breakdown["maps"].items():
+            assert winrate == winrate_counts(match_obj, clan_id, map=map)
+        for side in ("Axis", "Allies"):
+            assert breakdown["sides"].get(side, {"total": 0, "wins": 0, "winrate": 0}) \
+                == winrate_counts(match_obj, clan_id, side=side)
+            for map in breakdown["maps"]:
+                assert breakdown["maps_sides"].get(map, {}).get(side, {"total": 0, "wins": 0, "winrate": 0}) \
+                    == winrate_counts(match_obj, clan_id, map=map, side=side)
+
+
+def per_match_rating(match_obj, score_obj, clan_id, last=None, since=None):
+    # the loop of the baseline over the clan's matches, with the opponents' Score objects of
+    # every match instead of their current scores, matches without them are not rated
+    filter = (Q(clans1_ids=clan_id) | Q(clans2_ids=clan_id)) & Q(score_posted=True)
+    if since is not None: filter &= Q(date__gte=since)
+    matches = list(match_obj.objects(filter).order_by("-date"))
+    if last: matches = matches[:last]
+    total, wins, strengths = 0, 0, 0
+    for match in matches:
+        side1 = clan_id in match.clans1_ids
+        opponents = match.clans2_ids if side1 else match.clans1_ids
+        scores = [float(doc["score"]) for doc in score_obj.objects(match_id=match.match_id, clan__in=opponents)
+                  .as_pymongo()]
+        if not scores:
+            continue
+        total += 1
+        wins += (match.caps1 if side1 else match.caps2) >= 3
+        strengths += np.average(scores)
+    if total == 0:
+        return {"pr": 0, "total": 0}
+    return {"pr": round((strengths + 400 * (wins - (total - wins))) / total, 2), "total": total}
+
+
+@pytest.mark.parametrize("console", [False, True])
+def test_performance_rating_equals_the_per_match_rating(client, console):
+    match_obj, clan_obj = varied_history(3, console)
+    score_obj = Score if not console else ConsoleScore
+    prefix = "" if not console else "/console"
+    # a match that cannot be rated, without the Score objects of one side
+    match = match_obj.objects(score_posted=True).order_by("date")[5]
+    score_obj.objects(match_id=match.match_id, clan__in=match.clans2_ids).delete()
+    refresh_clan_stats(match_ids=[match.match_id], console=console)
+    # a clan without matches
+    clan_obj(tag="new").save()
+    data_changed("clans", console=console)
+
+    since = match_obj.objects.order_by("date")[20].date.date()
+    for clan in clan_obj.objects:
+        clan_id = str(clan.id)
+        for query in (dict(), dict(last=5), dict(since=since.isoformat()), dict(last=3, since=since.isoformat())):
+            response = client.get(f"{prefix}/statistics/pr/{clan_id}", query_string=query)
+            assert response.status_code == 200
+            expected = per_match_rating(match_obj, score_obj, clan_id, last=query.get("last"),
+                                        since=datetime.combine(since, datetime.min.time()) if "since" in query else None)
+            assert response.json["total"] == expected["total"], query
+            assert response.json["pr"] == pytest.approx(expected["pr"], abs=0.011), query
@@ -0,0 +1,32 @@
+"""
+Streamed listings
+"""
+
+import json
+
+import pytest
+
+from rest._common import stream_response
+
+
+def documents(num, fail_at=None):
+    for i in range(num):
+        if i == fail_at:
+            raise RuntimeError("cursor failed")
+        yield {"i": i}
+
+
+@pytest.mark.parametrize("num", [0, 3, 4, 5, 9])
+def test_streamed_listing_has_the_bytes_of_a_response(num):
+    response = stream_response(documents(num), key="docs", meta=lambda n: {"count": n}, batch_size=4, ndjson=False)
+    # a single batch is not streamed
+    assert response.is_streamed == (num >= 4)
+    assert json.loads(response.get_data()) == {"docs": [{"i": i} for i in range(num)], "meta": {"count": num}}
+    ndjson = stream_response(documents(num), batch_size=4, ndjson=True).get_data(as_text=True)
+    assert [json.loads(line) for line in ndjson.splitlines()] == [{"i": i} for i in range(num)]
+
+
+def test_failing_query_is_raised_before_the_response():
+    # the resources turn the error into an error response, not a 200 with truncated JSON
+    with pytest.raises(RuntimeError):
+        stream_response(documents(9, fail_at=2), batch_size=4, ndjson=False)